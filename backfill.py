@@ -0,0 +1,298 @@
+"""
+Bulk import of historical readings into the smart meter hypertable.
+
+Loads DSMR P1 telegram logs (the raw telegrams of a P1 reader, one after another) and CSV dumps,
+optionally gzip-compressed, e.g. after a gateway was offline or when migrating from another system.
+Files are read in blocks cut at telegram (or line) boundaries; the blocks are parsed into ``Message``
+rows by a process pool and each one is merged into the table in its own transaction, through a COPY
+into a staging table. Only a few blocks are in flight at once, so memory stays constant whatever
+the size of the files.
+
+Rows that already exist (same timestamp and device) are skipped, so an interrupted import can simply
+be run again; ``--on-conflict update`` overwrites them instead, keeping the stored values the import
+lacks. The rollups of the imported range are refreshed at the end.
+
+CSV files need a header. The time column is 'timestamp_utc' (or 'time_stamp'), the device column
+'device_id' (or 'mac_address'); the other columns are matched to the stored fields by their column
+name or their gateway REST name (e.g. 'PowerDelivered_l1'). Naive timestamps are taken as UTC.
+Quoted fields spanning several lines are not supported.
+
+Live readings are stored under the device id of their MQTT topic (its {device} level, or 'default').
+Telegrams only carry the meter's equipment id, and REST dumps the gateway's MAC address, so their
+rows would never match the live ones and would be stored twice under another device. Importing
+them into a table that already holds readings therefore requires ``--device``, the live device id
+of the meter. CSV dumps with a 'device_id' column, such as exports of this table, keep their ids.
+
+    python backfill.py logs/p1-2024-*.log.gz --device meter-1
+    python backfill.py dump.csv --on-conflict update
+    python backfill.py logs/*.log --dry-run --workers 8
+"""
+
+import argparse
+import csv
+import gzip
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import monotonic
+from typing import Iterator, Optional, TextIO
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.db import DBConnection, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_TABLE, DB_CONTINUOUS_AGGREGATES
+from src.dsmr import iter_telegrams, parse_telegram, verify_telegram
+from src.mssg import Message, FIELD_SLOTS, READING_TO_MESSAGE, DEFAULT_DEVICE
+from src.parser import parse_datetime
+from src.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FORMATS = ("auto", "telegram", "csv")
+TIME_COLUMNS = ("timestamp_utc", "time_stamp")
+DEVICE_COLUMNS = ("device_id", "mac_address")
+# CSV columns: stored field names and gateway REST names
+CSV_SLOTS = {**FIELD_SLOTS, **{reading: FIELD_SLOTS[name] for name, reading in READING_TO_MESSAGE.items()}}
+
+
+def detect_format(path: Path) -> str:
+    return "csv" if ".csv" in path.suffixes else "telegram"
+
+
+def open_text(path: Path) -> TextIO:
+    """Open a file as text, keeping the original line endings (needed for the telegram checksums)."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="ascii", errors="replace", newline="")
+    return open(path, encoding="ascii", errors="replace", newline="")
+
+
+def read_blocks(file: TextIO, file_format: str, block_size: int) -> Iterator[str]:
+    """Read ``block_size`` characters at a time, cut after the last complete telegram (or line)."""
+    separator = "\n/" if file_format == "telegram" else "\n"
+    carry = ""
+    while True:
+        data = file.read(block_size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        data = carry + data
+        cut = data.rfind(separator)
+        if cut < 0:
+            carry = data
+            continue
+        yield data[: cut + 1]
+        carry = data[cut + 1 :]
+
+
+def encode_row(message: Message) -> str:
+    """One row in COPY text format, in ``Message.COLUMNS`` order."""
+    timestamp, device_id, *values = message.as_row()
+    device_id = device_id.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    return "\t".join((timestamp.isoformat(), device_id, *("\\N" if value is None else repr(value) for value in values)))
+
+
+def parse_block(
+    file_format: str,
+    block: str,
+    header: Optional[list[str]] = None,
+    device_id: Optional[str] = None,
+    verify_crc: bool = False,
+) -> tuple[bytes, int, int, Optional[datetime], Optional[datetime]]:
+    """Parse a block of telegrams or CSV lines in a worker process.
+
+    Returns the rows in COPY text format, the number of rows and of rejected records, and the time
+    range of the rows.
+    """
+    if file_format == "telegram":
+        messages, rejected = _parse_telegrams(block, device_id, verify_crc)
+    else:
+        messages, rejected = _parse_csv(block, header, device_id)
+
+    if not messages:
+        return b"", 0, rejected, None, None
+    data = "\n".join(encode_row(message) for message in messages) + "\n"
+    timestamps = [message.timestamp_utc for message in messages]
+    return data.encode(), len(messages), rejected, min(timestamps), max(timestamps)
+
+
+def _parse_telegrams(block: str, device_id: Optional[str], verify_crc: bool) -> tuple[list[Message], int]:
+    messages = []
+    rejected = 0
+    for telegram in iter_telegrams(block.splitlines(keepends=True)):
+        if verify_crc and not verify_telegram(telegram):
+            rejected += 1
+            continue
+        try:
+            message = parse_telegram(telegram, device_id)
+        except ValueError:
+            message = None
+        if message is None:
+            rejected += 1
+        else:
+            messages.append(message)
+    return messages, rejected
+
+
+def _parse_csv(block: str, header: list[str], device_id: Optional[str]) -> tuple[list[Message], int]:
+    time_index = next(index for index, name in enumerate(header) if name in TIME_COLUMNS)
+    device_index = next((index for index, name in enumerate(header) if name in DEVICE_COLUMNS), None)
+    slots = [(index, CSV_SLOTS[name]) for index, name in enumerate(header) if name in CSV_SLOTS]
+
+    messages = []
+    rejected = 0
+    for record in csv.reader(block.splitlines()):
+        if not record:
+            continue
+        try:
+            timestamp = parse_datetime(record[time_index])
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            device = device_id or (record[device_index] if device_index is not None else None) or DEFAULT_DEVICE
+            message = Message(timestamp, device)
+            for index, slot in slots:
+                value = record[index]
+                if value:
+                    message.set_field(slot, value)
+        except (ValueError, IndexError, OverflowError):
+            rejected += 1
+            continue
+        messages.append(message)
+    return messages, rejected
+
+
+def has_live_device_ids(path: Path, file_format: str) -> bool:
+    """Check if the rows of a file get the device ids of the live readings, without ``--device``."""
+    if file_format == "telegram":
+        return False  # The meter's equipment id
+    with open_text(path) as file:
+        header = read_header(file)
+    return "device_id" in header or "mac_address" not in header
+
+
+def read_header(file: TextIO) -> list[str]:
+    header = next(csv.reader([file.readline()]))
+    header = [name.strip() for name in header]
+    if not any(name in TIME_COLUMNS for name in header):
+        raise ValueError(f"The CSV header has no time column ({' or '.join(TIME_COLUMNS)}).")
+    unknown = [name for name in header if name not in CSV_SLOTS and name not in TIME_COLUMNS + DEVICE_COLUMNS]
+    if unknown:
+        logger.warning(f"Ignoring the CSV columns {unknown}.")
+    return header
+
+
+class Backfill:
+    """Feeds file blocks to a process pool and merges the parsed rows into the database."""
+
+    def __init__(
+        self,
+        db: Optional[DBConnection],
+        workers: int = os.cpu_count() or 1,
+        block_size: int = 4 * 1024 * 1024,  # characters
+        update: bool = False,
+        device_id: Optional[str] = None,
+        verify_crc: bool = False,
+    ):
+        self.db = db
+        self.workers = workers
+        self.block_size = block_size
+        self.update = update
+        self.device_id = device_id
+        self.verify_crc = verify_crc
+        self.stats = {"rows": 0, "merged": 0, "rejected": 0, "blocks": 0}
+        self.start: Optional[datetime] = None
+        self.end: Optional[datetime] = None
+        self._started = monotonic()
+        self._reported = self._started
+
+    def run(self, paths: list[Path], file_format: str = "auto"):
+        # Bounded number of blocks in flight: parsing runs ahead of the database by a few blocks only
+        pending: deque[Future] = deque()
+        with ProcessPoolExecutor(self.workers) as pool:
+            for path in paths:
+                path_format = detect_format(path) if file_format == "auto" else file_format
+                logger.info(f"Importing '{path}' as {path_format}...")
+                with open_text(path) as file:
+                    header = read_header(file) if path_format == "csv" else None
+                    for block in read_blocks(file, path_format, self.block_size):
+                        pending.append(
+                            pool.submit(parse_block, path_format, block, header, self.device_id, self.verify_crc)
+                        )
+                        if len(pending) >= 2 * self.workers:
+                            self._load(pending.popleft().result())
+            while pending:
+                self._load(pending.popleft().result())
+        self._report()
+
+    def _load(self, result: tuple):
+        data, rows, rejected, start, end = result
+        if rows and self.db is not None:
+            self.stats["merged"] += self.db.merge_copy(data, update=self.update)
+        self.stats["rows"] += rows
+        self.stats["rejected"] += rejected
+        self.stats["blocks"] += 1
+        if start is not None:
+            self.start = start if self.start is None else min(self.start, start)
+            self.end = end if self.end is None else max(self.end, end)
+        if monotonic() - self._reported >= 10:
+            self._report()
+
+    def _report(self):
+        self._reported = monotonic()
+        elapsed = self._reported - self._started
+        rate = self.stats["rows"] / elapsed if elapsed else 0.0
+        logger.info(f"Backfill stats: {self.stats}, {rate:,.0f} rows/s ({rate * 60:,.0f} rows/min)")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Import DSMR telegram logs or CSV dumps into the smart meter table.")
+    arg_parser.add_argument("paths", nargs="+", type=Path, help="Telegram logs or CSV files, optionally .gz")
+    arg_parser.add_argument("--format", choices=FORMATS, default="auto", help="Defaults to csv for *.csv files.")
+    arg_parser.add_argument(
+        "--device",
+        help="Live device id of the meter, for all rows. Defaults to the meter id (or the CSV device column); "
+        "required for telegram logs and MAC-keyed dumps if the table already holds readings.",
+    )
+    arg_parser.add_argument("--on-conflict", choices=["skip", "update"], default="skip")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parser processes.")
+    arg_parser.add_argument("--block-size", type=int, default=4, help="MB of text per parsed and merged block.")
+    arg_parser.add_argument("--verify-crc", action="store_true", help="Skip telegrams with a wrong checksum.")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Parse only, without writing to the database.")
+    args = arg_parser.parse_args()
+
+    db = None
+    if not args.dry_run:
+        db = DBConnection(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_TABLE, max_size=1)
+        db.prepare_schema(Message, continuous_aggregates=DB_CONTINUOUS_AGGREGATES)
+        if args.device is None and db.has_rows():
+            foreign = [
+                str(path)
+                for path in args.paths
+                if not has_live_device_ids(path, detect_format(path) if args.format == "auto" else args.format)
+            ]
+            if foreign:
+                db.close()
+                arg_parser.error(
+                    f"The table already holds readings, but {foreign} identify the meter by its equipment id "
+                    "or MAC address: pass --device with its live device id, or the rows are stored twice."
+                )
+
+    backfill = Backfill(
+        db,
+        workers=args.workers,
+        block_size=args.block_size * 1024 * 1024,
+        update=args.on_conflict == "update",
+        device_id=args.device,
+        verify_crc=args.verify_crc,
+    )
+    try:
+        backfill.run(args.paths, args.format)
+        if db is not None and DB_CONTINUOUS_AGGREGATES and backfill.start is not None:
+            # Only whole buckets inside the window are refreshed: widen it to the enclosing days
+            db.refresh_continuous_aggregates(backfill.start - timedelta(days=1), backfill.end + timedelta(days=1))
+    finally:
+        if db is not None:
+            db.close()
+    logger.info(f"Backfill finished: {backfill.stats}, from {backfill.start} to {backfill.end}.")
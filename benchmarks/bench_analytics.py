@@ -0,0 +1,106 @@
+"""
+Throughput benchmark of the streaming anomaly detector (src/analytics.py).
+
+Synthetic complete readings are generated for a number of devices: phase voltages around 230 V and
+phase powers fluctuating around a per-device load, with voltage sags and power spikes injected at
+random readings. They are fed either straight into ``AnomalyDetector.process_batch`` or through
+its queue and worker thread (``submit``), as the ingesters do.
+
+Reported: readings/s and microseconds per reading, the events detected by kind, the share of the
+injected sags and spikes that were detected, and the memory of the per-device state.
+
+Run from the repository root:
+    python -m benchmarks.bench_analytics --devices 1000 --readings 200
+    python -m benchmarks.bench_analytics --mode worker
+    python -m benchmarks.bench_analytics --batch-size 1
+"""
+
+import argparse
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from src.analytics import AnomalyDetector
+from src.mssg import Message
+from src.schema import REQUIRED_FIELDS
+
+
+def readings(devices: int, per_device: int, anomaly_rate: float, seed: int = 0):
+    """Return the complete messages, interleaved by device, and the set of injected (device, reading, kind)."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    loads = [rng.uniform(0.2, 1.5) for _ in range(devices)]
+    messages = []
+    injected = set()
+    for index in range(per_device):
+        timestamp = start + timedelta(seconds=index)
+        for device in range(devices):
+            values = {name: 0.0 for name in REQUIRED_FIELDS}
+            for phase in (1, 2, 3):
+                values[f"phase_voltage_l{phase}"] = rng.gauss(230.0, 1.5)
+                values[f"phase_currently_delivered_l{phase}"] = max(0.0, rng.gauss(loads[device], 0.05))
+            # Anomalies after the detector's warmup, with a pause of a few readings so each one is a new event
+            if index >= 20 and index % 5 == 0 and rng.random() < anomaly_rate:
+                phase = rng.randint(1, 3)
+                if rng.random() < 0.5:
+                    values[f"phase_voltage_l{phase}"] = rng.uniform(180.0, 200.0)
+                    injected.add((f"meter-{device}", index, "voltage_sag"))
+                else:
+                    values[f"phase_currently_delivered_l{phase}"] += rng.uniform(2.0, 4.0)
+                    injected.add((f"meter-{device}", index, "power_spike"))
+            messages.append(Message(timestamp, f"meter-{device}", **values))
+    return messages, injected
+
+
+def run(args) -> dict:
+    messages, injected = readings(args.devices, args.readings, args.anomaly_rate)
+    events = []
+    detector = AnomalyDetector(on_events=events.extend, window=args.window, queue_size=len(messages))
+
+    started = perf_counter()
+    if args.mode == "direct":
+        for start in range(0, len(messages), args.batch_size):
+            events.extend(detector.process_batch(messages[start : start + args.batch_size]))
+    else:
+        detector.start()
+        for message in messages:
+            detector.submit(message)
+        detector.stop()
+    elapsed = perf_counter() - started
+
+    start = messages[0].timestamp_utc
+    detected = {(event.device_id, int((event.timestamp_utc - start).total_seconds()), event.kind) for event in events}
+    state_bytes = sum(
+        getattr(detector, name).nbytes
+        for name in ("_buffer", "_sum", "_sum_sq", "_ewma", "_count", "_position", "_active")
+    )
+    return {
+        "readings": len(messages),
+        "readings_per_s": len(messages) / elapsed,
+        "us_per_reading": elapsed / len(messages) * 1e6,
+        "events": Counter(event.kind for event in events),
+        "recall": len(injected & detected) / len(injected) if injected else 1.0,
+        "bytes_per_device": state_bytes / len(detector._count),
+        "stats": detector.stats(),
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the streaming anomaly detector.")
+    arg_parser.add_argument("--devices", type=int, default=1_000)
+    arg_parser.add_argument("--readings", type=int, default=100, help="Readings per device.")
+    arg_parser.add_argument("--window", type=int, default=60, help="Rolling window in readings.")
+    arg_parser.add_argument("--anomaly-rate", type=float, default=0.05, help="Probability of an anomaly every 5 readings.")
+    arg_parser.add_argument("--mode", choices=["direct", "worker"], default="direct")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="Readings per process_batch call (direct).")
+    args = arg_parser.parse_args()
+
+    results = run(args)
+    print(f"mode={args.mode} devices={args.devices} readings/device={args.readings} window={args.window} "
+          f"batch={args.batch_size if args.mode == 'direct' else 'worker'}")
+    print(f"  processed: {results['readings']} readings, {results['readings_per_s']:,.0f} readings/s, "
+          f"{results['us_per_reading']:.1f} us/reading")
+    print(f"  events:    {dict(results['events'])}")
+    print(f"  recall:    {results['recall']:.1%} of the injected sags and spikes detected")
+    print(f"  memory:    {results['bytes_per_device']:,.0f} B of state per device")
+    print(f"  detector:  {results['stats']}")
@@ -0,0 +1,251 @@
+"""
+End-to-end ingestion benchmark of MQTTHandler: topic routing, message assembly, batch writer and database.
+
+Synthetic DSMR telegrams (one MQTT payload per field, like the gateway publishes them) are generated
+for a number of devices, at a given rate, with the field order shuffled and optionally some fields
+missing ("jitter"). They are replayed either directly into ``MQTTHandler.on_message`` or through a
+local MQTT broker, and stored in an in-memory stub database or in the Postgres of the .env file.
+
+Reported: payloads/s fed, messages/s committed, p50/p99 latency from the first field of a telegram
+to its commit, and the memory held per device while its message is being assembled.
+
+Run from the repository root:
+    python -m benchmarks.bench_ingest --devices 100 --telegrams 100
+    python -m benchmarks.bench_ingest --mode broker --broker localhost:1883 --rate 1
+    python -m benchmarks.bench_ingest --db postgres
+"""
+
+import argparse
+import gc
+import random
+import resource
+import statistics
+import threading
+import tracemalloc
+from time import monotonic, sleep
+from types import SimpleNamespace
+from src.schema import REQUIRED_FIELDS
+
+TOPICS = [("bench/{device}/reading/#", 0), ("bench/{device}/consumption/gas/#", 0)]
+SEQUENCE_FIELD = "electricity_delivered_1"  # Carries the telegram number, to match commits to sends
+
+
+class RecordingDB:
+    """Wraps a ``DBConnection`` (or stands in for one when ``db`` is None) and records commit times."""
+
+    def __init__(self, db=None):
+        self.db = db
+        self.sent: dict[tuple[str, int], float] = {}  # (device, telegram) -> first field published
+        self.latencies: list[float] = []
+        self.committed = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.db is None:
+            return lambda *args, **kwargs: None  # Schema checks, close, ...
+        return getattr(self.db, name)
+
+    def get_pool_stats(self) -> dict:
+        return self.db.get_pool_stats() if self.db is not None else {}
+
+    def save_messages(self, messages: list):
+        if self.db is not None:
+            self.db.save_messages(messages)
+        committed = monotonic()
+        with self._lock:
+            for message in messages:
+                sequence = message.electricity_delivered_1
+                sent = self.sent.pop((message.device_id, int(sequence)), None) if sequence is not None else None
+                if sent is not None:
+                    self.latencies.append(committed - sent)
+            self.committed += len(messages)
+
+
+def field_topic(device_id: str, name: str) -> str:
+    if name == "delivered":
+        return f"bench/{device_id}/consumption/gas/{name}"
+    return f"bench/{device_id}/reading/{name}"
+
+
+def telegrams(devices: int, count: int, rate: float, jitter: float, seed: int = 0):
+    """Yield (due time, device, telegram number, [(topic, payload), ...]) in send order.
+
+    Every device sends ``count`` telegrams at ``rate`` telegrams per second (0: as fast as
+    possible), phase shifted so that the devices do not publish in lockstep. With ``jitter`` > 0
+    each field is left out with that probability, producing partial messages.
+    """
+    rng = random.Random(seed)
+    device_ids = [f"meter{i:05d}" for i in range(devices)]
+    topics = {device_id: [(name, field_topic(device_id, name)) for name in REQUIRED_FIELDS] for device_id in device_ids}
+    period = 1 / rate if rate > 0 else 0.0
+    for sequence in range(count):
+        for index, device_id in enumerate(device_ids):
+            fields = topics[device_id][:]
+            rng.shuffle(fields)
+            payloads = [
+                (topic, str(sequence) if name == SEQUENCE_FIELD else f"{rng.uniform(0, 250):.3f}")
+                for name, topic in fields
+                if name == SEQUENCE_FIELD or rng.random() >= jitter
+            ]
+            yield sequence * period + index * period / devices, device_id, sequence, payloads
+
+
+def feed_direct(handler, db: RecordingDB, stream) -> tuple[int, float]:
+    """Call on_message for every payload, pacing to the due times. Returns (payloads, seconds)."""
+    payloads = 0
+    start = monotonic()
+    for due, device_id, sequence, fields in stream:
+        delay = start + due - monotonic()
+        if delay > 0:
+            sleep(delay)
+        db.sent[(device_id, sequence)] = monotonic()
+        for topic, payload in fields:
+            handler.on_message(None, None, SimpleNamespace(topic=topic, payload=payload.encode()))
+        payloads += len(fields)
+    return payloads, monotonic() - start
+
+
+def feed_broker(publisher, db: RecordingDB, stream, qos: int) -> tuple[int, float]:
+    """Publish every payload to the broker, pacing to the due times. Returns (payloads, seconds)."""
+    payloads = 0
+    start = monotonic()
+    for due, device_id, sequence, fields in stream:
+        delay = start + due - monotonic()
+        if delay > 0:
+            sleep(delay)
+        db.sent[(device_id, sequence)] = monotonic()
+        for topic, payload in fields:
+            publisher.publish(topic, payload, qos=qos)
+        payloads += len(fields)
+    return payloads, monotonic() - start
+
+
+def wait_committed(db: RecordingDB, expected: int, idle: float):
+    """Wait until every telegram was committed, or nothing was committed for ``idle`` seconds.
+
+    Telegrams with missing fields merge into the device's next telegram, so with jitter fewer
+    messages than telegrams are committed.
+    """
+    committed, last_progress = db.committed, monotonic()
+    while db.committed < expected and monotonic() - last_progress < idle:
+        sleep(0.05)
+        if db.committed != committed:
+            committed, last_progress = db.committed, monotonic()
+
+
+def assembly_memory_per_device(devices: int) -> float:
+    """Bytes held by the assembler per device with a message missing one field."""
+    from main import MQTTHandler
+
+    handler = MQTTHandler("localhost", 1883, "", "", TOPICS, db_handler=RecordingDB(), timeout=3600)
+    fields = [(name, field_topic("{}", name)) for name in REQUIRED_FIELDS[:-1]]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(devices):
+        device_id = f"meter{i:05d}"
+        for _, topic in fields:
+            handler.on_message(None, None, SimpleNamespace(topic=topic.format(device_id), payload=b"1.0"))
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    handler.scheduler.stop()
+    return allocated / devices
+
+
+def run(args) -> dict:
+    from main import MQTTHandler, DB_CONFIG
+
+    db = RecordingDB()
+    if args.db == "postgres":
+        from src.db import DBConnection
+
+        db = RecordingDB(DBConnection(**DB_CONFIG))
+
+    handler = MQTTHandler(
+        "localhost",
+        1883,
+        "",
+        "",
+        TOPICS,
+        db_handler=db,
+        timeout=args.timeout,
+        batch_size=args.batch_size,
+        batch_max_age=args.batch_max_age,
+        queue_overflow="block",
+        max_devices=max(args.devices, 1_000),
+        # No client id: a clean session under an id assigned by the broker, so a run neither takes over
+        # the ingester's session (MQTT_CLIENT_ID) nor leaves a persistent one queueing readings behind
+        client_id="",
+    )
+    stream = telegrams(args.devices, args.telegrams, args.rate, args.jitter)
+    expected = args.devices * args.telegrams
+
+    if args.mode == "direct":
+        handler.prepare_schema()  # Run by start() in the background otherwise; the writer waits for it
+        handler.writer.start()
+        handler.scheduler.start()
+        payloads, elapsed = feed_direct(handler, db, stream)
+        wait_committed(db, expected, args.timeout + args.batch_max_age + 1)
+        handler.scheduler.stop()
+        handler.writer.stop()
+    else:
+        import paho.mqtt.client as mqtt
+
+        host, _, port = args.broker.partition(":")
+        handler.broker, handler.port = host, int(port or 1883)
+        consumer = threading.Thread(target=handler.start, daemon=True)
+        consumer.start()
+        sleep(1)  # Let the handler connect and subscribe
+
+        publisher = mqtt.Client()
+        publisher.connect(host, int(port or 1883))
+        publisher.loop_start()
+        payloads, elapsed = feed_broker(publisher, db, stream, args.qos)
+        wait_committed(db, expected, args.timeout + args.batch_max_age + 5)
+        publisher.loop_stop()
+        publisher.disconnect()
+        handler.stop_event.set()
+        handler.mqtt_client.disconnect()
+        consumer.join(10)
+
+    if not db.committed:
+        raise RuntimeError(f"None of the {expected} messages was committed. Writer stats: {handler.writer.stats()}")
+    latencies = sorted(db.latencies)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return {
+        "payloads": payloads,
+        "payloads_per_s": payloads / elapsed if elapsed else float("inf"),
+        "committed": db.committed,
+        "committed_per_s": db.committed / elapsed if elapsed else float("inf"),
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+        "writer": handler.writer.stats(),
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the MQTT ingestion pipeline.")
+    arg_parser.add_argument("--devices", type=int, default=100)
+    arg_parser.add_argument("--telegrams", type=int, default=100, help="Telegrams per device.")
+    arg_parser.add_argument("--rate", type=float, default=0, help="Telegrams/s per device, 0 = unpaced.")
+    arg_parser.add_argument("--jitter", type=float, default=0.0, help="Probability that a field is missing.")
+    arg_parser.add_argument("--mode", choices=["direct", "broker"], default="direct")
+    arg_parser.add_argument("--broker", default="localhost:1883")
+    arg_parser.add_argument("--qos", type=int, default=0)
+    arg_parser.add_argument("--db", choices=["stub", "postgres"], default="stub")
+    arg_parser.add_argument("--timeout", type=float, default=1.0, help="Assembly timeout in seconds.")
+    arg_parser.add_argument("--batch-size", type=int, default=500)
+    arg_parser.add_argument("--batch-max-age", type=float, default=0.2)
+    args = arg_parser.parse_args()
+
+    results = run(args)
+    print(f"mode={args.mode} db={args.db} devices={args.devices} telegrams/device={args.telegrams} "
+          f"rate={args.rate or 'unpaced'} jitter={args.jitter}")
+    print(f"  fed:       {results['payloads']} payloads, {results['payloads_per_s']:,.0f} payloads/s")
+    print(f"  committed: {results['committed']} messages, {results['committed_per_s']:,.0f} messages/s")
+    print(f"  latency:   p50 {results['p50_ms']:.1f} ms, p99 {results['p99_ms']:.1f} ms (first field -> commit)")
+    print(f"  writer:    {results['writer']}")
+    print(f"  memory:    {assembly_memory_per_device(args.devices):,.0f} B/device being assembled, "
+          f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.1f} MB")
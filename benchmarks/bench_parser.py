@@ -0,0 +1,96 @@
+"""
+Benchmark of the REST-API Reading parsing.
+
+Compares the original path (filter the JSON keys with a freshly built field set, then convert
+every field in ``Reading.__post_init__`` with a rebuilt converter map and dateutil) against the
+parser compiled once per dataclass, for single payloads and for a columnar batch.
+
+Run from the repository root:
+    python -m benchmarks.bench_parser
+"""
+
+from dataclasses import fields, make_dataclass
+from datetime import datetime
+from time import perf_counter_ns
+from src.mssg import Reading
+from src.parser import compile_parser
+
+N_PAYLOADS = 20_000
+
+PAYLOAD = {
+    "mac_address": "AA:BB:CC:DD:EE:FF",
+    "gateway_model": "smart-gateways",
+    "startup_time": "2025-06-22T13:00:00",
+    "firmware_running": "5.10",
+    "firmware_available": "5.10",
+    "firmware_update_available": "false",
+    "wifi_rssi": "-62",
+    "mqtt_configured": "true",
+    "mqtt_server": "192.168.2.64",
+    "Equipment_Id": "4530303433303036393938",
+    "GasEquipment_Id": "4730303732303033393634",
+    "ElectricityTariff": "2",
+    "gas_reading_time": "250622130000S",  # Not a Reading field
+    **{
+        field.name: "1234.567"
+        for field in fields(Reading)
+        if field.type is float
+    },
+}
+
+
+def _legacy_post_init(self):
+    from dateutil import parser
+
+    type_conversion = {
+        float: float,
+        int: int,
+        bool: lambda x: x.lower() == "true",
+        datetime: lambda x: parser.parse(x) if isinstance(x, str) else x,
+    }
+    for field in fields(self):
+        value = getattr(self, field.name)
+        if not isinstance(value, field.type):
+            setattr(self, field.name, type_conversion.get(field.type)(value))
+
+
+LegacyReading = make_dataclass(
+    "LegacyReading",
+    [(field.name, field.type, field) for field in fields(Reading)],
+    namespace={"__post_init__": _legacy_post_init},
+)
+
+
+def legacy(payloads: list[dict]) -> int:
+    """filter_json_data + Reading(**data) as before the compiled parser."""
+    for json_data in payloads:
+        names = {field.name for field in fields(LegacyReading)}
+        LegacyReading(**{key: value for key, value in json_data.items() if key in names})
+    return len(payloads)
+
+
+def compiled(payloads: list[dict]) -> int:
+    parser = compile_parser(Reading)
+    for json_data in payloads:
+        parser.parse(json_data)
+    return len(payloads)
+
+
+def compiled_batch(payloads: list[dict]) -> int:
+    columns = compile_parser(Reading).parse_batch(payloads)
+    return len(columns["PowerDelivered_total"])
+
+
+def bench(func, payloads: list[dict]) -> float:
+    start = perf_counter_ns()
+    parsed = func(payloads)
+    per_payload = (perf_counter_ns() - start) / parsed
+    print(f"{func.__name__:>14}: {per_payload / 1000:8.1f} us/payload")
+    return per_payload
+
+
+if __name__ == "__main__":
+    payloads = [dict(PAYLOAD) for _ in range(N_PAYLOADS)]
+    baseline = bench(legacy, payloads)
+    for func in (compiled, compiled_batch):
+        print(f"{'':>14}  speed-up {baseline / bench(func, payloads):.1f}x")
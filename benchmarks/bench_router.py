@@ -0,0 +1,81 @@
+"""
+Microbenchmark of the per-message routing and completion check in MQTTHandler.on_message.
+
+Compares the original linear prefix scan + hasattr/setattr + dataclass field iteration
+against the precompiled TopicRouter and the Message completion bitmask.
+
+Run from the repository root:
+    python -m benchmarks.bench_router
+"""
+
+import random
+from time import perf_counter_ns
+from src.mssg import Message
+from src.schema import REQUIRED_FIELDS
+from src.router import TopicRouter
+
+ROOT_TOPICS = [("dsmr/reading/#", 0), ("dsmr/consumption/gas/#", 0)]
+N_MESSAGES = 200_000
+
+
+def make_topics(n: int) -> list[str]:
+    topics = [
+        f"dsmr/consumption/gas/{name}" if name == "delivered" else f"dsmr/reading/{name}"
+        for name in REQUIRED_FIELDS
+    ]
+    topics.append("dsmr/reading/electricity_tariff")  # Published by the gateway, not stored
+    random.seed(0)
+    return [random.choice(topics) for _ in range(n)]
+
+
+def legacy(topics: list[str]) -> int:
+    """The routing of on_message before the TopicRouter."""
+    message = Message()
+    complete = 0
+    for topic in topics:
+        subtopic = None
+        for root_topic, _ in ROOT_TOPICS:
+            clean_topic = root_topic.replace("#", "")
+            if topic.startswith(clean_topic):
+                subtopic = topic.replace(clean_topic, "")
+                break
+        if subtopic is None:
+            continue
+        if hasattr(message, subtopic):
+            setattr(message, subtopic, "1.0")
+        if all(getattr(message, name) is not None for name in REQUIRED_FIELDS):
+            complete += 1
+            message = Message()
+    return complete
+
+
+def routed(topics: list[str]) -> int:
+    """The routing of on_message with the TopicRouter and the completion bitmask."""
+    router = TopicRouter([topic for topic, _ in ROOT_TOPICS])
+    message = Message()
+    complete = 0
+    for topic in topics:
+        route = router.route(topic)
+        if route is None:
+            continue
+        message.set_field(route[1], "1.0")
+        if message.is_complete():
+            complete += 1
+            message = Message()
+    return complete
+
+
+def bench(func, topics: list[str]) -> float:
+    start = perf_counter_ns()
+    complete = func(topics)
+    elapsed = perf_counter_ns() - start
+    per_message = elapsed / len(topics)
+    print(f"{func.__name__:>8}: {per_message:8.0f} ns/message, {complete} complete messages")
+    return per_message
+
+
+if __name__ == "__main__":
+    topics = make_topics(N_MESSAGES)
+    baseline = bench(legacy, topics)
+    optimized = bench(routed, topics)
+    print(f"Speed-up: {baseline / optimized:.1f}x")
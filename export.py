@@ -0,0 +1,210 @@
+"""
+Export the smart meter hypertable to columnar files for offline analytics.
+
+Each day (or hour/month) of the requested range is streamed from a server-side cursor in chunks and
+written incrementally as one compressed Parquet file (or an Arrow IPC file, which can be memory-mapped),
+in a hive-style layout that pyarrow/pandas/duckdb read as a single dataset:
+
+    export/<table>/date=2024-01-05/part-20240105T000000.parquet
+
+Memory is bounded by the chunk size whatever the range. The end of the last exported partition is
+kept in ``_export_state.json``, so running the command again resumes where the previous run stopped.
+Files are written under a temporary name and renamed once complete. Requires pyarrow.
+
+Rows can land after their timestamp: batches wait up to DB_BATCH_MAX_AGE in the writer, and spooled
+readings are replayed once the database is reachable again. So by default the export ends at the
+last partition boundary at least ``--lag`` (EXPORT_LAG, 15 minutes) in the past, and never resumes
+past rows still to come. Readings replayed after a longer outage are exported by running the command
+again over their range with --start/--end, which rewrites those partitions.
+
+    python export.py --start 2024-01-01
+    python export.py --start 2024-01-01 --end 2024-02-01 --format arrow --partition month
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.db import DBConnection, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_TABLE
+from src.mssg import Message
+from src.logger import setup_logger, BASE_DIR
+
+logger = setup_logger(__name__)
+
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR") or BASE_DIR / "export")  # Empty also means the default
+EXPORT_LAG = float(os.getenv("EXPORT_LAG", 900))  # seconds
+STATE_FILE = "_export_state.json"
+PARTITIONS = ("hour", "day", "month")
+
+
+def parse_time(value: str) -> datetime:
+    time = datetime.fromisoformat(value)
+    return time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+
+
+def partition_start(time: datetime, partition: str) -> datetime:
+    """Start of the partition ``time`` falls in."""
+    if partition == "hour":
+        return time.replace(minute=0, second=0, microsecond=0)
+    if partition == "day":
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_end(start: datetime, partition: str) -> datetime:
+    """Start of the partition following the one ``start`` falls in."""
+    first = partition_start(start, partition)
+    if partition == "hour":
+        return first + timedelta(hours=1)
+    if partition == "day":
+        return first + timedelta(days=1)
+    return (first + timedelta(days=32)).replace(day=1)
+
+
+def partition_dir(start: datetime, partition: str) -> str:
+    if partition == "hour":
+        return f"date={start:%Y-%m-%d}/hour={start:%H}"
+    if partition == "day":
+        return f"date={start:%Y-%m-%d}"
+    return f"month={start:%Y-%m}"
+
+
+def arrow_schema(columns: list[str]):
+    import pyarrow as pa
+
+    return pa.schema(
+        [("timestamp_utc", pa.timestamp("us", tz="UTC")), ("device_id", pa.string())]
+        + [(name, pa.float64()) for name in columns]
+    )
+
+
+class Exporter:
+    """Writes time partitions of the table to Parquet or Arrow IPC files, one chunk at a time."""
+
+    def __init__(
+        self,
+        db: DBConnection,
+        out_dir: Path,
+        file_format: str = "parquet",
+        partition: str = "day",
+        chunk_size: int = 50_000,
+        compression: str = "zstd",
+        columns: list[str] | None = None,
+    ):
+        self.db = db
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.partition = partition
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.columns = columns or [name for name, _ in Message.COLUMNS if name not in ("timestamp_utc", "device_id")]
+        self.schema = arrow_schema(self.columns)
+        self.state_path = out_dir / STATE_FILE
+
+    def resume_from(self) -> datetime | None:
+        """End of the last exported partition, if any."""
+        if not self.state_path.exists():
+            return None
+        return parse_time(json.loads(self.state_path.read_text())["exported_until"])
+
+    def export(self, start: datetime, end: datetime) -> int:
+        """Export ``[start, end)`` partition by partition, recording progress after each one."""
+        rows = 0
+        while start < end:
+            stop = min(partition_end(start, self.partition), end)
+            written = self.export_partition(start, stop)
+            logger.info(f"Exported {written} rows from {start:%Y-%m-%d %H:%M} to {stop:%Y-%m-%d %H:%M}.")
+            rows += written
+            self.state_path.write_text(json.dumps({"exported_until": stop.isoformat()}))
+            start = stop
+        return rows
+
+    def export_partition(self, start: datetime, end: datetime) -> int:
+        import pyarrow as pa
+
+        suffix = "parquet" if self.file_format == "parquet" else "arrow"
+        path = self.out_dir / partition_dir(start, self.partition) / f"part-{start:%Y%m%dT%H%M%S}.{suffix}"
+        tmp_path = path.with_name(path.name + ".tmp")
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        rows = 0
+        writer = None
+        try:
+            for chunk in self.db.iter_chunks(start, end, self.columns, self.chunk_size):
+                batch = pa.RecordBatch.from_pydict(chunk, schema=self.schema)
+                if writer is None:
+                    writer = self._open_writer(tmp_path)
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is not None:
+            os.replace(tmp_path, path)
+        return rows
+
+    def _open_writer(self, path: Path):
+        import pyarrow as pa
+
+        if self.file_format == "arrow":
+            options = pa.ipc.IpcWriteOptions(compression=None if self.compression == "none" else self.compression)
+            return pa.ipc.new_file(str(path), self.schema, options=options)
+
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(str(path), self.schema, compression=self.compression)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export the smart meter table to Parquet or Arrow files.")
+    arg_parser.add_argument("--start", type=parse_time, help="ISO start time. Defaults to where the last export stopped.")
+    arg_parser.add_argument(
+        "--end",
+        type=parse_time,
+        help="ISO end time (exclusive). Defaults to the last partition boundary at least --lag seconds ago.",
+    )
+    arg_parser.add_argument(
+        "--lag", type=float, default=EXPORT_LAG, help="Seconds to wait for late rows (default end only)."
+    )
+    arg_parser.add_argument("--out", type=Path, default=EXPORT_DIR / DB_TABLE if DB_TABLE else EXPORT_DIR)
+    arg_parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    arg_parser.add_argument("--partition", choices=PARTITIONS, default="day")
+    arg_parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows per fetch and per row group.")
+    arg_parser.add_argument("--compression", default="zstd", help="zstd, lz4, snappy (parquet only) or none.")
+    arg_parser.add_argument("--columns", help="Comma-separated columns. Defaults to all of them.")
+    args = arg_parser.parse_args()
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SystemExit("The export requires pyarrow: pip install pyarrow")
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    with DBConnection(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_TABLE) as db:
+        exporter = Exporter(
+            db,
+            args.out,
+            file_format=args.format,
+            partition=args.partition,
+            chunk_size=args.chunk_size,
+            compression=args.compression,
+            columns=args.columns.split(",") if args.columns else None,
+        )
+        start = exporter.resume_from() or args.start
+        if args.start and start < args.start:
+            start = args.start
+        if start is None:
+            raise SystemExit("Nothing exported yet: give a --start time.")
+        end = args.end or partition_start(datetime.now(timezone.utc) - timedelta(seconds=args.lag), args.partition)
+        if start >= end:
+            logger.info(f"Nothing to export: already exported until {start.isoformat()}.")
+            raise SystemExit(0)
+        logger.info(f"Exporting '{DB_TABLE}' from {start.isoformat()} to {end.isoformat()} into {args.out}")
+        total = exporter.export(start, end)
+        logger.info(f"Export finished: {total} rows.")
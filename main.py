@@ -1,30 +1,123 @@
+from time import monotonic
+
+STARTED_AT = monotonic()  # Startup phases are timed from here
+
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file (see src/__init__.py)
+load_dotenv()
+
 import paho.mqtt.client as mqtt
-from datetime import datetime, timezone
-from threading import Timer, Event
+from threading import Event
 import threading
-from dotenv import load_dotenv
+import logging
+import argparse
+import asyncio
+import random
+import signal
 import os
-from typing import Optional
-from src.mssg import Message
-from src.db import DBConnection
-from src.logger import setup_logger
+from typing import Optional, TYPE_CHECKING
+from src.mssg import Message, PAYLOAD_FIELDS
+from src.schema import FIELDS
+from src.db import DBConnection, AsyncDBConnection, DB_CONTINUOUS_AGGREGATES
+from src.writer import BatchWriter
+from src.spool import Spool, SpoolReplayer
+from src.scheduler import TimerScheduler
+from src.assembler import MessageAssembler
+from src.router import TopicRouter
+from src.filters import DeadbandFilter
+from src.sharding import ShardAssignment
+from src.httpd import StatusServer, health_check
+from src.live import LiveCache, DEFAULT_WINDOW_FIELDS
+from src.metrics import (
+    REGISTRY,
+    MESSAGES_RECEIVED,
+    MESSAGES_UNROUTED,
+    MQTT_RECONNECTS,
+    MQTT_CONNECTED,
+    MQTT_RECOVERY_SECONDS,
+    QUEUE_DEPTH,
+    DB_ERRORS,
+    record_startup_phase,
+)
+from src.logger import setup_logger, RateLimitFilter
+
+if TYPE_CHECKING:
+    from src.analytics import AnomalyDetector
 
 
 
 logger = setup_logger(__name__)
-# Load environment variables from the .env file
+logger.addFilter(RateLimitFilter())  # Avoid flooding the logs with per-message errors
 
-load_dotenv()
+# Ingestion engine: "threaded" (paho + threads) or "async" (single asyncio event loop)
+INGEST_ENGINE = os.getenv("INGEST_ENGINE", "threaded")
 
 # MQTT broker details
 BROKER = os.getenv("BROKER_IP")
 PORT = int(os.getenv("PORT", 1883))  # Default to 1883 if not set
 USERNAME = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
+# Persistent session: with a fixed client id and QoS 1 subscriptions the broker queues readings while we are away
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "smart-meter-ingester")
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1))
+MQTT_RECONNECT_MIN_DELAY = float(os.getenv("MQTT_RECONNECT_MIN_DELAY", 1.0))  # seconds
+MQTT_RECONNECT_MAX_DELAY = float(os.getenv("MQTT_RECONNECT_MAX_DELAY", 60.0))  # seconds
 TOPICS = [
-    (os.getenv("TOPIC_ELECTRICITY"), 0),
-    (os.getenv("TOPIC_GAS"), 0),
-]  # List of topics to subscribe to with QoS level
+    (os.getenv("TOPIC_ELECTRICITY"), MQTT_QOS),
+    (os.getenv("TOPIC_GAS"), MQTT_QOS),
+]  # List of topics to subscribe to with QoS level. A '{device}' level identifies the meter.
+MAX_DEVICES = int(os.getenv("MAX_DEVICES", 1_000))
+
+# Scale-out over several replicas: each one assembles and stores the meters of its shard
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+SHARD_MODE = os.getenv("SHARD_MODE", "filter")  # filter | shared
+SHARD_GROUP = os.getenv("SHARD_GROUP", "smart-meter")  # $share group name in 'shared' mode
+SHARD_DEVICES = [device.strip() for device in os.getenv("SHARD_DEVICES", "").split(",") if device.strip()]
+
+# Optional filtering of readings that did not change beyond a deadband
+FILTER_ENABLED = os.getenv("FILTER_ENABLED", "false").lower() == "true"
+FILTER_KEYFRAME_INTERVAL = float(os.getenv("FILTER_KEYFRAME_INTERVAL", 60))  # seconds
+FILTER_DEADBAND_POWER = float(os.getenv("FILTER_DEADBAND_POWER", 0.01))  # kW
+FILTER_DEADBAND_VOLTAGE = float(os.getenv("FILTER_DEADBAND_VOLTAGE", 1.0))  # V
+
+
+def build_filter() -> Optional[DeadbandFilter]:
+    """Create the deadband filter configured in the environment, if enabled."""
+    if not FILTER_ENABLED:
+        return None
+    deadbands = {field.name: FILTER_DEADBAND_POWER for field in FIELDS if field.unit == "kW"}
+    deadbands.update({field.name: FILTER_DEADBAND_VOLTAGE for field in FIELDS if field.unit == "V"})
+    return DeadbandFilter(deadbands, keyframe_interval=FILTER_KEYFRAME_INTERVAL)
+
+# Streaming anomaly detection on the complete readings (requires numpy)
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "false").lower() == "true"
+ANALYTICS_WINDOW = int(os.getenv("ANALYTICS_WINDOW", 60))  # readings per device
+ANALYTICS_NOMINAL_VOLTAGE = float(os.getenv("ANALYTICS_NOMINAL_VOLTAGE", 230.0))  # V
+ANALYTICS_VOLTAGE_TOLERANCE = float(os.getenv("ANALYTICS_VOLTAGE_TOLERANCE", 0.1))
+ANALYTICS_SPIKE_SIGMA = float(os.getenv("ANALYTICS_SPIKE_SIGMA", 4.0))
+ANALYTICS_SPIKE_MIN_DELTA = float(os.getenv("ANALYTICS_SPIKE_MIN_DELTA", 0.5))  # kW
+ANALYTICS_IMBALANCE_RATIO = float(os.getenv("ANALYTICS_IMBALANCE_RATIO", 0.5))
+ANALYTICS_IMBALANCE_MIN_POWER = float(os.getenv("ANALYTICS_IMBALANCE_MIN_POWER", 0.3))  # kW
+EVENTS_TOPIC = os.getenv("EVENTS_TOPIC", "smart_meter/events")  # Events are published to <topic>/<device>
+
+
+def build_detector() -> Optional["AnomalyDetector"]:
+    """Create the anomaly detector configured in the environment, if enabled."""
+    if not ANALYTICS_ENABLED:
+        return None
+    from src.analytics import AnomalyDetector
+
+    return AnomalyDetector(
+        window=ANALYTICS_WINDOW,
+        nominal_voltage=ANALYTICS_NOMINAL_VOLTAGE,
+        voltage_tolerance=ANALYTICS_VOLTAGE_TOLERANCE,
+        spike_sigma=ANALYTICS_SPIKE_SIGMA,
+        spike_min_delta=ANALYTICS_SPIKE_MIN_DELTA,
+        imbalance_ratio=ANALYTICS_IMBALANCE_RATIO,
+        imbalance_min_power=ANALYTICS_IMBALANCE_MIN_POWER,
+    )
 
 # Database configuration
 DB_CONFIG = {
@@ -34,7 +127,29 @@ DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
     "port": os.getenv("DB_PORT"),
     "table": os.getenv("DB_TABLE"),
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 4)),
 }
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", 500))
+DB_BATCH_MAX_AGE = float(os.getenv("DB_BATCH_MAX_AGE", 1.0))  # seconds
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", 10_000))
+DB_QUEUE_OVERFLOW = os.getenv("DB_QUEUE_OVERFLOW", "spill")  # block | drop-oldest | spill
+DB_WRITER_WORKERS = int(os.getenv("DB_WRITER_WORKERS", 1))
+# On shutdown, what is not written within this time is spooled instead ('docker stop' waits 10 s)
+DB_STOP_TIMEOUT = float(os.getenv("DB_STOP_TIMEOUT", 5.0))  # seconds
+
+# Local HTTP endpoint serving /metrics (HTTP_PORT=0 disables it)
+HTTP_HOST = os.getenv("HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.getenv("HTTP_PORT", 9108))
+# Latest readings served from memory on /live: rolling window of LIVE_WINDOW_SIZE messages per device
+LIVE_WINDOW_SIZE = int(os.getenv("LIVE_WINDOW_SIZE", 300))
+LIVE_WINDOW_FIELDS = tuple(
+    name.strip() for name in os.getenv("LIVE_WINDOW_FIELDS", ",".join(DEFAULT_WINDOW_FIELDS)).split(",") if name.strip()
+)
+
+# Local spool for messages that could not be written to the database
+SPOOL_PATH = os.getenv("SPOOL_PATH")  # Defaults to spool/messages.sqlite
+SPOOL_MAX_ROWS = int(os.getenv("SPOOL_MAX_ROWS", 2_000_000))
 
 
 class MQTTHandler:
@@ -49,16 +164,52 @@ class MQTTHandler:
         topics: list | str,
         db_handler: Optional[DBConnection] = None,
         timeout: int = 7,  # seconds
+        batch_size: int = DB_BATCH_SIZE,
+        batch_max_age: float = DB_BATCH_MAX_AGE,
+        queue_size: int = DB_QUEUE_SIZE,
+        queue_overflow: str = DB_QUEUE_OVERFLOW,
+        writer_workers: int = DB_WRITER_WORKERS,
+        stop_timeout: float = DB_STOP_TIMEOUT,
+        spool: Optional[Spool] = None,
+        max_devices: int = MAX_DEVICES,
+        reading_filter: Optional[DeadbandFilter] = None,
+        client_id: str = MQTT_CLIENT_ID,
+        reconnect_min_delay: float = MQTT_RECONNECT_MIN_DELAY,
+        reconnect_max_delay: float = MQTT_RECONNECT_MAX_DELAY,
+        shard: Optional[ShardAssignment] = None,
+        live_cache: Optional[LiveCache] = None,
+        detector: Optional["AnomalyDetector"] = None,
+        events_topic: str = EVENTS_TOPIC,
+        started_at: Optional[float] = None,  # monotonic time the process started, for the startup timings
     ):
 
         self.db_handler = db_handler
-
-        # Check TimescaleDB extension is installed
-        self.db_handler.check_timescaledb()
-        # Check if the table exist. Otherwise, create the TimescaleDB hypertable.
-        self.db_handler.create_hypertable(
-            Message, index_columns=["electricity_currently_delivered"]
-        )
+        self.spool = spool
+        self.reading_filter = reading_filter
+        self.writer = None
+        self.replayer = None
+        self.stop_timeout = stop_timeout
+        # The schema is checked in the background once started: until then the writer only buffers
+        self.schema_ready = Event()
+        if db_handler is None:
+            self.schema_ready.set()
+        if db_handler is not None:
+            if queue_overflow == "spill" and spool is None:
+                logger.warning("No spool configured for the 'spill' overflow policy. Using 'block' instead.")
+                queue_overflow = "block"
+            self.writer = BatchWriter(
+                db_handler,
+                batch_size=batch_size,
+                max_age=batch_max_age,
+                max_pending=queue_size,
+                workers=writer_workers,
+                overflow=queue_overflow,
+                spill_handler=spool.append if spool is not None else None,
+                ready=self.schema_ready,
+            )
+            if spool is not None:
+                self.replayer = SpoolReplayer(spool, db_handler, ready=self.schema_ready)
+            QUEUE_DEPTH.set_function(self.writer.depth)
 
         # MQTT credentials
         self.broker = broker
@@ -69,15 +220,48 @@ class MQTTHandler:
         if isinstance(topics, str):
             topics = [(topics, 0)]
 
-        self.root_topics = topics
+        # Routing table from the received topics to (device, Message field), compiled once
+        self.router = TopicRouter([topic for topic, _ in topics if topic])
+        # Devices of other replicas are dropped right after routing, unless the broker splits the traffic
+        self.shard = shard if shard is not None and shard.filtering else None
+        self.root_topics = (shard or ShardAssignment()).subscriptions(topics)
         self.timeout = timeout
 
-        self.current_message: Message = (
-            Message()
-        )  # Single instance of Message to track subtopics
-
-        self.timer = None
-        self.mqtt_client = mqtt.Client()
+        self.scheduler = TimerScheduler()  # Single thread handling the message timeouts
+        # One partially built Message per device
+        self.assembler = MessageAssembler(
+            self.on_message_assembled,
+            self.scheduler,
+            timeout=timeout,
+            max_devices=max_devices,
+        )
+        self.live_cache = live_cache
+        if live_cache is not None:
+            live_cache.pending = self.assembler.pending
+        # Complete readings are analyzed on the detector's thread, which hands back the events
+        self.detector = detector
+        self.events_topic = events_topic
+        if detector is not None:
+            detector.on_events = self.publish_events
+        # Reconnection is driven by run_network_loop(), never from within the paho callbacks
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self._reconnect_delay = reconnect_min_delay
+        self._disconnected_at: Optional[float] = None
+        self.connected = False
+        # The network loop ticks at least every second, or every backoff delay while reconnecting
+        self.liveness_timeout = max(60.0, 2 * reconnect_max_delay)
+        self._loop_tick = monotonic()
+
+        self.started_at = started_at if started_at is not None else monotonic()
+        self._started = self.started_at
+        self._startup_pending = {"mqtt_connect", "schema"} if db_handler is not None else {"mqtt_connect"}
+        self._startup_lock = threading.Lock()
+
+        # Without a client id the broker cannot keep the session (and queue messages) across connections
+        if shard is not None:
+            client_id = shard.client_id(client_id)
+        self.mqtt_client = mqtt.Client(client_id=client_id, clean_session=not client_id)
         self.mqtt_client.will_set("clients/python_status", payload="disconnected", qos=1, retain=True)
         self.stop_event = Event()
         self.setup_mqtt_client()
@@ -92,138 +276,276 @@ class MQTTHandler:
     def on_connect(self, client, userdata, flags, rc):
         """Callback when the MQTT client connects to the broker."""
         if rc == 0:
-            print("Connected to broker!")
-            print(f"Connected to {self.broker}:{self.port} as {self.username}")
             logger.info(f"Connected to {self.broker}:{self.port} as {self.username}")
+            MQTT_CONNECTED.set(1)
+            self.connected = True
+            self._startup_phase("mqtt_connect")
+            self._reconnect_delay = self.reconnect_min_delay
+            if self._disconnected_at is not None:
+                recovery = monotonic() - self._disconnected_at
+                MQTT_RECOVERY_SECONDS.observe(recovery)
+                self._disconnected_at = None
+                session = "resumed" if flags.get("session present") else "new"
+                logger.info(f"Recovered the broker connection after {recovery:.1f} seconds ({session} session).")
 
             for topic, qos in self.root_topics:
                 if topic:
                     client.subscribe(topic, qos)
-                    print(f"Subscribed to topic: {topic} with qos: {qos}")
                     logger.info(f"Subscribed to topic: {topic} with qos: {qos}")
                 else:
-                    print("Warning: Empty topic detected. Check .env file!")
-                    logger.warning("Warning: Empty topic detected. Check .env file!")
+                    logger.warning("Empty topic detected. Check .env file!")
 
         else:
-            print(f"Failed to connect, return code {rc}")
+            logger.warning(f"Failed to connect, return code {rc}")
 
     def on_disconnect(self, client, userdata, rc):
         """Callback when the MQTT client is disconnected."""
-        print(f"Disconnected from broker with code {rc}")
-        logger.info(f"Disconnected from broker with code {rc}")
-
-        # if rc != 0:
-        #     print("Unexpected disconnection. Reconnecting...")
+        if rc == 0:
+            logger.info("Disconnected from broker.")
+        else:
+            logger.warning(f"Disconnected from broker with code {rc}")
+
+        MQTT_CONNECTED.set(0)
+        self.connected = False
+        if self._disconnected_at is None:
+            self._disconnected_at = monotonic()
+        # run_network_loop() notices the lost connection and reconnects with backoff
+
+    def run_network_loop(self):
+        """Drive the paho network loop until stopped, reconnecting with exponential backoff and jitter."""
+        self.mqtt_client.connect_async(self.broker, self.port, keepalive=60)
+        first_attempt = True
         while not self.stop_event.is_set():
+            self._loop_tick = monotonic()
             try:
-                print("Attempting to reconnect...")
-                logger.info(f"Attempting to reconnect...")
+                if not first_attempt:
+                    MQTT_RECONNECTS.inc()
+                    logger.info("Attempting to reconnect...")
+                first_attempt = False
                 self.mqtt_client.reconnect()
-                logger.info("Reconnected successfully! Exiting on_disconnect().")
-                print("Reconnected successfully! Exiting on_disconnect().")
-                return
             except Exception as e:
-                logger.info(f"Reconnection failed: {e}. Retrying in 5 seconds...")
-                print(f"Reconnection failed: {e}. Retrying in 5 seconds...")
-                self.stop_event.wait(5)
+                self._backoff(f"Connection failed: {e}.")
+                continue
+
+            rc = mqtt.MQTT_ERR_SUCCESS
+            while rc == mqtt.MQTT_ERR_SUCCESS and not self.stop_event.is_set():
+                rc = self.mqtt_client.loop(timeout=1.0)
+                self._loop_tick = monotonic()
+            if not self.stop_event.is_set():
+                self._backoff(f"Network loop stopped with code {rc}.")
+
+    def prepare_schema(self, retry_min_delay: float = 5.0, retry_max_delay: float = 60.0):
+        """Check and upgrade the database schema, retrying until it succeeds, then let the writer flush.
+
+        Runs in a background thread while the readings are received and buffered.
+        """
+        delay = retry_min_delay
+        while not self.stop_event.is_set():
+            try:
+                cached = self.db_handler.prepare_schema(
+                    Message, continuous_aggregates=DB_CONTINUOUS_AGGREGATES, events_table=self.detector is not None
+                )
+            except Exception as e:
+                logger.error(f"Schema checks failed, retrying in {delay:.0f} seconds. Readings are buffered: {e}")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, retry_max_delay)
+                continue
+            self.schema_ready.set()
+            self._startup_phase("schema", "cached" if cached else "checked")
+            return
+
+    def _startup_phase(self, phase: str, detail: str = ""):
+        """Record the first completion of a startup phase, and the time to ready once all are done."""
+        with self._startup_lock:
+            if phase not in self._startup_pending:
+                return
+            self._startup_pending.discard(phase)
+            done = not self._startup_pending
+        record_startup_phase(phase, self._started, detail)
+        if done:
+            record_startup_phase("ready", self.started_at)
+
+    def liveness_checks(self) -> dict:
+        """Checks failing only if the process is stuck: the network loop or a writer thread stopped."""
+        return {
+            "network_loop": lambda: monotonic() - self._loop_tick < self.liveness_timeout,
+            "writer": lambda: self.writer is None or self.writer.is_alive(),
+        }
+
+    def readiness_checks(self) -> dict:
+        """Checks passing once the readings are received and written: connected, with the schema ready."""
+        return {"mqtt": lambda: self.connected, "schema": self.schema_ready.is_set}
+
+    def _backoff(self, reason: str):
+        delay = self._reconnect_delay * random.uniform(0.5, 1.5)
+        self._reconnect_delay = min(self._reconnect_delay * 2, self.reconnect_max_delay)
+        logger.warning(f"{reason} Reconnecting in {delay:.1f} seconds...")
+        self.stop_event.wait(delay)
 
     def on_message(self, client, userdata, msg):
         """Callback when a message is received."""
 
+        MESSAGES_RECEIVED.inc()
         try:
-
-            print(f"Received message on topic: {msg.topic} with payload: {msg.payload.decode()}")
-
-            subtopic = None
-            for root_topic, _ in self.root_topics:
-                clean_topic = root_topic.replace("#", "")  # Remove wildcard
-                if msg.topic.startswith(clean_topic):
-                    subtopic = msg.topic.replace(clean_topic, "")
-                    break
-
-            if subtopic is None:
-                print(f"Received message from unknown topic: {msg.topic}")
+            route = self.router.route(msg.topic)
+            if route is None:
+                MESSAGES_UNROUTED.inc()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Received message from unknown topic: {msg.topic}")
                 return
 
-            payload = msg.payload.decode()
-
-            # Update the corresponding field in the current message
-            if hasattr(self.current_message, subtopic):
-                setattr(self.current_message, subtopic, payload)
-                print(f"Updated field: {subtopic} -> {payload}")
+            device_id, slot = route
+            if self.shard is not None and not self.shard.owns(device_id):
+                return
 
-            # Reset the timeout RRtimer
-            if self.timer:
-                self.timer.cancel()
-            self.timer = Timer(self.timeout, self.handle_timeout)
-            self.timer.start()
-
-            # Check if the message is complete and save it to the database
-            if self.current_message.is_complete():
-                self.current_message.timestamp_utc = datetime.now(timezone.utc).replace(
-                    microsecond=0
-                )
-                if self.db_handler is not None:
-                    self.db_handler.save_message(self.current_message)
-                    print(f"Saved complete message: {self.current_message}")
-                else:
-                    print(f"Complete message: {self.current_message}")
-                self.reset_message()
+            # Update the corresponding field in the device's message. The payload is parsed to float.
+            self.assembler.update(device_id, slot, msg.payload)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Updated field: {device_id}/{PAYLOAD_FIELDS[slot]} -> {msg.payload!r}")
 
         except Exception as e:
-            logger.error(f"Error while handling message: {e}")
-            print(f"Error processing message: {e}")
+            logger.error(f"Error while handling message on topic {msg.topic}: {e}")
+
+    def on_message_assembled(self, message: Message, complete: bool):
+        """Callback when a device's message is complete or its timeout was reached."""
+        if self.live_cache is not None:
+            self.live_cache.update(message, complete)
+        if not complete:
+            self.handle_timeout(message)
+            return
+
+        if self.detector is not None:
+            self.detector.submit(message)  # Before the filter: the analytics see every reading
+        if self.reading_filter is not None and not self.reading_filter.accept(message):
+            return
+        if self.writer is not None:
+            self.writer.add(message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Complete message: {message}")
+
+    def publish_events(self, events: list):
+        """Publish detected events (see ``src.analytics.Event``) to the broker and store them.
+
+        Called from the detector's thread.
+        """
+        for event in events:
+            logger.info(f"Event '{event.kind}' on device '{event.device_id}' (phase {event.phase}): {event.value:.3f}")
+            self.mqtt_client.publish(f"{self.events_topic}/{event.device_id}", event.as_json(), qos=1)
+        if self.db_handler is not None and self.schema_ready.is_set():
+            try:
+                self.db_handler.save_events(events)
+            except Exception as e:
+                logger.error(f"Error while saving {len(events)} events: {e}")
+                DB_ERRORS.labels("events").inc()
 
-    def handle_timeout(self):
+    def handle_timeout(self, message: Message):
         """Handle timeout for incomplete messages."""
-        print("Timeout reached! Saving partial message to the database.")
-        self.current_message.timestamp_utc = datetime.now(timezone.utc).replace(
-            microsecond=0
-        )
-        self.db_handler.save_message(self.current_message)
-        self.reset_message()
-
-    def reset_message(self):
-        """Reset the current message and stop the timer."""
-        if self.timer:
-            self.timer.cancel()
-            self.timer = None
-        self.current_message = Message()
-
-        # Restart the timer to handle a new timeout
-        self.timer = Timer(self.timeout, self.handle_timeout)
-        self.timer.start()
+        logger.info(f"Timeout reached! Saving partial message of device '{message.device_id}' to the database.")
+        if self.writer is not None:
+            self.writer.add(message)
 
     def start(self):
-        """Starts the MQTT client loop."""
+        """Starts the MQTT client loop, with the schema checks in the background."""
         try:
+            self._started = monotonic()
+            if threading.current_thread() is threading.main_thread():
+                # 'docker stop' sends SIGTERM: stop as on Ctrl+C, so the buffered readings are written or spooled
+                signal.signal(signal.SIGTERM, self.on_sigterm)
+            if self.db_handler is not None:
+                schema_thread = threading.Thread(target=self.prepare_schema, name="schema-check", daemon=True)
+                schema_thread.start()
+            if self.writer is not None:
+                self.writer.start()
+            if self.replayer is not None:
+                self.replayer.start()
+            if self.detector is not None:
+                self.detector.start()
+            self.scheduler.start()
+
             # Start heartbeat in a background thread
             self.heartbeat_thread = threading.Thread(target=self.publish_heartbeat, daemon=True)
             self.heartbeat_thread.start()
 
-            self.mqtt_client.connect(self.broker, self.port, keepalive=60)
-            print("MQTT client started. Listening for messages...")
             logger.info("MQTT client started. Listening for messages...")
-            self.mqtt_client.loop_forever()
+            self.run_network_loop()
         except KeyboardInterrupt:
-            print("Gracefully stopping MQTT handler...")
             logger.info("Gracefully stopping MQTT handler...")
             self.stop_event.set()
+        finally:
             self.mqtt_client.disconnect()
-
+            self.scheduler.stop()
+            self.assembler.flush()
+            if self.detector is not None:
+                self.detector.stop()
+            if self.replayer is not None:
+                self.replayer.stop(self.stop_timeout)
+            if self.writer is not None:
+                self.writer.stop(self.stop_timeout)
+            if self.spool is not None:
+                self.spool.close()
+            if self.db_handler is not None:
+                self.db_handler.close()
+
+
+    def on_sigterm(self, signum, frame):
+        logger.info("SIGTERM received. Gracefully stopping MQTT handler...")
+        self.stop_event.set()
 
     def publish_heartbeat(self):
         while not self.stop_event.is_set():
             try:
                 self.mqtt_client.publish("clients/python_status", "alive", qos=1, retain=True)
-                print("[HEARTBEAT] Published alive message")
+                logger.debug("[HEARTBEAT] Published alive message")
+                if self.db_handler is not None:
+                    logger.info(f"DB pool stats: {self.db_handler.get_pool_stats()}")
+                if self.writer is not None:
+                    logger.info(f"Writer queue stats: {self.writer.stats()}")
+                if self.spool is not None:
+                    logger.info(f"Spooled messages pending replay: {len(self.spool)}")
+                if self.reading_filter is not None:
+                    logger.info(f"Deadband filter stats: {self.reading_filter.stats()}")
+                if self.detector is not None:
+                    logger.info(f"Anomaly detector stats: {self.detector.stats()}")
             except Exception as e:
-                print(f"[HEARTBEAT ERROR] {e}")
+                logger.error(f"[HEARTBEAT ERROR] {e}")
             self.stop_event.wait(300)  # every 5 minutes
 
-# Main execution
-if __name__ == "__main__":
+def build_status_server(
+    live_cache: Optional[LiveCache] = None,
+    liveness: Optional[dict] = None,
+    readiness: Optional[dict] = None,
+) -> Optional[StatusServer]:
+    """Create the local HTTP server exposing the metrics, the probes and the live readings, if enabled."""
+    if not HTTP_PORT:
+        return None
+    server = StatusServer(HTTP_HOST, HTTP_PORT)
+    server.route("/metrics", lambda: (200, "text/plain; version=0.0.4", REGISTRY.render()))
+    server.route("/healthz", health_check(liveness or {}))
+    server.route("/readyz", health_check(readiness or {}))
+    if live_cache is not None:
+        server.route_prefix("/live", live_cache.http_route)
+    return server
+
+
+def build_live_cache() -> Optional[LiveCache]:
+    """Create the in-memory cache of the latest readings, if they are served."""
+    if not HTTP_PORT:
+        return None
+    return LiveCache(LIVE_WINDOW_SIZE, LIVE_WINDOW_FIELDS)
+
+
+def build_shard() -> Optional[ShardAssignment]:
+    """Create the shard assignment of this replica configured in the environment, if sharded."""
+    if SHARD_COUNT == 1 and not SHARD_DEVICES and SHARD_MODE != "shared":
+        return None
+    return ShardAssignment(SHARD_INDEX, SHARD_COUNT, mode=SHARD_MODE, group=SHARD_GROUP, devices=SHARD_DEVICES)
+
+
+def run_threaded():
+    """Run the paho-based ingester with its writer, scheduler and heartbeat threads."""
+    record_startup_phase("imports", STARTED_AT)
+    started = monotonic()
+    live_cache = build_live_cache()
     db_connection = DBConnection(**DB_CONFIG)
     handler = MQTTHandler(
         broker=BROKER,
@@ -233,5 +555,96 @@ if __name__ == "__main__":
         db_handler=db_connection,
         topics=TOPICS,
         timeout=7,
+        spool=Spool(SPOOL_PATH, max_rows=SPOOL_MAX_ROWS),
+        reading_filter=build_filter(),
+        shard=build_shard(),
+        live_cache=live_cache,
+        detector=build_detector(),
+        started_at=STARTED_AT,
+    )
+    status_server = build_status_server(live_cache, handler.liveness_checks(), handler.readiness_checks())
+    if status_server is not None:
+        status_server.start()
+    record_startup_phase("init", started)
+    try:
+        handler.start()
+    finally:
+        if status_server is not None:
+            status_server.stop()
+
+
+def run_async():
+    """Run the asyncio ingester. BROKER_IP may list several brokers as 'host[:port],host[:port]'."""
+    from src.async_handler import AsyncMQTTHandler
+
+    brokers = []
+    for broker in BROKER.split(","):
+        host, _, port = broker.strip().partition(":")
+        brokers.append((host, int(port) if port else PORT))
+
+    record_startup_phase("imports", STARTED_AT)
+    started = monotonic()
+    detector = build_detector()
+
+    def prepare_schema() -> bool:
+        # Schema checks use a synchronous connection once; the engine writes through the async pool
+        with DBConnection(**{**DB_CONFIG, "min_size": 1, "max_size": 1}) as db_connection:
+            return db_connection.prepare_schema(
+                Message, continuous_aggregates=DB_CONTINUOUS_AGGREGATES, events_table=detector is not None
+            )
+
+    live_cache = build_live_cache()
+    handler = AsyncMQTTHandler(
+        brokers=brokers,
+        username=USERNAME,
+        password=PASSWORD,
+        topics=TOPICS,
+        db_handler=AsyncDBConnection(**DB_CONFIG),
+        timeout=7,
+        batch_size=DB_BATCH_SIZE,
+        batch_max_age=DB_BATCH_MAX_AGE,
+        queue_size=DB_QUEUE_SIZE,
+        queue_overflow=DB_QUEUE_OVERFLOW,
+        writer_workers=DB_WRITER_WORKERS,
+        stop_timeout=DB_STOP_TIMEOUT,
+        spool=Spool(SPOOL_PATH, max_rows=SPOOL_MAX_ROWS),
+        max_devices=MAX_DEVICES,
+        reading_filter=build_filter(),
+        client_id=MQTT_CLIENT_ID,
+        reconnect_min_delay=MQTT_RECONNECT_MIN_DELAY,
+        reconnect_max_delay=MQTT_RECONNECT_MAX_DELAY,
+        shard=build_shard(),
+        live_cache=live_cache,
+        detector=detector,
+        events_topic=EVENTS_TOPIC,
+        prepare_schema=prepare_schema,
+        started_at=STARTED_AT,
     )
-    handler.start()
+    status_server = build_status_server(live_cache, handler.liveness_checks(), handler.readiness_checks())
+    if status_server is not None:
+        status_server.start()
+    record_startup_phase("init", started)
+    try:
+        asyncio.run(handler.run())
+    except KeyboardInterrupt:
+        logger.info("Gracefully stopping async ingestion engine...")
+    finally:
+        if status_server is not None:
+            status_server.stop()
+
+
+# Main execution
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Store smart meter readings from MQTT in TimescaleDB.")
+    arg_parser.add_argument(
+        "--engine",
+        choices=["threaded", "async"],
+        default=INGEST_ENGINE,
+        help="Ingestion engine: paho with worker threads, or a single asyncio event loop.",
+    )
+    args = arg_parser.parse_args()
+
+    if args.engine == "async":
+        run_async()
+    else:
+        run_threaded()
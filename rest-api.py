@@ -1,56 +1,71 @@
 """
-REST API example for the smart-meter
+REST API ingester for the smart-meter gateways.
+
+Polls every gateway listed in GATEWAY_URLS (comma-separated) concurrently and stores the readings
+through the same batched writer as the MQTT ingester.
 """
 
-import requests
-from dataclasses import fields
-import time
-from typing import Type
-from src.mssg import Reading
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
 
+from src.mssg import Message, Reading
+from src.db import DBConnection, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_TABLE
+from src.writer import BatchWriter
+from src.spool import Spool, SpoolReplayer, SPOOL_DIR
+from src.poller import GatewayPoller
+from src.logger import setup_logger
 
-def filter_json_data(json_data: dict, dataclass_type: Type[Reading]) -> dict:
-    """
-    Filters the input JSON dictionary to include only the fields defined in the dataclass.
-    """
-    dataclass_field_names = {field.name for field in fields(dataclass_type)}
-    return {
-        key: value for key, value in json_data.items() if key in dataclass_field_names
-    }
+logger = setup_logger(__name__)
+
+GATEWAY_URLS = os.getenv("GATEWAY_URLS", "http://192.168.2.11:82/smartmeter/api/read")
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 3.0))  # seconds
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", 2.0))  # seconds
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", 8))
 
 
 if __name__ == "__main__":
-    # Define the URL of the REST-API server
-    url = "http://192.168.2.11:82/smartmeter/api/read"
-
-    response = requests.get(url)
-    if response.status_code == 200:
-        json_data = response.json()
-        filtered_data = filter_json_data(json_data, Reading)  # Filter out unwanted keys
-        reading_instance = Reading(**filtered_data)
-        print(reading_instance)
-    else:
-        print(f"Failed to retrieve data. Status code: {response.status_code}")
-
-    received_message = Reading(**json_data)
-
-    # %%
-    while True:
-        try:
-            # Send a GET request to the server
-            response = requests.get(url)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code == 200:
-                # Parse the response as JSON
-                json_data = response.json()
-                # print("Successfully retrieved data:")
-                # print(json_data)
-            else:
-                print(f"Failed to retrieve data. Status code: {response.status_code}")
-
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred: {e}")
-
-        print(f"Power: {float(json_data['PowerDelivered_total']):.3f}")
-        time.sleep(3)
+    db = DBConnection(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        table=DB_TABLE,
+    )
+    db.prepare_schema(Message, continuous_aggregates=False)
+
+    spool = Spool(SPOOL_DIR / "rest-api.sqlite")
+    writer = BatchWriter(db, overflow="spill", spill_handler=spool.append)
+    replayer = SpoolReplayer(spool, db)
+
+    def store_reading(url: str, reading: Reading):
+        writer.add(reading.to_message())
+        logger.debug(f"Reading from {url}: power {reading.PowerDelivered_total:.3f} kW")
+
+    poller = GatewayPoller(
+        [url.strip() for url in GATEWAY_URLS.split(",") if url.strip()],
+        store_reading,
+        interval=POLL_INTERVAL,
+        timeout=POLL_TIMEOUT,
+        workers=POLL_WORKERS,
+    )
+
+    stop_event = threading.Event()
+    writer.start()
+    replayer.start()
+    poller.start()
+    try:
+        while not stop_event.wait(300):  # Report every 5 minutes
+            logger.info(f"Gateway stats: {poller.stats()}")
+            logger.info(f"Writer queue stats: {writer.stats()}")
+    except KeyboardInterrupt:
+        logger.info("Gracefully stopping REST API poller...")
+    finally:
+        poller.stop()
+        replayer.stop()
+        writer.stop()
+        spool.close()
+        db.close()
@@ -0,0 +1,5 @@
+"""Smart meter ingestion: MQTT/REST readings assembled into messages and stored in TimescaleDB.
+
+The modules read their settings from the environment when they are imported, so the entrypoints
+load the .env file before importing anything from this package.
+"""
@@ -0,0 +1,279 @@
+import json
+import queue
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Callable, Optional
+import numpy as np
+from .metrics import ANALYTICS_EVENTS, ANALYTICS_DROPPED
+from .mssg import Message, FIELD_SLOTS
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+VOLTAGE_FIELDS = ("phase_voltage_l1", "phase_voltage_l2", "phase_voltage_l3")
+POWER_FIELDS = ("phase_currently_delivered_l1", "phase_currently_delivered_l2", "phase_currently_delivered_l3")
+CHANNELS = VOLTAGE_FIELDS + POWER_FIELDS
+
+# Detector states of a device, in this order: sag and swell per phase, spike per phase, imbalance
+EVENT_KINDS = ("voltage_sag",) * 3 + ("voltage_swell",) * 3 + ("power_spike",) * 3 + ("phase_imbalance",)
+EVENT_PHASES = (1, 2, 3) * 3 + (None,)
+EVENT_CHANNELS = (0, 1, 2, 0, 1, 2, 3, 4, 5, None)
+
+
+@dataclass
+class Event:
+    """Anomaly detected on a device's readings.
+
+    ``value`` is the reading that triggered it (the imbalance ratio for ``phase_imbalance``) and
+    ``baseline`` what it was compared with: the rolling mean of the channel (the mean phase power for
+    ``phase_imbalance``). ``phase`` is None for the events of the whole device.
+    """
+
+    timestamp_utc: datetime
+    device_id: str
+    kind: str
+    phase: Optional[int]
+    value: float
+    baseline: float
+
+    def as_row(self) -> tuple:
+        return self.timestamp_utc, self.device_id, self.kind, self.phase, self.value, self.baseline
+
+    def as_json(self) -> str:
+        return json.dumps({**asdict(self), "timestamp_utc": self.timestamp_utc.isoformat()})
+
+
+class AnomalyDetector:
+    """Streaming detection of voltage sags/swells, power spikes and phase imbalance on complete readings.
+
+    Per device it keeps the last ``window`` readings of the phase voltages and powers in a NumPy ring
+    buffer with running sums, so the rolling mean and variance are updated incrementally, and an EWMA
+    of the phase powers. All devices share preallocated ``(devices, ...)`` arrays, so a batch of
+    readings is evaluated with array operations over its devices and the six channels at once.
+    Events are edge-triggered: one when a condition starts, none while it lasts.
+
+    - ``voltage_sag`` / ``voltage_swell``: a phase voltage leaves ``nominal_voltage`` +/- ``voltage_tolerance``
+      (EN 50160 allows 10%). It ends once back within the band with ``hysteresis`` margin.
+    - ``power_spike``: a phase power exceeds its rolling mean by ``spike_sigma`` standard deviations
+      and by at least ``spike_min_delta`` kW.
+    - ``phase_imbalance``: the spread of the EWMA phase powers exceeds ``imbalance_ratio`` times their
+      mean, while the mean is at least ``imbalance_min_power`` kW.
+
+    Spikes and imbalance are only evaluated after ``warmup`` readings of the device. ``process_batch``
+    evaluates readings in the caller's thread; ``start``/``submit`` run it on a worker thread fed by
+    a bounded queue, handing each group of events to ``on_events``. Readings are skipped, never
+    waited for, when the queue is full.
+    """
+
+    def __init__(
+        self,
+        on_events: Optional[Callable[[list[Event]], None]] = None,
+        window: int = 60,  # readings
+        ewma_alpha: float = 0.1,
+        nominal_voltage: float = 230.0,  # V
+        voltage_tolerance: float = 0.1,
+        hysteresis: float = 0.01,
+        spike_sigma: float = 4.0,
+        spike_min_delta: float = 0.5,  # kW
+        imbalance_ratio: float = 0.5,
+        imbalance_min_power: float = 0.3,  # kW
+        warmup: int = 10,  # readings
+        queue_size: int = 10_000,
+        capacity: int = 64,  # devices, grows as needed
+    ):
+        if window < 2 or warmup > window:
+            raise ValueError("The window must hold at least 2 readings and the warmup fit in it.")
+        self.on_events = on_events
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.spike_sigma = spike_sigma
+        self.spike_min_delta = spike_min_delta
+        self.imbalance_ratio = imbalance_ratio
+        self.imbalance_min_power = imbalance_min_power
+        self.warmup = warmup
+        self._sag_start = nominal_voltage * (1 - voltage_tolerance)
+        self._sag_end = nominal_voltage * (1 - voltage_tolerance + hysteresis)
+        self._swell_start = nominal_voltage * (1 + voltage_tolerance)
+        self._swell_end = nominal_voltage * (1 + voltage_tolerance - hysteresis)
+        self._slots = np.array([FIELD_SLOTS[name] for name in CHANNELS])
+
+        self._rows: dict[str, int] = {}
+        self._allocate(capacity)
+
+        self._queue: queue.Queue[Message] = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"processed": 0, "events": 0, "dropped": 0}
+
+    def _allocate(self, capacity: int):
+        """(Re)allocate the per-device arrays for ``capacity`` devices, keeping the existing rows."""
+        channels = len(CHANNELS)
+        arrays = {
+            "_buffer": np.zeros((capacity, self.window, channels)),
+            "_sum": np.zeros((capacity, channels)),
+            "_sum_sq": np.zeros((capacity, channels)),
+            "_ewma": np.zeros((capacity, channels)),
+            "_count": np.zeros(capacity, dtype=np.int64),
+            "_position": np.zeros(capacity, dtype=np.int64),
+            "_active": np.zeros((capacity, len(EVENT_KINDS)), dtype=bool),
+        }
+        for name, new in arrays.items():
+            old = getattr(self, name, None)
+            if old is not None:
+                new[: len(old)] = old
+            setattr(self, name, new)
+
+    def _row(self, device_id: str) -> int:
+        row = self._rows.get(device_id)
+        if row is None:
+            row = self._rows[device_id] = len(self._rows)
+            if row == len(self._count):
+                self._allocate(2 * row)
+        return row
+
+    def process(self, message: Message) -> list[Event]:
+        """Update the statistics of the message's device and return the events that started with it."""
+        return self.process_batch([message])
+
+    def process_batch(self, messages: list[Message]) -> list[Event]:
+        """Update the statistics with messages in arrival order and return the events that started.
+
+        The batch is evaluated in rounds holding at most one message per device, each round with
+        array operations over all its devices. Messages missing a channel are skipped.
+        """
+        if not messages:
+            return []
+        values = np.frombuffer(b"".join(message.values().tobytes() for message in messages), dtype=np.float64)
+        x = values.reshape(len(messages), -1)[:, self._slots]
+        valid = ~np.isnan(x).any(axis=1)
+
+        rows = []
+        rounds = []
+        seen: dict[str, int] = {}
+        for message in messages:
+            rows.append(self._row(message.device_id))
+            rounds.append(seen.get(message.device_id, 0))
+            seen[message.device_id] = rounds[-1] + 1
+        rows = np.array(rows)
+        rounds = np.array(rounds)
+
+        events = []
+        for number in range(max(seen.values())):
+            selected = np.flatnonzero((rounds == number) & valid)
+            if selected.size:
+                events.extend(self._process_round(rows[selected], x[selected], [messages[i] for i in selected]))
+        self._stats["processed"] += int(valid.sum())
+        self._stats["events"] += len(events)
+        return events
+
+    def _process_round(self, rows: np.ndarray, x: np.ndarray, messages: list[Message]) -> list[Event]:
+        """Evaluate one reading per device: ``x`` holds the channels of the devices at ``rows``."""
+        count = self._count[rows]
+        previous = self._active[rows]
+        active = np.zeros_like(previous)
+
+        # Voltage band, with hysteresis on the way back
+        voltages = x[:, :3]
+        active[:, 0:3] = np.where(previous[:, 0:3], voltages < self._sag_end, voltages < self._sag_start)
+        active[:, 3:6] = np.where(previous[:, 3:6], voltages > self._swell_end, voltages > self._swell_start)
+
+        # Rolling mean and variance of the window, before this reading joins it
+        seen = (count > 0)[:, None]
+        n = np.maximum(count, 1)[:, None]
+        mean = np.where(seen, self._sum[rows] / n, x)
+        std = np.sqrt(np.where(seen, np.maximum(self._sum_sq[rows] / n - mean * mean, 0.0), 0.0))
+        ewma = self._ewma[rows]
+        ewma = np.where(seen, ewma + self.ewma_alpha * (x - ewma), x)
+        self._ewma[rows] = ewma
+
+        warm = count >= self.warmup
+        delta = x[:, 3:] - mean[:, 3:]
+        active[:, 6:9] = warm[:, None] & (delta > self.spike_min_delta) & (delta > self.spike_sigma * std[:, 3:])
+        phase_power = ewma[:, 3:]
+        mean_power = phase_power.mean(axis=1)
+        imbalance = (phase_power.max(axis=1) - phase_power.min(axis=1)) / np.maximum(mean_power, 1e-9)
+        active[:, 9] = warm & (mean_power >= self.imbalance_min_power) & (imbalance > self.imbalance_ratio)
+
+        started = active & ~previous
+        self._active[rows] = active
+        self._append(rows, x, count)
+
+        events = []
+        for index, state in zip(*np.nonzero(started)):
+            channel = EVENT_CHANNELS[state]
+            if channel is None:
+                value, baseline = imbalance[index], mean_power[index]
+            else:
+                value, baseline = x[index, channel], mean[index, channel]
+            kind = EVENT_KINDS[state]
+            message = messages[index]
+            events.append(
+                Event(message.timestamp_utc, message.device_id, kind, EVENT_PHASES[state], float(value), float(baseline))
+            )
+            ANALYTICS_EVENTS.labels(kind).inc()
+        return events
+
+    def _append(self, rows: np.ndarray, x: np.ndarray, count: np.ndarray):
+        """Push one reading per device into the ring buffers, updating the running sums."""
+        position = self._position[rows]
+        evicted = self._buffer[rows, position] * (count == self.window)[:, None]
+        self._sum[rows] += x - evicted
+        self._sum_sq[rows] += x * x - evicted * evicted
+        self._buffer[rows, position] = x
+        self._count[rows] = np.minimum(count + 1, self.window)
+        position = (position + 1) % self.window
+        self._position[rows] = position
+        # Once per lap, recompute the sums so rounding errors do not accumulate
+        lapped = rows[position == 0]
+        if lapped.size:
+            self._sum[lapped] = self._buffer[lapped].sum(axis=1)
+            self._sum_sq[lapped] = np.square(self._buffer[lapped]).sum(axis=1)
+
+    def submit(self, message: Message):
+        """Queue a complete message for the worker thread. Never blocks the caller."""
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            ANALYTICS_DROPPED.inc()
+
+    def start(self):
+        """Start the worker thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="anomaly-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Process the queued messages and stop the worker thread."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Return the counters, the number of devices and the queue depth."""
+        return {**self._stats, "devices": len(self._rows), "depth": self._queue.qsize()}
+
+    def _run(self, batch_size: int = 500):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            try:
+                messages = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(messages) < batch_size:
+                try:
+                    messages.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                events = self.process_batch(messages)
+            except Exception as e:
+                logger.error(f"Error while analyzing {len(messages)} messages: {e}")
+                continue
+            if events and self.on_events is not None:
+                try:
+                    self.on_events(events)
+                except Exception as e:
+                    logger.error(f"Error while handling {len(events)} events: {e}")
@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Callable, Optional
+from .metrics import MESSAGES_ASSEMBLED, ASSEMBLY_TIMEOUTS, ASSEMBLY_SECONDS
+from .mssg import Message, PAYLOAD_FIELDS, COMPLETE_MASK, ALL_FIELDS_MASK
+from .scheduler import TimerScheduler
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+COMPLETE_MESSAGES = MESSAGES_ASSEMBLED.labels("complete")
+PARTIAL_MESSAGES = MESSAGES_ASSEMBLED.labels("partial")
+
+
+class MessageAssembler:
+    """Builds one ``Message`` per device from the individual MQTT subtopic payloads.
+
+    A device's message is emitted as soon as it holds the fields expected from the device, when a
+    field it already holds arrives again (the device's next reading began), or when no field arrived
+    for ``timeout`` seconds. It is complete if it holds all the required fields. Devices are tracked
+    in least-recently-updated order; when more than ``max_devices`` are being assembled the stalest
+    one is emitted and evicted.
+
+    The expected fields start as all the schema fields, so the first message of a device collects
+    the optional ones it sends too, and then become the fields of its last complete message. Optional
+    fields arriving after their message was emitted go into the device's next message; a message
+    holding only such fields is never emitted on its own.
+    """
+
+    def __init__(
+        self,
+        on_message: Callable[[Message, bool], None],
+        scheduler: TimerScheduler,
+        timeout: float = 7,  # seconds
+        max_devices: int = 1_000,
+    ):
+        self.on_message = on_message  # Called with (message, is_complete)
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.max_devices = max_devices
+
+        self._messages: OrderedDict[str, Message] = OrderedDict()
+        self._started: dict[str, float] = {}  # Arrival of the first field of each device's message
+        self._expected: dict[str, int] = {}  # Mask of the fields completing each device's message
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def update(self, device_id: str, slot: int, payload: str | bytes | float):
+        """Parse and set the field at ``slot`` (see ``FIELD_SLOTS``) of the device's message."""
+        evicted = None
+        finished = None
+        completed = None
+        with self._lock:
+            message = self._messages.get(device_id)
+            if message is not None and message.mask >> slot & 1:
+                # The device's next reading began: the fields it did not send by then will not come
+                self._learn(message)
+                del self._messages[device_id]
+                finished_started = self._started.pop(device_id)
+                self.scheduler.cancel(device_id)
+                finished, message = message, None
+            if message is None:
+                message = Message(device_id=device_id)
+                self._messages[device_id] = message
+                self._started[device_id] = monotonic()
+                if len(self._messages) > self.max_devices:
+                    _, evicted = self._messages.popitem(last=False)
+                    evicted_started = self._started.pop(evicted.device_id)
+                    self.scheduler.cancel(evicted.device_id)
+            else:
+                self._messages.move_to_end(device_id)
+
+            message.set_field(slot, payload)
+
+            if message.is_complete(self._expected.get(device_id, ALL_FIELDS_MASK)):
+                self._learn(message)
+                del self._messages[device_id]
+                started = self._started.pop(device_id)
+                self.scheduler.cancel(device_id)
+                completed = message
+            else:
+                self.scheduler.schedule(device_id, self.timeout, lambda: self.expire(device_id))
+
+        if evicted is not None:
+            logger.warning(f"Too many devices being assembled. Evicted device '{evicted.device_id}'.")
+            self._emit(evicted, False, evicted_started)
+        if finished is not None and finished.mask & COMPLETE_MASK:
+            self._emit(finished, finished.is_complete(), finished_started)
+        if completed is not None:
+            self._emit(completed, True, started)
+
+    def pending(self, device_id: str) -> Optional[tuple[dict[str, float], float]]:
+        """Fields received so far for the device's message being assembled, and their age in seconds."""
+        with self._lock:
+            message = self._messages.get(device_id)
+            if message is None:
+                return None
+            row = message.as_row()
+            age = monotonic() - self._started[device_id]
+        fields = {name: value for name, value in zip(PAYLOAD_FIELDS, row[2:]) if value is not None}
+        return fields, age
+
+    def expire(self, device_id: str):
+        """Emit the device's message after its timeout."""
+        with self._lock:
+            message = self._messages.pop(device_id, None)
+            started = self._started.pop(device_id, None)
+            if message is not None:
+                self._learn(message)
+        if message is None:
+            return
+        ASSEMBLY_TIMEOUTS.inc()
+        if not message.mask & COMPLETE_MASK:
+            logger.debug(f"Timeout reached for device '{device_id}'. Discarding its late optional fields.")
+            return
+        complete = message.is_complete()
+        kind = "complete" if complete else "partial"
+        logger.debug(f"Timeout reached for device '{device_id}'. Emitting {kind} message.")
+        self._emit(message, complete, started)
+
+    def _learn(self, message: Message):
+        """Update the fields expected from the message's device. Called with the lock held."""
+        expected = self._expected.pop(message.device_id, ALL_FIELDS_MASK)
+        if message.is_complete():
+            expected = message.mask
+        else:
+            expected |= message.mask & ~COMPLETE_MASK  # Optional fields trailing the last complete message
+        self._expected[message.device_id] = expected
+        if len(self._expected) > 10 * self.max_devices:
+            del self._expected[next(iter(self._expected))]  # Least recently emitted device
+
+    def flush(self):
+        """Emit every partially assembled message, e.g. on shutdown."""
+        with self._lock:
+            messages = list(self._messages.values())
+            started = self._started
+            self._messages.clear()
+            self._started = {}
+        for message in messages:
+            self.scheduler.cancel(message.device_id)
+            self._emit(message, False, started[message.device_id])
+
+    def _emit(self, message: Message, complete: bool, started: float):
+        ASSEMBLY_SECONDS.observe(monotonic() - started)
+        (COMPLETE_MESSAGES if complete else PARTIAL_MESSAGES).inc()
+        message.timestamp_utc = datetime.now(timezone.utc).replace(microsecond=0)
+        self.on_message(message, complete)
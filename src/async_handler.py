@@ -0,0 +1,503 @@
+import asyncio
+import logging
+import random
+import signal
+import threading
+from collections import deque
+from time import monotonic
+from typing import Callable, Optional, TYPE_CHECKING
+import aiomqtt
+from .assembler import MessageAssembler
+from .db import AsyncDBConnection
+from .filters import DeadbandFilter
+from .live import LiveCache
+from .metrics import (
+    MESSAGES_RECEIVED,
+    MESSAGES_UNROUTED,
+    MQTT_RECONNECTS,
+    MQTT_CONNECTED,
+    MQTT_RECOVERY_SECONDS,
+    QUEUE_DEPTH,
+    DB_ERRORS,
+    record_startup_phase,
+)
+from .mssg import Message, PAYLOAD_FIELDS
+from .router import TopicRouter
+from .scheduler import LoopScheduler
+from .sharding import ShardAssignment
+from .spool import Spool, record_replayed, record_replay_error
+from .writer import OVERFLOW_POLICIES, record_written, record_write_error, spill
+from .logger import setup_logger, RateLimitFilter
+
+if TYPE_CHECKING:
+    from .analytics import AnomalyDetector
+
+logger = setup_logger(__name__)
+logger.addFilter(RateLimitFilter())
+
+STATUS_TOPIC = "clients/python_status"
+
+
+class AsyncMQTTHandler:
+    """asyncio ingestion engine: MQTT receive, message assembly, heartbeat and batched DB writes on one event loop.
+
+    Several brokers can be consumed concurrently; their readings share the same router, assembler
+    and write queue. Batches that cannot be written are spilled to the ``spool`` when one is given,
+    and replayed once the database is reachable again.
+
+    The brokers are consumed right away: ``prepare_schema`` (the database schema checks) runs in a
+    thread meanwhile, retried until it succeeds, and the readings are buffered until it did.
+    """
+
+    def __init__(
+        self,
+        brokers: list[tuple[str, int]],
+        username: str,
+        password: str,
+        topics: list | str,
+        db_handler: Optional[AsyncDBConnection] = None,
+        timeout: float = 7,  # seconds
+        batch_size: int = 500,
+        batch_max_age: float = 1.0,  # seconds
+        queue_size: int = 10_000,
+        queue_overflow: str = "block",
+        writer_workers: int = 1,
+        stop_timeout: float = 5.0,  # seconds to write the queued messages on shutdown before spilling them
+        spool: Optional[Spool] = None,
+        max_devices: int = 1_000,
+        heartbeat_interval: float = 300,  # seconds
+        reading_filter: Optional[DeadbandFilter] = None,
+        client_id: str = "",
+        reconnect_min_delay: float = 1.0,  # seconds
+        reconnect_max_delay: float = 60.0,  # seconds
+        shard: Optional[ShardAssignment] = None,
+        live_cache: Optional[LiveCache] = None,
+        detector: Optional["AnomalyDetector"] = None,
+        events_topic: str = "smart_meter/events",
+        prepare_schema: Optional[Callable[[], bool]] = None,
+        started_at: Optional[float] = None,  # monotonic time the process started, for the startup timings
+        liveness_timeout: float = 30.0,  # seconds without an event loop tick
+    ):
+        if queue_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{queue_overflow}'. Use one of {OVERFLOW_POLICIES}.")
+        if queue_overflow == "spill" and spool is None:
+            logger.warning("No spool configured for the 'spill' overflow policy. Using 'block' instead.")
+            queue_overflow = "block"
+
+        self.brokers = brokers
+        self.username = username
+        self.password = password
+        self.db_handler = db_handler
+        self.spool = spool
+        self.batch_size = batch_size
+        self.batch_max_age = batch_max_age
+        self.queue_size = queue_size
+        self.queue_overflow = queue_overflow
+        self.writer_workers = writer_workers
+        self.stop_timeout = stop_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.reading_filter = reading_filter
+        self.client_id = shard.client_id(client_id) if shard is not None else client_id
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+        if isinstance(topics, str):
+            topics = [(topics, 0)]
+        self.router = TopicRouter([topic for topic, _ in topics if topic])
+        self.shard = shard if shard is not None and shard.filtering else None
+        self.root_topics = [
+            (topic, qos) for topic, qos in (shard or ShardAssignment()).subscriptions(topics) if topic
+        ]
+
+        self.scheduler = LoopScheduler()
+        self.assembler = MessageAssembler(
+            self.on_message_assembled,
+            self.scheduler,
+            timeout=timeout,
+            max_devices=max_devices,
+        )
+        self.live_cache = live_cache
+        if live_cache is not None:
+            live_cache.pending = self.assembler.pending
+        # Complete readings are analyzed on the detector's thread, off the event loop
+        self.detector = detector
+        self.events_topic = events_topic
+        self._clients: list[aiomqtt.Client] = []  # Connected clients, to publish the events
+        # Messages are queued with the time they were added, to measure their wait until committed
+        self._queue: Optional[asyncio.Queue[tuple[float, Message]]] = None
+        # 'block' policy: messages that did not fit, moved into the queue as the writers free slots.
+        # The receive loops wait for it to be empty before they read on
+        self._blocked: deque[tuple[float, Message]] = deque()
+        self._unblocked: Optional[asyncio.Event] = None
+        self._stats = {"enqueued": 0, "written": 0, "failed": 0, "dropped": 0, "spilled": 0}
+
+        self.prepare_schema = prepare_schema
+        self._schema_ready: Optional[asyncio.Event] = None
+        self.liveness_timeout = liveness_timeout
+        self._loop_tick = monotonic()
+        self.started_at = started_at if started_at is not None else monotonic()
+        self._started = self.started_at
+        self._startup_pending = {"mqtt_connect", "schema"}
+
+    async def run(self):
+        """Run the engine until cancelled."""
+        self._started = monotonic()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._unblocked = asyncio.Event()
+        self._unblocked.set()
+        QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._schema_ready = asyncio.Event()
+        if self.db_handler is not None:
+            await self.db_handler.open()
+
+        tasks = [asyncio.create_task(self._tick())]
+        tasks += [asyncio.create_task(self._consume(host, port)) for host, port in self.brokers]
+        if self.db_handler is not None and self.prepare_schema is not None:
+            tasks.append(asyncio.create_task(self._prepare_schema()))
+        else:
+            self._schema_ready.set()
+            self._startup_phase("schema")
+        if self.db_handler is not None:
+            tasks += [asyncio.create_task(self._write_batches()) for _ in range(self.writer_workers)]
+            if self.spool is not None:
+                tasks.append(asyncio.create_task(self._replay_spool()))
+        if self.detector is not None:
+            loop = asyncio.get_running_loop()
+            self.detector.on_events = lambda events: asyncio.run_coroutine_threadsafe(
+                self._publish_events(events), loop
+            )
+            self.detector.start()
+        logger.info(f"Async ingestion engine started for {len(self.brokers)} broker(s).")
+
+        # 'docker stop' sends SIGTERM: cancel the tasks, so the buffered readings are written or spooled below
+        terminated = []
+
+        def on_sigterm():
+            logger.info("SIGTERM received. Gracefully stopping async ingestion engine...")
+            terminated.append(True)
+            for task in tasks:
+                task.cancel()
+
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        except NotImplementedError:
+            pass  # Windows event loops
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            if not terminated:
+                raise
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except NotImplementedError:
+                pass
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.assembler.flush()
+            if self.detector is not None:
+                await asyncio.to_thread(self.detector.stop)
+            await self._drain()
+            if self.db_handler is not None:
+                await self.db_handler.close()
+            if self.spool is not None:
+                self.spool.close()
+
+    def stats(self) -> dict:
+        """Return the write queue depth and the writer counters."""
+        return {**self._stats, "depth": self._queue.qsize() if self._queue else 0, "capacity": self.queue_size}
+
+    def schema_ready(self) -> bool:
+        return self._schema_ready is not None and self._schema_ready.is_set()
+
+    def liveness_checks(self) -> dict:
+        """Checks failing only if the engine is stuck: the event loop stopped running its tasks."""
+        return {"event_loop": lambda: monotonic() - self._loop_tick < self.liveness_timeout}
+
+    def readiness_checks(self) -> dict:
+        """Checks passing once the readings are received and written: connected, with the schema ready."""
+        return {"mqtt": lambda: bool(self._clients), "schema": self.schema_ready}
+
+    async def _tick(self):
+        while True:
+            self._loop_tick = monotonic()
+            await asyncio.sleep(1.0)
+
+    async def _prepare_schema(self, retry_min_delay: float = 5.0, retry_max_delay: float = 60.0):
+        """Run the schema checks in a thread, retrying until they succeed, then let the writers flush."""
+        delay = retry_min_delay
+        while True:
+            try:
+                cached = await self._in_daemon_thread(self.prepare_schema)
+                break
+            except Exception as e:
+                logger.error(f"Schema checks failed, retrying in {delay:.0f} seconds. Readings are buffered: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, retry_max_delay)
+        self._schema_ready.set()
+        self._startup_phase("schema", "cached" if cached else "checked")
+
+    @staticmethod
+    async def _in_daemon_thread(function: Callable):
+        """Await ``function`` run in a daemon thread, which unlike ``asyncio.to_thread`` does not hold up
+        the shutdown while it blocks (e.g. connecting to an unreachable database)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result=None, error: Optional[BaseException] = None):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            try:
+                result, error = function(), None
+            except Exception as e:
+                result, error = None, e
+            try:
+                loop.call_soon_threadsafe(resolve, result, error)
+            except RuntimeError:
+                pass  # The event loop was closed meanwhile
+
+        threading.Thread(target=run, name="schema-check", daemon=True).start()
+        return await future
+
+    def _startup_phase(self, phase: str, detail: str = ""):
+        """Record the first completion of a startup phase, and the time to ready once all are done."""
+        if phase not in self._startup_pending:
+            return
+        self._startup_pending.discard(phase)
+        record_startup_phase(phase, self._started, detail)
+        if not self._startup_pending:
+            record_startup_phase("ready", self.started_at)
+
+    async def _consume(self, host: str, port: int):
+        """Receive messages from one broker, reconnecting with exponential backoff and jitter.
+
+        With a ``client_id`` the session is persistent, so the broker queues the QoS 1 readings
+        published while the connection is down.
+        """
+        delay = self.reconnect_min_delay
+        disconnected_at = None
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    hostname=host,
+                    port=port,
+                    username=self.username,
+                    password=self.password,
+                    identifier=self.client_id or None,
+                    clean_session=not self.client_id,
+                    keepalive=60,
+                    will=aiomqtt.Will(STATUS_TOPIC, payload="disconnected", qos=1, retain=True),
+                ) as client:
+                    logger.info(f"Connected to {host}:{port} as {self.username}")
+                    MQTT_CONNECTED.set(1)
+                    if disconnected_at is not None:
+                        recovery = monotonic() - disconnected_at
+                        MQTT_RECOVERY_SECONDS.observe(recovery)
+                        logger.info(f"Recovered the connection to {host}:{port} after {recovery:.1f} seconds.")
+                        disconnected_at = None
+                    for topic, qos in self.root_topics:
+                        await client.subscribe(topic, qos)
+                        logger.info(f"Subscribed to topic: {topic} with qos: {qos}")
+                    delay = self.reconnect_min_delay
+
+                    heartbeat = asyncio.create_task(self._heartbeat(client))
+                    self._clients.append(client)
+                    self._startup_phase("mqtt_connect")
+                    try:
+                        async for message in client.messages:
+                            self.on_message(message.topic.value, message.payload)
+                            await self._unblocked.wait()
+                    finally:
+                        self._clients.remove(client)
+                        heartbeat.cancel()
+            except aiomqtt.MqttError as e:
+                MQTT_CONNECTED.set(0)
+                if disconnected_at is None:
+                    disconnected_at = monotonic()
+                wait = delay * random.uniform(0.5, 1.5)
+                logger.warning(f"Connection to {host}:{port} lost: {e}. Reconnecting in {wait:.1f} seconds...")
+                MQTT_RECONNECTS.inc()
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.reconnect_max_delay)
+
+    def on_message(self, topic: str, payload: bytes):
+        """Route a received payload into its device's message."""
+        MESSAGES_RECEIVED.inc()
+        try:
+            route = self.router.route(topic)
+            if route is None:
+                MESSAGES_UNROUTED.inc()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Received message from unknown topic: {topic}")
+                return
+
+            device_id, slot = route
+            if self.shard is not None and not self.shard.owns(device_id):
+                return
+            self.assembler.update(device_id, slot, payload)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Updated field: {device_id}/{PAYLOAD_FIELDS[slot]} -> {payload!r}")
+        except Exception as e:
+            logger.error(f"Error while handling message on topic {topic}: {e}")
+
+    def on_message_assembled(self, message: Message, complete: bool):
+        """Queue a complete (or timed-out partial) message for the batch writers."""
+        if self.live_cache is not None:
+            self.live_cache.update(message, complete)
+        if not complete:
+            logger.info(f"Timeout reached! Saving partial message of device '{message.device_id}' to the database.")
+        else:
+            if self.detector is not None:
+                self.detector.submit(message)  # Before the filter: the analytics see every reading
+            if self.reading_filter is not None and not self.reading_filter.accept(message):
+                return
+        if self.db_handler is None:
+            return
+
+        item = (monotonic(), message)
+        try:
+            if self._blocked:
+                raise asyncio.QueueFull  # Behind the messages already waiting
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.queue_overflow == "spill":
+                self._spill([message])
+                return
+            if self.queue_overflow == "drop-oldest":
+                self._queue.get_nowait()
+                self._stats["dropped"] += 1
+                self._queue.put_nowait(item)
+            else:
+                # 'block': the assembler callback cannot await, so the message waits aside and the
+                # receive loops stop reading until the writers made room. Without receives, at most the
+                # timed-out messages of every device wait here.
+                self._blocked.append(item)
+                self._unblocked.clear()
+        self._stats["enqueued"] += 1
+
+    async def _publish_events(self, events: list):
+        """Publish detected events (see ``src.analytics.Event``) on the first connected broker and store them."""
+        for event in events:
+            logger.info(f"Event '{event.kind}' on device '{event.device_id}' (phase {event.phase}): {event.value:.3f}")
+            if self._clients:
+                try:
+                    await self._clients[0].publish(f"{self.events_topic}/{event.device_id}", event.as_json(), qos=1)
+                except aiomqtt.MqttError as e:
+                    logger.error(f"Error while publishing event '{event.kind}': {e}")
+        if self.db_handler is not None and self.schema_ready():
+            try:
+                await self.db_handler.save_events(events)
+            except Exception as e:
+                logger.error(f"Error while saving {len(events)} events: {e}")
+                DB_ERRORS.labels("events").inc()
+
+    async def _heartbeat(self, client: aiomqtt.Client):
+        while True:
+            try:
+                await client.publish(STATUS_TOPIC, "alive", qos=1, retain=True)
+                logger.debug("[HEARTBEAT] Published alive message")
+                if self.db_handler is not None:
+                    logger.info(f"DB pool stats: {self.db_handler.get_pool_stats()}")
+                    logger.info(f"Writer queue stats: {self.stats()}")
+                if self.detector is not None:
+                    logger.info(f"Anomaly detector stats: {self.detector.stats()}")
+            except aiomqtt.MqttError as e:
+                logger.error(f"[HEARTBEAT ERROR] {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _next_batch(self) -> list[tuple[float, Message]]:
+        """Wait until a batch is full or the oldest message in it reached the maximum age."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        self._unblock()
+        deadline = loop.time() + self.batch_max_age
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                self._unblock()
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _unblock(self):
+        """Move the messages put aside by the 'block' policy into the slots the writers freed."""
+        while self._blocked and not self._queue.full():
+            self._queue.put_nowait(self._blocked.popleft())
+        if not self._blocked:
+            self._unblocked.set()
+
+    async def _write_batches(self):
+        await self._schema_ready.wait()
+        while True:
+            await self._flush(await self._next_batch())
+
+    async def _flush(self, batch: list[tuple[float, Message]]):
+        started = monotonic()
+        try:
+            await self.db_handler.save_messages([message for _, message in batch])
+            record_written(batch, started)
+            self._stats["written"] += len(batch)
+        except Exception as e:
+            record_write_error(batch, e)
+            self._stats["failed"] += len(batch)
+            if self.spool is not None:
+                self._spill([message for _, message in batch])
+        except asyncio.CancelledError:
+            # Stopped while writing: spill the batch, replaying it is idempotent
+            if self.spool is not None:
+                self._spill([message for _, message in batch])
+            raise
+
+    async def _drain(self):
+        """Write the messages still queued on shutdown, or spill them if the schema was never ready or
+        they are not written within the stop timeout."""
+        if self.db_handler is None or self._queue is None:
+            return
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        batch.extend(self._blocked)
+        self._blocked.clear()
+        if not batch:
+            return
+        if self.schema_ready():
+            try:
+                await asyncio.wait_for(self._flush(batch), self.stop_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{len(batch)} queued messages not written after {self.stop_timeout} seconds.")
+        elif self.spool is not None:
+            self._spill([message for _, message in batch])
+        else:
+            logger.error(f"Dropping {len(batch)} queued messages: the database schema was never ready.")
+            self._stats["dropped"] += len(batch)
+
+    def _spill(self, messages: list[Message]):
+        spilled = spill(self.spool.append, messages)
+        self._stats["spilled" if spilled else "dropped"] += len(messages)
+
+    async def _replay_spool(self, batch_size: int = 5_000, interval: float = 10.0):
+        """Drain the spool into the database in large, idempotent batches."""
+        await self._schema_ready.wait()
+        while True:
+            if len(self.spool) == 0:
+                await asyncio.sleep(interval)
+                continue
+            last_id, messages = await asyncio.to_thread(self.spool.peek, batch_size)
+            try:
+                await self.db_handler.merge_messages(messages)
+            except Exception as e:
+                record_replay_error(e, interval)
+                await asyncio.sleep(interval)
+                continue
+            await asyncio.to_thread(record_replayed, self.spool, last_id, messages)
@@ -1,14 +1,25 @@
-from psycopg import connect
-from psycopg.rows import dict_row
-from dataclasses import asdict, fields
-from typing import Optional, Type
-from .mssg import Message
-from dotenv import load_dotenv
+import functools
+import hashlib
+import json
+import logging
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import NamedTuple, Optional, Type
+
+if __name__ == "__main__":
+    # Before src.logger reads LOG_LEVEL and LOG_NON_BLOCKING (see src/__init__.py)
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+from psycopg.errors import UniqueViolation
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from .mssg import Message, DEFAULT_DEVICE
+from .logger import setup_logger, BASE_DIR
 
-# Load environment variables from the .env file
-load_dotenv()
+logger = setup_logger(__name__)
 
 # DB details
 DB_NAME = os.getenv("DB_NAME")
@@ -17,9 +28,84 @@ DB_PASSWORD = os.getenv("DB_PASSWD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_TABLE = os.getenv("DB_TABLE")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 4))
+
+# Hypertable storage settings
+DB_CHUNK_INTERVAL = os.getenv("DB_CHUNK_INTERVAL", "7 days")
+DB_PARTITIONS = int(os.getenv("DB_PARTITIONS", 0))  # Space partitions by device id. 0 disables them.
+DB_COMPRESS_AFTER = os.getenv("DB_COMPRESS_AFTER", "7 days")  # Empty disables compression
+DB_RETENTION = os.getenv("DB_RETENTION", "")  # Empty keeps the data forever
+DB_INDEX_COLUMNS = [column for column in os.getenv("DB_INDEX_COLUMNS", "").split(",") if column]
+DB_CONTINUOUS_AGGREGATES = os.getenv("DB_CONTINUOUS_AGGREGATES", "true").lower() == "true"
+# Fingerprints of the schemas already prepared, to skip the checks on restarts. Empty disables the cache.
+DB_SCHEMA_CACHE = os.getenv("DB_SCHEMA_CACHE", str(BASE_DIR / "spool" / "schema.json"))
+
+# Continuous aggregates: (view suffix, bucket width, bucket seconds, refresh start offset)
+ROLLUPS = (
+    ("1m", "1 minute", 60, "1 hour"),
+    ("15m", "15 minutes", 900, "1 day"),
+    ("1h", "1 hour", 3_600, "3 days"),
+    ("1d", "1 day", 86_400, "7 days"),
+)
+# Aggregate of each rolled-up column: mean power/voltages, extremes for peaks and sags, last counter value
+ROLLUP_AGGREGATES = (
+    ("electricity_currently_delivered", "avg"),
+    ("electricity_currently_delivered_max", "max", "electricity_currently_delivered"),
+    ("electricity_currently_returned", "avg"),
+    ("electricity_currently_returned_max", "max", "electricity_currently_returned"),
+    ("phase_currently_delivered_l1", "avg"),
+    ("phase_currently_delivered_l2", "avg"),
+    ("phase_currently_delivered_l3", "avg"),
+    ("phase_voltage_l1", "avg"),
+    ("phase_voltage_l2", "avg"),
+    ("phase_voltage_l3", "avg"),
+    ("phase_voltage_l1_min", "min", "phase_voltage_l1"),
+    ("phase_voltage_l2_min", "min", "phase_voltage_l2"),
+    ("phase_voltage_l3_min", "min", "phase_voltage_l3"),
+    ("electricity_delivered_1", "last"),
+    ("electricity_delivered_2", "last"),
+    ("electricity_returned_1", "last"),
+    ("electricity_returned_2", "last"),
+    ("delivered", "last"),
+    ("samples", "count"),
+)
+ROLLUP_COLUMNS = tuple(aggregate[0] for aggregate in ROLLUP_AGGREGATES)
+
+# Columns of the <table>_events table, in the order of Event.as_row()
+EVENT_COLUMNS = "timestamp_utc, device_id, kind, phase, value, baseline"
+
+
+class WriteQueries(NamedTuple):
+    """Statements of the batched write path, shared by the sync and async connections."""
+
+    copy: str  # Binary COPY straight into the table
+    create_staging: str
+    copy_staging: str  # Binary COPY into the staging table
+    merge: str  # Staging table into the table, skipping the rows already stored
+    types: list[str]  # COPY types of the columns
+
+
+@functools.cache
+def write_queries(table: str, message_cls: Type[Message]) -> WriteQueries:
+    names, _, types = DBConnection._get_column_types(message_cls)
+    columns = ", ".join(names)
+    staging_table = f"{table}_staging"
+    return WriteQueries(
+        copy=f"COPY {table} ({columns}) FROM STDIN (FORMAT BINARY)",
+        create_staging=f"CREATE TEMP TABLE {staging_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;",
+        copy_staging=f"COPY {staging_table} ({columns}) FROM STDIN (FORMAT BINARY)",
+        merge=f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging_table} ON CONFLICT DO NOTHING;",
+        types=types,
+    )
 
 
 class DBConnection:
+    """Database access for the smart meter table using a bounded, persistent connection pool.
+
+    Connections are health-checked when borrowed; broken ones are discarded and reconnected by the pool.
+    """
+
     def __init__(
         self,
         dbname: str,
@@ -28,6 +114,11 @@ class DBConnection:
         host: Optional[str] = None,
         port: Optional[int] = None,
         table: Optional[str] = None,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        max_idle: float = 300.0,  # seconds
+        timeout: float = 30.0,  # seconds to wait for a free connection
+        reconnect_timeout: float = 300.0,  # seconds
     ):
         self.dbname = dbname
         self.user = user
@@ -36,19 +127,49 @@ class DBConnection:
         self.port = port
         self.table = table
 
+        self.pool = ConnectionPool(
+            kwargs={
+                "dbname": self.dbname,
+                "user": self.user,
+                "password": self.password,
+                "host": self.host,
+                "port": self.port,
+            },
+            min_size=min_size,
+            max_size=max_size,
+            max_idle=max_idle,
+            timeout=timeout,
+            reconnect_timeout=reconnect_timeout,
+            check=ConnectionPool.check_connection,
+            reconnect_failed=self._on_reconnect_failed,
+            name=f"smart-meter-{self.table}",
+            open=True,
+        )
+
+    def _on_reconnect_failed(self, pool: ConnectionPool):
+        """Called by the pool when it gave up trying to re-establish a connection."""
+        logger.warning(f"Connection pool '{pool.name}' failed to reconnect to the database.")
+
+    def get_pool_stats(self) -> dict:
+        """Return the connection pool counters (size, available, waiting, errors, ...)."""
+        return self.pool.get_stats()
+
+    def close(self):
+        """Close the connection pool and all its connections."""
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def check_timescaledb(self):
         """Check if TimescaleDB extension is installed."""
         query = "SELECT extname FROM pg_extension WHERE extname = 'timescaledb';"
         try:
-            with connect(
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port,
-                row_factory=dict_row,
-            ) as conn:
-                with conn.cursor() as cursor:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
                     cursor.execute(query)
                     result = cursor.fetchone()
                     if not result:
@@ -58,6 +179,80 @@ class DBConnection:
         except Exception as e:
             raise RuntimeError(f"Failed to check TimescaleDB extension: {e}")
 
+    def prepare_schema(
+        self,
+        message_cls: Type[Message],
+        continuous_aggregates: bool = DB_CONTINUOUS_AGGREGATES,
+        events_table: bool = False,
+        cache_path: Optional[str | Path] = DB_SCHEMA_CACHE,
+    ) -> bool:
+        """Check TimescaleDB and create or upgrade the hypertable, its rollups and the events table.
+
+        The result is cached in ``cache_path`` under a fingerprint of the table definition and of the
+        storage settings, one per table and combination of ``continuous_aggregates`` and
+        ``events_table``, so callers preparing different parts of the schema (e.g. main.py and
+        rest-api.py) do not invalidate each other. While it matches, a single query confirming the
+        hypertable still exists replaces the checks. Returns True if the checks were skipped.
+        """
+        settings = {
+            "columns": [(name, column_type.__name__) for name, column_type in message_cls.COLUMNS],
+            "chunk_interval": DB_CHUNK_INTERVAL,
+            "partitions": DB_PARTITIONS,
+            "compress_after": DB_COMPRESS_AFTER,
+            "retention": DB_RETENTION,
+            "index_columns": DB_INDEX_COLUMNS,
+            "rollups": [ROLLUPS, ROLLUP_AGGREGATES] if continuous_aggregates else None,
+            "events_table": events_table,
+        }
+        fingerprint = hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+        key = f"{self.table}:continuous_aggregates={continuous_aggregates}:events_table={events_table}"
+        cache_path = Path(cache_path) if cache_path else None
+        cache = {}
+        if cache_path is not None and cache_path.exists():
+            try:
+                cache = json.loads(cache_path.read_text())
+            except ValueError:
+                cache = {}
+        if cache.get(key) == fingerprint and self.hypertable_exists():
+            logger.info(f"Schema of '{self.table}' unchanged since it was last prepared. Skipping the checks.")
+            return True
+
+        self.check_timescaledb()
+        self.create_hypertable(message_cls)
+        if continuous_aggregates:
+            self.create_continuous_aggregates()
+        if events_table:
+            self.create_events_table()
+
+        if cache_path is not None:
+            cache[key] = fingerprint
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                cache_path.write_text(json.dumps(cache))
+            except OSError as e:
+                logger.warning(f"Could not write the schema cache '{cache_path}': {e}")
+        return False
+
+    def hypertable_exists(self) -> bool:
+        """Check in one query that TimescaleDB is installed and the table is a hypertable."""
+        query = "SELECT count(*) AS count FROM timescaledb_information.hypertables WHERE hypertable_name = %s;"
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    cursor.execute(query, (self.table,))
+                    return cursor.fetchone()["count"] > 0
+        except Exception as e:
+            logger.warning(f"Could not check the hypertable '{self.table}': {e}")
+            return False
+
+    def has_rows(self) -> bool:
+        """Check if the table holds any reading."""
+        query = f"SELECT EXISTS (SELECT 1 FROM {self.table} LIMIT 1);"
+        with self.pool.connection() as conn:
+            with conn.cursor(row_factory=dict_row) as cursor:
+                cursor.execute(query)
+                return cursor.fetchone()["exists"]
+
     def table_exists(self):
         """Check if a table exists in the database."""
         query = """
@@ -67,15 +262,8 @@ class DBConnection:
         );
         """
         try:
-            with connect(
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port,
-                row_factory=dict_row,
-            ) as conn:
-                with conn.cursor() as cursor:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
                     cursor.execute(query, (self.table,))
                     return cursor.fetchone()["exists"]
         except Exception as e:
@@ -83,96 +271,633 @@ class DBConnection:
 
     def _get_datetime_field(self, message_cls):
         """Retrieve the name of the field with datetime type."""
-        for field in fields(message_cls):
-            if field.type is datetime:
-                return field.name
-        raise ValueError("No datetime field found in the Message dataclass.")
+        for name, column_type in message_cls.COLUMNS:
+            if column_type is datetime:
+                return name
+        raise ValueError("No datetime field found in the Message columns.")
+
+    @staticmethod
+    def _get_column_types(message_cls) -> tuple[list[str], list[str], list[str]]:
+        """Return the column names, their DDL definitions and their COPY types."""
+        names, definitions, copy_types = [], [], []
+        for name, column_type in message_cls.COLUMNS:
+            names.append(name)
+            if column_type is datetime:
+                definitions.append(f"{name} TIMESTAMPTZ NOT NULL")
+                copy_types.append("timestamptz")
+            elif column_type is str:
+                definitions.append(f"{name} TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'")
+                copy_types.append("text")
+            else:
+                definitions.append(f"{name} DOUBLE PRECISION")
+                copy_types.append("float8")
+        return names, definitions, copy_types
+
+    def _add_device_column(self):
+        """Migrate a single-meter table: add the device id column and include it in the primary key."""
+        query = """
+        SELECT EXISTS (
+            SELECT FROM information_schema.columns
+            WHERE table_name = %s AND column_name = 'device_id'
+        );
+        """
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    cursor.execute(query, (self.table,))
+                    if cursor.fetchone()["exists"]:
+                        return
+
+                    cursor.execute(
+                        f"ALTER TABLE {self.table} ADD COLUMN device_id TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}';"
+                    )
+                    cursor.execute(
+                        f"ALTER TABLE {self.table} DROP CONSTRAINT IF EXISTS {self.table}_pkey, "
+                        f"ADD PRIMARY KEY (timestamp_utc, device_id);"
+                    )
+                conn.commit()
+                logger.info(f"Column 'device_id' added to table '{self.table}'.")
+        except Exception as e:
+            raise RuntimeError(f"Failed to add the device id column: {e}")
+
+    def _add_missing_columns(self, message_cls):
+        """Schema evolution: add the columns of fields appended to the schema since the table was created."""
+        query = "SELECT column_name FROM information_schema.columns WHERE table_name = %s;"
+        names, definitions, _ = self._get_column_types(message_cls)
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, (self.table,))
+                    existing = {row[0] for row in cursor.fetchall()}
+                    missing = [
+                        (name, definition) for name, definition in zip(names, definitions) if name not in existing
+                    ]
+                    for _, definition in missing:
+                        # Nullable without default: also allowed on compressed hypertables
+                        cursor.execute(f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {definition};")
+                conn.commit()
+            if missing:
+                logger.info(f"Columns added to table '{self.table}': {[name for name, _ in missing]}")
+        except Exception as e:
+            raise RuntimeError(f"Failed to add the missing columns: {e}")
 
     def create_hypertable(
         self,
         message_cls: Type[Message],
-        chunk_interval: str = "7 days",
+        chunk_interval: str = DB_CHUNK_INTERVAL,
         index_columns: Optional[list] = None,
+        partitions: int = DB_PARTITIONS,
+        compress_after: Optional[str] = DB_COMPRESS_AFTER,
+        retention: Optional[str] = DB_RETENTION,
     ):
-        """Create the table and convert it to a hypertable."""
+        """Create the table and convert it to a hypertable, then apply the storage policies.
+
+        ``partitions`` adds a space partition on the device id, only when the table is created.
+        ``compress_after`` enables native
+        compression (segmented by device, ordered by time) of the chunks older than that interval,
+        and ``retention`` drops the chunks older than that interval. Secondary indexes are only
+        created for ``index_columns`` (by default ``DB_INDEX_COLUMNS``), since each one costs write
+        amplification on every insert.
+        """
         time_column = self._get_datetime_field(message_cls)
+        if index_columns is None:
+            index_columns = DB_INDEX_COLUMNS
 
         if not self.table_exists():
-            print(f"Table '{self.table}' does not exist. Creating...")
+            logger.info(f"Table '{self.table}' does not exist. Creating...")
             # Dynamically generate table schema from the Message class
-            columns = [
-                (
-                    f"{field.name} TIMESTAMPTZ NOT NULL"
-                    if field.type is datetime
-                    else f"{field.name} DOUBLE PRECISION"
-                )
-                for field in fields(message_cls)
-            ]
+            _, columns, _ = self._get_column_types(message_cls)
             columns = ", ".join(columns)
             create_table_query = f"""
             CREATE TABLE {self.table} (
                 {columns},
-                PRIMARY KEY ({time_column})
+                PRIMARY KEY ({time_column}, device_id)
             );
             """
+            space_partitioning = (
+                f", partitioning_column => 'device_id', number_partitions => {partitions}"
+                if partitions
+                else ""
+            )
             try:
-                with connect(
-                    dbname=self.dbname,
-                    user=self.user,
-                    password=self.password,
-                    host=self.host,
-                    port=self.port,
-                ) as conn:
+                with self.pool.connection() as conn:
                     with conn.cursor() as cursor:
                         # Create the table
                         cursor.execute(create_table_query)
-                        print(f"Table '{self.table}' created successfully.")
+                        logger.info(f"Table '{self.table}' created successfully.")
 
                         # Convert the table to a hypertable with the specified chunk interval
                         hypertable_query = f"""
-                                         SELECT create_hypertable('{self.table}', '{time_column}', chunk_time_interval => INTERVAL '{chunk_interval}');
+                                         SELECT create_hypertable('{self.table}', '{time_column}', chunk_time_interval => INTERVAL '{chunk_interval}'{space_partitioning});
                                          """
                         cursor.execute(hypertable_query)
-                        print(
-                            f"Table '{self.table}' converted to a hypertable with a chunk interval of {chunk_interval}."
+                        logger.info(
+                            f"Table '{self.table}' converted to a hypertable with a chunk interval of {chunk_interval}"
+                            f" and {partitions or 'no'} space partitions."
                         )
 
-                        if index_columns:
-                            for column in index_columns:
-                                index_query = f"CREATE INDEX IF NOT EXISTS {self.table}_{column}_idx ON {self.table} ({column});"
-                                cursor.execute(index_query)
-                                print(f"Secondary index on '{column}' added.")
-
                         conn.commit()
 
             except Exception as e:
                 raise RuntimeError(f"Failed to create hypertable: {e}")
         else:
-            print(f"Table '{self.table}' already exists.")
+            logger.info(f"Table '{self.table}' already exists.")
+            self._add_device_column()
+            self._add_missing_columns(message_cls)
+            if partitions:
+                self._check_space_partitions(partitions)
+
+        self._apply_storage_policies(time_column, chunk_interval, index_columns, compress_after, retention)
+
+    def _check_space_partitions(self, partitions: int):
+        """Warn if the existing hypertable does not have the requested space partitions."""
+        query = """
+        SELECT num_partitions FROM timescaledb_information.dimensions
+        WHERE hypertable_name = %s AND column_name = 'device_id';
+        """
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    cursor.execute(query, (self.table,))
+                    row = cursor.fetchone()
+        except Exception as e:
+            logger.warning(f"Could not check the space partitions of '{self.table}': {e}")
+            return
+        current = row["num_partitions"] if row else 0
+        if current != partitions:
+            logger.warning(
+                f"DB_PARTITIONS={partitions} is ignored: table '{self.table}' already exists with "
+                f"{current or 'no'} space partitions, which are only set when the table is created."
+            )
+
+    def _apply_storage_policies(
+        self,
+        time_column: str,
+        chunk_interval: str,
+        index_columns: list,
+        compress_after: Optional[str],
+        retention: Optional[str],
+    ):
+        """Idempotently apply chunk sizing, indexes, compression and retention to the hypertable."""
+        compression_query = """
+        SELECT compression_enabled FROM timescaledb_information.hypertables
+        WHERE hypertable_name = %s;
+        """
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    # Only affects the chunks created from now on
+                    cursor.execute(
+                        f"SELECT set_chunk_time_interval('{self.table}', INTERVAL '{chunk_interval}');"
+                    )
+
+                    for column in index_columns:
+                        index_query = f"CREATE INDEX IF NOT EXISTS {self.table}_{column}_idx ON {self.table} ({column});"
+                        cursor.execute(index_query)
+                        logger.info(f"Secondary index on '{column}' added.")
+
+                    if compress_after:
+                        cursor.execute(compression_query, (self.table,))
+                        if not cursor.fetchone()["compression_enabled"]:
+                            cursor.execute(
+                                f"ALTER TABLE {self.table} SET ("
+                                f"timescaledb.compress, "
+                                f"timescaledb.compress_segmentby = 'device_id', "
+                                f"timescaledb.compress_orderby = '{time_column} DESC');"
+                            )
+                        cursor.execute(
+                            f"SELECT add_compression_policy('{self.table}', INTERVAL '{compress_after}', "
+                            f"if_not_exists => true);"
+                        )
+                        logger.info(f"Chunks older than {compress_after} are compressed.")
+
+                    if retention:
+                        cursor.execute(
+                            f"SELECT add_retention_policy('{self.table}', INTERVAL '{retention}', "
+                            f"if_not_exists => true);"
+                        )
+                        logger.info(f"Chunks older than {retention} are dropped.")
+
+                conn.commit()
+        except Exception as e:
+            raise RuntimeError(f"Failed to apply the hypertable storage policies: {e}")
+
+    def create_continuous_aggregates(self, time_column: str = "timestamp_utc"):
+        """Create the 1 min / 15 min / 1 h / 1 day rollups of the hypertable and their refresh policies.
+
+        Each rollup is computed from the raw table per device and time bucket. Recent buckets that are
+        not materialized yet are aggregated on the fly (real-time aggregation).
+        """
+        select_list = []
+        for name, function, *source in ROLLUP_AGGREGATES:
+            column = source[0] if source else name
+            if function == "last":
+                select_list.append(f"last({column}, {time_column}) AS {name}")
+            elif function == "count":
+                select_list.append(f"count(*) AS {name}")
+            else:
+                select_list.append(f"{function}({column}) AS {name}")
+        select_list = ", ".join(select_list)
+
+        try:
+            with self.pool.connection() as conn:
+                # Continuous aggregates cannot be created inside a transaction block
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cursor:
+                        for suffix, bucket, _, start_offset in ROLLUPS:
+                            view = f"{self.table}_{suffix}"
+                            cursor.execute(f"""
+                            CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+                            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                            SELECT time_bucket(INTERVAL '{bucket}', {time_column}) AS bucket, device_id, {select_list}
+                            FROM {self.table}
+                            GROUP BY bucket, device_id
+                            WITH NO DATA;
+                            """)
+                            cursor.execute(f"""
+                            SELECT add_continuous_aggregate_policy('{view}',
+                                start_offset => INTERVAL '{start_offset}',
+                                end_offset => INTERVAL '{bucket}',
+                                schedule_interval => INTERVAL '{bucket}',
+                                if_not_exists => true);
+                            """)
+                            logger.info(f"Continuous aggregate '{view}' ready.")
+                finally:
+                    conn.autocommit = False
+        except Exception as e:
+            raise RuntimeError(f"Failed to create the continuous aggregates: {e}")
+
+    def refresh_continuous_aggregates(self, start: datetime, end: datetime):
+        """Materialize the rollups over ``[start, end)``, e.g. after a backfill older than the refresh policies reach."""
+        try:
+            with self.pool.connection() as conn:
+                # refresh_continuous_aggregate cannot run inside a transaction block
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cursor:
+                        for suffix, *_ in ROLLUPS:
+                            view = f"{self.table}_{suffix}"
+                            cursor.execute(f"CALL refresh_continuous_aggregate('{view}', %s, %s);", (start, end))
+                            logger.info(f"Continuous aggregate '{view}' refreshed from {start} to {end}.")
+                finally:
+                    conn.autocommit = False
+        except Exception as e:
+            raise RuntimeError(f"Failed to refresh the continuous aggregates: {e}")
+
+    def create_events_table(self, chunk_interval: str = "30 days"):
+        """Create the hypertable of the events detected by the analytics stage, if it does not exist."""
+        events_table = f"{self.table}_events"
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {events_table} (
+                        timestamp_utc TIMESTAMPTZ NOT NULL,
+                        device_id TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        phase SMALLINT,
+                        value DOUBLE PRECISION,
+                        baseline DOUBLE PRECISION
+                    );
+                    """)
+                    cursor.execute(
+                        f"SELECT create_hypertable('{events_table}', 'timestamp_utc', "
+                        f"chunk_time_interval => INTERVAL '{chunk_interval}', if_not_exists => true);"
+                    )
+                    cursor.execute(
+                        f"CREATE INDEX IF NOT EXISTS {events_table}_device_idx "
+                        f"ON {events_table} (device_id, timestamp_utc DESC);"
+                    )
+                conn.commit()
+                logger.info(f"Events table '{events_table}' ready.")
+        except Exception as e:
+            raise RuntimeError(f"Failed to create the events table: {e}")
+
+    def save_events(self, events: list):
+        """Insert events (see ``src.analytics.Event``) into the events table."""
+        if not events:
+            return
+        query = f"INSERT INTO {self.table}_events ({EVENT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s);"
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.executemany(query, [event.as_row() for event in events])
+                conn.commit()
+        except Exception as e:
+            raise RuntimeError(f"Failed to save {len(events)} events: {e}")
+
+    def query(
+        self,
+        start: datetime,
+        end: datetime,
+        resolution: Optional[float | timedelta] = None,
+        columns: Optional[list[str]] = None,
+        device_id: Optional[str] = None,
+        max_points: int = 1_000,
+        as_numpy: bool = False,
+    ) -> dict:
+        """Read a time range from the coarsest rollup whose bucket is not wider than ``resolution``.
+
+        ``resolution`` is in seconds (or a timedelta). Without it, the resolution is chosen so that
+        the range yields about ``max_points`` buckets per device. Ranges finer than a minute are read
+        from the raw table. Returns a columnar dict ``{"time": [...], "device_id": [...], column: [...]}``,
+        with NumPy arrays instead of lists if ``as_numpy`` (requires numpy).
+        """
+        if isinstance(resolution, timedelta):
+            resolution = resolution.total_seconds()
+        if resolution is None:
+            resolution = (end - start).total_seconds() / max_points
+
+        source, time_column, available = self.table, "timestamp_utc", Message.COLUMNS
+        available = [name for name, _ in available if name not in ("timestamp_utc", "device_id")]
+        for suffix, _, seconds, _ in reversed(ROLLUPS):
+            if seconds <= resolution:
+                source, time_column, available = f"{self.table}_{suffix}", "bucket", ROLLUP_COLUMNS
+                break
+
+        columns = list(columns) if columns else list(available)
+        unknown = set(columns) - set(available)
+        if unknown:
+            raise ValueError(f"Unknown columns for '{source}': {sorted(unknown)}")
+
+        query = (
+            f"SELECT {time_column}, device_id, {', '.join(columns)} FROM {source} "
+            f"WHERE {time_column} >= %s AND {time_column} < %s"
+        )
+        params = [start, end]
+        if device_id is not None:
+            query += " AND device_id = %s"
+            params.append(device_id)
+        query += f" ORDER BY device_id, {time_column};"
+
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor(binary=True) as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+        except Exception as e:
+            raise RuntimeError(f"Failed to query '{source}': {e}")
+
+        names = ["time", "device_id"] + columns
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        result = {name: list(column) for name, column in zip(names, values)}
+        if as_numpy:
+            import numpy as np
+
+            result["time"] = np.array(
+                [time.astimezone(timezone.utc).replace(tzinfo=None) for time in result["time"]],
+                dtype="datetime64[us]",
+            )
+            result["device_id"] = np.array(result["device_id"], dtype=object)
+            for name in columns:
+                result[name] = np.array(result[name], dtype="f8")  # None becomes NaN
+        return result
+
+    def iter_chunks(
+        self,
+        start: datetime,
+        end: datetime,
+        columns: Optional[list[str]] = None,
+        chunk_size: int = 50_000,
+    ):
+        """Stream the raw rows of a time range as columnar dicts of at most ``chunk_size`` rows.
+
+        Rows are read through a server-side cursor in time order, so memory stays bounded by the
+        chunk size whatever the range. Each chunk is ``{"timestamp_utc": [...], "device_id": [...],
+        column: [...]}``.
+        """
+        available = [name for name, _ in Message.COLUMNS if name not in ("timestamp_utc", "device_id")]
+        columns = list(columns) if columns else available
+        unknown = set(columns) - set(available)
+        if unknown:
+            raise ValueError(f"Unknown columns for '{self.table}': {sorted(unknown)}")
+
+        names = ["timestamp_utc", "device_id"] + columns
+        query = (
+            f"SELECT {', '.join(names)} FROM {self.table} "
+            f"WHERE timestamp_utc >= %s AND timestamp_utc < %s ORDER BY timestamp_utc, device_id;"
+        )
+        with self.pool.connection() as conn:
+            # Named cursors live on the server; they need the transaction the pool connection is in
+            with conn.cursor(name=f"{self.table}_export", binary=True) as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, (start, end))
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield {name: list(column) for name, column in zip(names, zip(*rows))}
+
+    def save_messages(self, messages: list[Message]):
+        """Insert a batch of messages in a single round-trip using a binary COPY.
+
+        If some (timestamp, device) is already stored, e.g. a device emitting twice within the second
+        its timestamps are rounded to, the COPY fails as a whole: the batch is merged instead.
+        """
+        if not messages:
+            return
+
+        queries = write_queries(self.table, type(messages[0]))
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    with cursor.copy(queries.copy) as copy:
+                        copy.set_types(queries.types)
+                        for message in messages:
+                            copy.write_row(message.as_row())
+                conn.commit()
+        except UniqueViolation:
+            logger.warning(f"A batch of {len(messages)} messages holds rows already stored. Merging it instead.")
+            self.merge_messages(messages)
+        except Exception as e:
+            raise RuntimeError(f"Failed to save {len(messages)} messages: {e}")
+
+    def merge_messages(self, messages: list[Message]):
+        """Idempotently insert a batch of messages, skipping rows that already exist.
+
+        Rows are copied into a temporary staging table and merged with ``ON CONFLICT DO NOTHING``,
+        so replaying the same messages twice does not fail on the primary key.
+        """
+        if not messages:
+            return
+
+        queries = write_queries(self.table, type(messages[0]))
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(queries.create_staging)
+                    with cursor.copy(queries.copy_staging) as copy:
+                        copy.set_types(queries.types)
+                        for message in messages:
+                            copy.write_row(message.as_row())
+                    cursor.execute(queries.merge)
+                conn.commit()
+        except Exception as e:
+            raise RuntimeError(f"Failed to merge {len(messages)} messages: {e}")
+
+    def merge_copy(self, data: bytes, update: bool = False) -> int:
+        """Idempotently load rows given in COPY text format, in ``Message.COLUMNS`` order, and return
+        the number of rows inserted or updated.
+
+        The rows are copied into a temporary staging table and merged in the same transaction. Rows
+        whose (timestamp, device) already exist are skipped, unless ``update`` is set: then the
+        imported values overwrite the stored ones, keeping the stored value where the import has none.
+        """
+        names, _, _ = self._get_column_types(Message)
+        columns = ", ".join(names)
+        staging_table = f"{self.table}_staging"
+        if update:
+            assignments = ", ".join(
+                f"{name} = COALESCE(EXCLUDED.{name}, {self.table}.{name})"
+                for name in names
+                if name not in ("timestamp_utc", "device_id")
+            )
+            merge_query = (
+                f"INSERT INTO {self.table} ({columns}) "
+                f"SELECT DISTINCT ON (timestamp_utc, device_id) {columns} FROM {staging_table} "
+                f"ON CONFLICT (timestamp_utc, device_id) DO UPDATE SET {assignments};"
+            )
+        else:
+            merge_query = (
+                f"INSERT INTO {self.table} ({columns}) SELECT {columns} FROM {staging_table} ON CONFLICT DO NOTHING;"
+            )
+
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(write_queries(self.table, Message).create_staging)
+                    with cursor.copy(f"COPY {staging_table} ({columns}) FROM STDIN") as copy:
+                        copy.write(data)
+                    cursor.execute(merge_query)
+                    merged = cursor.rowcount
+                conn.commit()
+            return merged
+        except Exception as e:
+            raise RuntimeError(f"Failed to merge the imported rows: {e}")
 
     def save_message(self, message: Message):
         """Insert a message into the SMARTMETER table."""
-        message_dict = asdict(message)
+        message_dict = message.as_dict()
         columns = ", ".join(message_dict.keys())
         placeholders = ", ".join(["%s"] * len(message_dict))
         query = f"INSERT INTO {self.table} ({columns}) VALUES ({placeholders});"
 
         try:
-            with connect(
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port,
-            ) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(query, tuple(message_dict.values()))
                     conn.commit()
-                    print(f"Message saved to table '{self.table}': {message}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Message saved to table '{self.table}': {message}")
         except Exception as e:
             raise RuntimeError(f"Failed to save message: {e}")
 
 
+class AsyncDBConnection:
+    """asyncio counterpart of ``DBConnection`` for the batched write path, backed by an async connection pool.
+
+    Schema management stays with ``DBConnection``; this class only writes messages.
+    """
+
+    def __init__(
+        self,
+        dbname: str,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        table: Optional[str] = None,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        max_idle: float = 300.0,  # seconds
+        timeout: float = 30.0,  # seconds to wait for a free connection
+        reconnect_timeout: float = 300.0,  # seconds
+    ):
+        self.table = table
+        self.pool = AsyncConnectionPool(
+            kwargs={
+                "dbname": dbname,
+                "user": user,
+                "password": password,
+                "host": host,
+                "port": port,
+            },
+            min_size=min_size,
+            max_size=max_size,
+            max_idle=max_idle,
+            timeout=timeout,
+            reconnect_timeout=reconnect_timeout,
+            check=AsyncConnectionPool.check_connection,
+            name=f"smart-meter-async-{table}",
+            open=False,
+        )
+
+    async def open(self):
+        """Open the connection pool. Connections are established in the background."""
+        await self.pool.open()
+
+    async def close(self):
+        """Close the connection pool and all its connections."""
+        await self.pool.close()
+
+    def get_pool_stats(self) -> dict:
+        """Return the connection pool counters (size, available, waiting, errors, ...)."""
+        return self.pool.get_stats()
+
+    async def save_messages(self, messages: list[Message]):
+        """Insert a batch of messages with a binary COPY, merging it if it holds rows already stored."""
+        if not messages:
+            return
+
+        queries = write_queries(self.table, type(messages[0]))
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    async with cursor.copy(queries.copy) as copy:
+                        copy.set_types(queries.types)
+                        for message in messages:
+                            await copy.write_row(message.as_row())
+                await conn.commit()
+        except UniqueViolation:
+            logger.warning(f"A batch of {len(messages)} messages holds rows already stored. Merging it instead.")
+            await self.merge_messages(messages)
+        except Exception as e:
+            raise RuntimeError(f"Failed to save {len(messages)} messages: {e}")
+
+    async def merge_messages(self, messages: list[Message]):
+        """Idempotently insert a batch of messages, skipping rows that already exist."""
+        if not messages:
+            return
+
+        queries = write_queries(self.table, type(messages[0]))
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(queries.create_staging)
+                    async with cursor.copy(queries.copy_staging) as copy:
+                        copy.set_types(queries.types)
+                        for message in messages:
+                            await copy.write_row(message.as_row())
+                    await cursor.execute(queries.merge)
+                await conn.commit()
+        except Exception as e:
+            raise RuntimeError(f"Failed to merge {len(messages)} messages: {e}")
+
+    async def save_events(self, events: list):
+        """Insert events (see ``src.analytics.Event``) into the events table."""
+        if not events:
+            return
+        query = f"INSERT INTO {self.table}_events ({EVENT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s);"
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(query, [event.as_row() for event in events])
+                await conn.commit()
+        except Exception as e:
+            raise RuntimeError(f"Failed to save {len(events)} events: {e}")
+
+
 if __name__ == "__main__":
     db = DBConnection(
         dbname=DB_NAME,
@@ -184,7 +909,8 @@ if __name__ == "__main__":
     )
 
     db.check_timescaledb()
-    db.create_hypertable(Message, index_columns=["electricity_currently_delivered"])
+    db.create_hypertable(Message)
+    db.create_continuous_aggregates()
 
     # Create a sample message
     sample_message = Message(
@@ -206,3 +932,9 @@ if __name__ == "__main__":
 
     # Save the message to the database
     db.save_message(sample_message)
+    print(f"Pool stats: {db.get_pool_stats()}")
+
+    # Read back the last day at 15 minute resolution
+    now = datetime.now(timezone.utc)
+    print(db.query(now - timedelta(days=1), now, resolution=timedelta(minutes=15), columns=["phase_voltage_l1"]))
+    db.close()
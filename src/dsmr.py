@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional
+from .mssg import Message, FIELD_SLOTS, DEFAULT_DEVICE
+from .schema import FIELDS
+
+# DSMR P1 telegram codes of the stored fields (see src/schema.py)
+OBIS_SLOTS = {field.obis: FIELD_SLOTS[field.name] for field in FIELDS if field.obis}
+TIMESTAMP_OBIS = "0-0:1.0.0"
+EQUIPMENT_OBIS = "0-0:96.1.1"
+
+# Telegram timestamps are local time, flagged W (winter, CET) or S (summer, CEST)
+DST_OFFSETS = {"W": timedelta(hours=1), "S": timedelta(hours=2)}
+
+
+def _crc16_table() -> tuple[int, ...]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """CRC16/ARC, as used by the DSMR 4+ telegrams."""
+    crc = 0
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a telegram timestamp (YYMMDDhhmmssX) to UTC."""
+    local = datetime(
+        2000 + int(value[0:2]), int(value[2:4]), int(value[4:6]), int(value[6:8]), int(value[8:10]), int(value[10:12])
+    )
+    return (local - DST_OFFSETS.get(value[12:13], DST_OFFSETS["W"])).replace(tzinfo=timezone.utc)
+
+
+def iter_telegrams(lines: Iterable[str]) -> Iterator[list[str]]:
+    """Split a stream of lines into telegrams, from the '/' header line to the '!' checksum line.
+
+    Lines before the first header (a log started mid-telegram) and unterminated telegrams are skipped.
+    """
+    telegram: Optional[list[str]] = None
+    for line in lines:
+        if line.startswith("/"):
+            telegram = [line]
+        elif telegram is not None:
+            telegram.append(line)
+            if line.startswith("!"):
+                yield telegram
+                telegram = None
+
+
+def verify_telegram(lines: list[str]) -> bool:
+    """Check the CRC of a telegram read with its original line endings. Telegrams without one (DSMR < 4) pass."""
+    checksum = lines[-1].strip()[1:]
+    if not checksum:
+        return True
+    data = "".join(lines[:-1]).encode("ascii", "replace") + b"!"
+    try:
+        return crc16(data) == int(checksum, 16)
+    except ValueError:
+        return False
+
+
+def parse_telegram(lines: list[str], device_id: Optional[str] = None) -> Optional[Message]:
+    """Build a message from the lines of a telegram, or return None if it carries no timestamp.
+
+    The device id defaults to the equipment identifier of the meter. Values keep the meter's units
+    (kWh, kW, V, A, m3), which are the units of the stored fields.
+    """
+    message = Message()
+    equipment_id = None
+    for line in lines:
+        code, _, rest = line.partition("(")
+        if not rest:
+            continue
+        if code[:2] == "0-" and code[2:4] != "0:":
+            code = "0-1" + code[3:]  # M-Bus devices (gas) may sit on any channel
+        slot = OBIS_SLOTS.get(code)
+        if slot is not None:
+            # The last group holds the value: gas readings are '(<timestamp>)(<value>*m3)'
+            value = rest[rest.rfind("(") + 1 :].rstrip().rstrip(")")
+            try:
+                message.set_field(slot, value.partition("*")[0])
+            except ValueError:
+                pass
+        elif code == TIMESTAMP_OBIS:
+            message.timestamp_utc = parse_timestamp(rest)
+        elif code == EQUIPMENT_OBIS and device_id is None:
+            equipment_id = rest.rstrip().rstrip(")")
+
+    if message.timestamp_utc is None:
+        return None
+    if device_id is None:
+        try:
+            device_id = bytes.fromhex(equipment_id).decode("ascii") if equipment_id else DEFAULT_DEVICE
+        except ValueError:
+            device_id = equipment_id
+    message.device_id = device_id
+    return message
@@ -0,0 +1,69 @@
+import threading
+from datetime import timedelta
+from typing import Optional
+from .mssg import Message, PAYLOAD_FIELDS, FIELD_SLOTS
+from .schema import FIELDS
+
+# Default deadband per field (see src/schema.py). Cumulative counters must change exactly.
+DEFAULT_DEADBANDS = {field.name: field.deadband for field in FIELDS}
+
+
+class DeadbandFilter:
+    """Drops readings that carry no new information before they reach the database.
+
+    A complete reading is stored only if a field moved by more than its deadband since the last
+    *stored* reading of the device (any change for the cumulative counters), or if ``keyframe_interval``
+    elapsed since then. Holding the last stored value therefore reconstructs every dropped reading
+    within the deadbands. Partial readings are always stored.
+    """
+
+    def __init__(
+        self,
+        deadbands: Optional[dict[str, float]] = None,
+        keyframe_interval: float | timedelta = 60,  # seconds
+    ):
+        deadbands = {**DEFAULT_DEADBANDS, **(deadbands or {})}
+        unknown = set(deadbands) - set(FIELD_SLOTS)
+        if unknown:
+            raise ValueError(f"Unknown deadband fields: {sorted(unknown)}")
+
+        self.deadbands = tuple(deadbands[name] for name in PAYLOAD_FIELDS)
+        if not isinstance(keyframe_interval, timedelta):
+            keyframe_interval = timedelta(seconds=keyframe_interval)
+        self.keyframe_interval = keyframe_interval
+
+        self._last: dict[str, Message] = {}  # Last stored reading per device
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.dropped = 0
+
+    def accept(self, message: Message) -> bool:
+        """Return True if the message must be stored, and remember it as the device's reference."""
+        with self._lock:
+            last = self._last.get(message.device_id)
+            if (
+                last is None
+                or not message.is_complete()
+                or message.timestamp_utc - last.timestamp_utc >= self.keyframe_interval
+                or self._changed(last, message)
+            ):
+                if message.is_complete():
+                    self._last[message.device_id] = message
+                self.accepted += 1
+                return True
+
+            self.dropped += 1
+            return False
+
+    def _changed(self, last: Message, message: Message) -> bool:
+        for previous, value, deadband in zip(last.as_row()[2:], message.as_row()[2:], self.deadbands):
+            if previous is None or value is None:
+                if previous is not value:  # An optional field appeared or went missing
+                    return True
+            elif abs(value - previous) > deadband:
+                return True
+        return False
+
+    def stats(self) -> dict:
+        """Return the number of readings stored and dropped."""
+        return {"accepted": self.accepted, "dropped": self.dropped, "devices": len(self._last)}
@@ -0,0 +1,105 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# A route returns (status code, content type, body). Prefix routes get the request path.
+Route = Callable[[], tuple[int, str, str | bytes]]
+PrefixRoute = Callable[[str], tuple[int, str, str | bytes]]
+
+
+def health_check(checks: dict[str, Callable[[], bool]]) -> Route:
+    """Route answering 200 when every check passes and 503 otherwise, with the result of each check as JSON."""
+
+    def handler() -> tuple[int, str, str]:
+        results = {}
+        for name, check in checks.items():
+            try:
+                results[name] = bool(check())
+            except Exception as e:
+                logger.error(f"Health check '{name}' failed: {e}")
+                results[name] = False
+        status = 200 if all(results.values()) else 503
+        return status, "application/json", json.dumps({"status": "ok" if status == 200 else "fail", **results})
+
+    return handler
+
+
+class StatusServer:
+    """Small HTTP server, on a background thread, exposing read-only endpoints such as ``/metrics``.
+
+    Handlers run on the server threads and never on the ingestion path.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108):
+        self.host = host
+        self.port = port
+        self._routes: dict[str, Route] = {}
+        self._prefix_routes: dict[str, PrefixRoute] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def route(self, path: str, handler: Route):
+        """Serve ``GET path`` with ``handler``."""
+        self._routes[path] = handler
+
+    def route_prefix(self, prefix: str, handler: PrefixRoute):
+        """Serve ``GET prefix`` and ``GET prefix/...`` with ``handler``, called with the path."""
+        self._prefix_routes[prefix.rstrip("/")] = handler
+
+    def start(self):
+        """Bind the port and serve requests in a daemon thread."""
+        routes = self._routes
+        prefix_routes = self._prefix_routes
+
+        def resolve(path: str) -> Optional[Callable[[], tuple[int, str, str | bytes]]]:
+            if path in routes:
+                return routes[path]
+            prefix = path
+            while prefix:
+                if prefix in prefix_routes:
+                    handler = prefix_routes[prefix]
+                    return lambda: handler(path)
+                prefix = prefix.rpartition("/")[0]
+            return None
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                handler = resolve(self.path.split("?", 1)[0])
+                if handler is None:
+                    status, content_type, body = 404, "text/plain", "Not found\n"
+                else:
+                    try:
+                        status, content_type, body = handler()
+                    except Exception as e:
+                        logger.error(f"Error while serving {self.path}: {e}")
+                        status, content_type, body = 500, "text/plain", "Internal error\n"
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the application log
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="status-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Status server listening on http://{self.host}:{self._server.server_port}")
+
+    def stop(self):
+        """Stop serving and release the port."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,179 @@
+import json
+import threading
+from array import array
+from datetime import datetime, timezone
+from math import isnan, nan
+from typing import Callable, Optional
+from .mssg import Message, PAYLOAD_FIELDS, FIELD_SLOTS
+
+# Fields kept in the rolling window of each device
+DEFAULT_WINDOW_FIELDS = (
+    "electricity_currently_delivered",
+    "electricity_currently_returned",
+    "phase_voltage_l1",
+    "phase_voltage_l2",
+    "phase_voltage_l3",
+)
+
+
+class RingBuffer:
+    """Fixed-size window of rows of floats in one preallocated ``array('d')``, overwriting the oldest row.
+
+    Appends are serialized by a lock. The write position is advanced after the row is written, so
+    readers without a lock see complete rows (at worst, the oldest one was just overwritten).
+    """
+
+    def __init__(self, size: int, width: int):
+        self.size = size
+        self.width = width
+        self._data = array("d", [nan] * (size * width))
+        self._written = 0  # Rows ever appended
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self._written, self.size)
+
+    def append(self, row):
+        values = array("d", row)
+        with self._lock:
+            start = (self._written % self.size) * self.width
+            self._data[start : start + self.width] = values
+            self._written += 1
+
+    def rows(self) -> list[tuple[float, ...]]:
+        """Return the rows, oldest first."""
+        written = self._written
+        data = self._data[:]
+        first = written - min(written, self.size)
+        return [
+            tuple(data[(index % self.size) * self.width : (index % self.size + 1) * self.width])
+            for index in range(first, written)
+        ]
+
+
+class _DeviceState:
+    __slots__ = ("complete", "partial", "window")
+
+    def __init__(self, window: Optional[RingBuffer]):
+        self.complete: Optional[Message] = None
+        self.partial: Optional[Message] = None
+        self.window = window
+
+
+class LiveCache:
+    """Latest readings per device, kept in memory for live dashboards.
+
+    Holds the last complete and the last partial ``Message`` of each device, plus a rolling window
+    of ``window_fields`` over the last ``window_size`` complete messages. Updates come from the MQTT
+    thread and from the scheduler thread (timed-out messages), so they take a lock; they only replace
+    references and append to the device's ring buffer, so readers never do. ``pending`` can return
+    the fields received so far for a device (see ``MessageAssembler.pending``).
+    """
+
+    def __init__(
+        self,
+        window_size: int = 300,
+        window_fields: tuple[str, ...] = DEFAULT_WINDOW_FIELDS,
+        pending: Optional[Callable[[str], Optional[tuple[dict, float]]]] = None,
+    ):
+        unknown = set(window_fields) - set(FIELD_SLOTS)
+        if unknown:
+            raise ValueError(f"Unknown window fields: {sorted(unknown)}")
+        self.window_size = window_size
+        self.window_fields = tuple(window_fields)
+        self._window_slots = tuple(FIELD_SLOTS[name] for name in self.window_fields)
+        self.pending = pending
+        self._devices: dict[str, _DeviceState] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def update(self, message: Message, complete: bool):
+        """Record an assembled message. Called from the ingestion and the timeout threads."""
+        with self._lock:
+            state = self._devices.get(message.device_id)
+            if state is None:
+                window = RingBuffer(self.window_size, 1 + len(self._window_slots)) if self.window_size else None
+                state = self._devices[message.device_id] = _DeviceState(window)
+
+            if not complete:
+                state.partial = message
+                return
+            state.complete = message
+            if state.window is not None:
+                row = message.as_row()
+                state.window.append(
+                    (message.timestamp_utc.timestamp(), *(_nan_if_none(row[2 + slot]) for slot in self._window_slots))
+                )
+
+    def devices(self) -> dict:
+        """Last complete reading of every device."""
+        now = datetime.now(timezone.utc)
+        return {
+            device_id: _message_json(state.complete, now)
+            for device_id, state in list(self._devices.items())
+            if state.complete is not None
+        }
+
+    def device(self, device_id: str) -> Optional[dict]:
+        """Last complete and partial readings of a device, and the fields of its message being assembled."""
+        state = self._devices.get(device_id)
+        pending = self.pending(device_id) if self.pending is not None else None
+        if state is None and pending is None:
+            return None
+
+        now = datetime.now(timezone.utc)
+        result = {
+            "device_id": device_id,
+            "complete": _message_json(state.complete, now) if state is not None else None,
+            "partial": _message_json(state.partial, now) if state is not None else None,
+            "pending": None,
+        }
+        if pending is not None:
+            fields, age = pending
+            result["pending"] = {"age_s": round(age, 3), **fields}
+        return result
+
+    def window(self, device_id: str) -> Optional[dict]:
+        """Rolling window of a device as columns, oldest first."""
+        state = self._devices.get(device_id)
+        if state is None or state.window is None:
+            return None
+        rows = state.window.rows()
+        columns = list(zip(*rows)) if rows else [()] * (1 + len(self.window_fields))
+        result = {"time": [datetime.fromtimestamp(t, timezone.utc).isoformat() for t in columns[0]]}
+        for name, values in zip(self.window_fields, columns[1:]):
+            result[name] = [None if isnan(value) else value for value in values]
+        return result
+
+    def http_route(self, path: str) -> tuple[int, str, str]:
+        """Serve ``/live``, ``/live/<device>`` and ``/live/<device>/window`` as JSON."""
+        parts = [part for part in path.split("/") if part][1:]  # Drop the 'live' prefix
+        if not parts:
+            body = self.devices()
+        elif len(parts) == 1:
+            body = self.device(parts[0])
+        elif len(parts) == 2 and parts[1] == "window":
+            body = self.window(parts[0])
+        else:
+            body = None
+        if body is None:
+            return 404, "application/json", json.dumps({"error": "not found"})
+        return 200, "application/json", json.dumps(body)
+
+
+def _nan_if_none(value: Optional[float]) -> float:
+    return nan if value is None else value
+
+
+def _message_json(message: Optional[Message], now: datetime) -> Optional[dict]:
+    if message is None:
+        return None
+    row = message.as_row()
+    fields = {name: value for name, value in zip(PAYLOAD_FIELDS, row[2:]) if value is not None}
+    return {
+        "time": message.timestamp_utc.isoformat(),
+        "age_s": round((now - message.timestamp_utc).total_seconds(), 3),
+        **fields,
+    }
@@ -1,7 +1,12 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import functools
 from pathlib import Path
+from time import monotonic
 
 
 import sys
@@ -10,15 +15,47 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 LOG_DIR = BASE_DIR / "logs"
 LOG_DIR.mkdir(exist_ok=True)
 
-def setup_logger(name: str,
-                 log_file: str = 'smart-meter.log',
-                 max_bytes: int = 5_000_000,
-                 backup_count: int =5) -> logging.Logger:
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Hand the records to a background thread so stdout/disk I/O never runs on the caller's thread
+LOG_NON_BLOCKING = os.getenv("LOG_NON_BLOCKING", "true").lower() == "true"
+
+_listeners: dict[str, tuple[QueueHandler, QueueListener]] = {}
+_listeners_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site: lets through ``burst`` records, then ``rate`` records per second.
+
+    Records dropped since the last one let through are counted in the next one.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 10):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[tuple, list] = {}  # call site -> [tokens, last update, dropped]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = monotonic()
+        key = (record.pathname, record.lineno)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now, 0]
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.msg} [{bucket[2]} similar messages suppressed]"
+            bucket[2] = 0
+        return True
 
-    logger = logging.getLogger(name)
-    logger.setLevel("INFO")
-    logger.handlers.clear()
 
+def _build_handlers(log_file: str, max_bytes: int, backup_count: int) -> list[logging.Handler]:
     prd_format = "%(asctime)s - %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
 
     formatter = logging.Formatter(fmt=prd_format)
@@ -26,13 +63,53 @@ def setup_logger(name: str,
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
 
     # File handler (rotating)
     log_path = LOG_DIR / log_file
     file_handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    return [console_handler, file_handler]
+
+
+def _get_queue_handler(log_file: str, max_bytes: int, backup_count: int) -> QueueHandler:
+    """Return the queue handler of the (shared) background listener writing to ``log_file``."""
+    with _listeners_lock:
+        if log_file not in _listeners:
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            listener = QueueListener(
+                log_queue, *_build_handlers(log_file, max_bytes, backup_count), respect_handler_level=True
+            )
+            listener.start()
+            _listeners[log_file] = (QueueHandler(log_queue), listener)
+        return _listeners[log_file][0]
+
+
+@atexit.register
+def stop_logging():
+    """Flush and stop the background log listeners."""
+    with _listeners_lock:
+        for _, listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+def setup_logger(name: str,
+                 log_file: str = 'smart-meter.log',
+                 max_bytes: int = 5_000_000,
+                 backup_count: int =5,
+                 level: str = LOG_LEVEL,
+                 non_blocking: bool = LOG_NON_BLOCKING) -> logging.Logger:
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.handlers.clear()
+
+    if non_blocking:
+        logger.addHandler(_get_queue_handler(log_file, max_bytes, backup_count))
+    else:
+        for handler in _build_handlers(log_file, max_bytes, backup_count):
+            logger.addHandler(handler)
 
     return logger
 
@@ -47,4 +124,4 @@ def log_function_call(func, logger):
         result = func(*args, **kwargs)
         logger.info(f"Function {func.__name__} finished execution")
         return result
-    return wrapper
\ No newline at end of file
+    return wrapper
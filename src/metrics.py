@@ -0,0 +1,213 @@
+import threading
+from bisect import bisect_left
+from time import monotonic
+from typing import Callable, Optional
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond callbacks up to slow database commits
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: list = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class _Metric:
+    """Base of the metric types: an optional set of label names, one child per label values."""
+
+    TYPE = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._labels: dict = {}
+        self._children: dict[tuple, "_Metric"] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values: str) -> "_Metric":
+        """Return the child metric for the given label values. Keep it around on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    child._labels = dict(zip(self.labelnames, values))
+                    self._children[values] = child
+        return child
+
+    def samples(self) -> list[str]:
+        if not self.labelnames:
+            return self._samples(self.name)
+        return [line for child in list(self._children.values()) for line in child._samples(self.name)]
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def _samples(self, name: str) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, exposed as ``<name>_total`` in the metadata and the samples alike."""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), registry: Optional[Registry] = REGISTRY):
+        if not name.endswith("_total"):
+            name = f"{name}_total"
+        super().__init__(name, help, labelnames, registry)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.help, registry=None)
+
+    def _samples(self, name: str) -> list[str]:
+        return [f"{name}{_format_labels(self._labels)} {self.value}"]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down. With ``set_function`` it is read only when scraped."""
+
+    TYPE = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.help, registry=None)
+
+    def _samples(self, name: str) -> list[str]:
+        value = self.value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return []
+        return [f"{name}{_format_labels(self._labels)} {value}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed, cumulative buckets."""
+
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets, registry=None)
+
+    def _samples(self, name: str) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            labels = _format_labels({**self._labels, "le": bound})
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self._labels)
+        lines.append(f"{name}_sum{labels} {total}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+# Ingestion pipeline metrics: MQTT receive -> message assembly -> write queue -> database commit
+MESSAGES_RECEIVED = Counter("smart_meter_mqtt_messages_received", "MQTT payloads received.")
+MESSAGES_UNROUTED = Counter("smart_meter_mqtt_messages_unrouted", "MQTT payloads on topics that map to no field.")
+MESSAGES_ASSEMBLED = Counter(
+    "smart_meter_messages_assembled", "Device messages emitted by the assembler.", ("kind",)
+)
+ASSEMBLY_TIMEOUTS = Counter("smart_meter_assembly_timeouts", "Device messages ended by their timeout, complete or partial.")
+ASSEMBLY_SECONDS = Histogram(
+    "smart_meter_assembly_seconds", "Time from the first field of a device message to its emission."
+)
+QUEUE_DEPTH = Gauge("smart_meter_write_queue_depth", "Messages waiting in the write queue.")
+QUEUE_WAIT_SECONDS = Histogram(
+    "smart_meter_write_queue_wait_seconds", "Time from queueing a message to committing its batch."
+)
+DB_COMMIT_SECONDS = Histogram("smart_meter_db_commit_seconds", "Duration of a batch write to the database.")
+DB_MESSAGES_WRITTEN = Counter("smart_meter_db_messages_written", "Messages committed to the database.")
+DB_ERRORS = Counter("smart_meter_db_errors", "Failed database operations.", ("operation",))
+MQTT_RECONNECTS = Counter("smart_meter_mqtt_reconnect_attempts", "Attempts to reconnect to the MQTT broker.")
+MQTT_CONNECTED = Gauge("smart_meter_mqtt_connected", "1 while connected to the MQTT broker.")
+MQTT_RECOVERY_SECONDS = Histogram(
+    "smart_meter_mqtt_recovery_seconds",
+    "Time from losing the MQTT connection to being connected again.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+ANALYTICS_EVENTS = Counter("smart_meter_analytics_events", "Events detected on the reading stream.", ("kind",))
+ANALYTICS_DROPPED = Counter(
+    "smart_meter_analytics_dropped", "Readings skipped by the analytics stage because its queue was full."
+)
+STARTUP_SECONDS = Gauge("smart_meter_startup_phase_seconds", "Duration of each phase of the last startup.", ("phase",))
+
+
+def record_startup_phase(phase: str, started: float, detail: str = ""):
+    """Record and log the duration of a startup phase that began at monotonic time ``started``."""
+    seconds = monotonic() - started
+    STARTUP_SECONDS.labels(phase).set(seconds)
+    logger.info(f"Startup phase '{phase}' took {seconds:.3f} seconds{f' ({detail})' if detail else ''}.")
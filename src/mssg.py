@@ -1,37 +1,151 @@
 from datetime import datetime, timezone
-from dataclasses import dataclass, fields, field, asdict
+from dataclasses import dataclass, field, asdict
+from array import array
+import functools
+from math import nan
 import json
-from dateutil import parser
+from .parser import compile_parser
+from .schema import FIELDS
+from typing import Optional
+
+DEFAULT_DEVICE = "default"  # Device id used when the MQTT topic does not identify the meter
+
+
+# Payload fields of a Message in column order (timestamp and device id come first), see src/schema.py
+PAYLOAD_FIELDS = tuple(field.name for field in FIELDS)
+FIELD_SLOTS = {name: slot for slot, name in enumerate(PAYLOAD_FIELDS)}
+COMPLETE_MASK = sum(1 << slot for slot, field in enumerate(FIELDS) if field.required)
+ALL_FIELDS_MASK = (1 << len(PAYLOAD_FIELDS)) - 1
+_EMPTY_VALUES = array("d", [nan] * len(PAYLOAD_FIELDS))
+
+
+@functools.cache
+def _unset_slots(mask: int) -> tuple[int, ...]:
+    """Slots of the fields missing from a presence mask. Only a handful of masks occur in practice."""
+    return tuple(slot for slot in range(len(PAYLOAD_FIELDS)) if not mask >> slot & 1)
 
 
-@dataclass
 class Message:
-    """Dataclass to represent the relevant smart meter data from the MQTT broker"""
-
-    timestamp_utc: datetime = None
-    electricity_delivered_1: float = None
-    electricity_delivered_2: float = None
-    electricity_returned_1: float = None
-    electricity_returned_2: float = None
-    electricity_currently_delivered: float = None
-    electricity_currently_returned: float = None
-    phase_currently_delivered_l1: float = None
-    phase_currently_delivered_l2: float = None
-    phase_currently_delivered_l3: float = None
-    phase_voltage_l1: float = None
-    phase_voltage_l2: float = None
-    phase_voltage_l3: float = None
-    delivered: float = None  # Gas
-
-    def is_complete(self) -> bool:
-        """Check if all fields (except timestamp) are populated."""
-
-        # noinspection PyUnresolvedReferences
-        return all(
-            getattr(self, field.name) is not None
-            for field in self.__dataclass_fields__.values()
-            if field.name != "timestamp_utc"
-        )
+    """Relevant smart meter data from the MQTT broker, stored as a fixed-width array of floats.
+
+    Payloads are parsed to float when they are set; a bitmask tracks which fields are populated,
+    so unset fields are reported as None. Fields are also readable as attributes (``message.delivered``).
+    """
+
+    __slots__ = ("timestamp_utc", "device_id", "_values", "_mask")
+
+    METADATA_FIELDS = ("timestamp_utc", "device_id")
+    COLUMNS = (("timestamp_utc", datetime), ("device_id", str)) + tuple(
+        (name, float) for name in PAYLOAD_FIELDS
+    )
+
+    def __init__(
+        self,
+        timestamp_utc: Optional[datetime] = None,
+        device_id: str = DEFAULT_DEVICE,
+        **values,
+    ):
+        self.timestamp_utc = timestamp_utc
+        self.device_id = device_id
+        self._values = _EMPTY_VALUES[:]
+        self._mask = 0
+        for name, value in values.items():
+            if name not in FIELD_SLOTS:
+                raise TypeError(f"Message got an unexpected field '{name}'")
+            if value is not None:
+                self.set_field(FIELD_SLOTS[name], value)
+
+    def set_field(self, slot: int, value: str | bytes | float):
+        """Parse and set the payload field at ``slot`` (see ``FIELD_SLOTS``) and mark it as populated."""
+        self._values[slot] = float(value)
+        self._mask |= 1 << slot
+
+    def get_field(self, slot: int) -> Optional[float]:
+        """Return the payload field at ``slot``, or None if it was not set."""
+        return self._values[slot] if self._mask >> slot & 1 else None
+
+    def values(self) -> array:
+        """Return the field values in slot order, NaN when unset. This is the message's own buffer, not a copy."""
+        return self._values
+
+    @property
+    def mask(self) -> int:
+        """Bitmask of the populated fields, bit ``slot`` set for each one (see ``FIELD_SLOTS``)."""
+        return self._mask
+
+    def is_complete(self, expected: int = COMPLETE_MASK) -> bool:
+        """Check if all the required fields (or all the fields of the ``expected`` mask) are populated."""
+        return self._mask & expected == expected
+
+    def as_row(self) -> tuple:
+        """Return the field values in column order, ready for a batch writer."""
+        if self._mask == ALL_FIELDS_MASK:
+            return self.timestamp_utc, self.device_id, *self._values
+        values = self._values.tolist()
+        for slot in _unset_slots(self._mask):
+            values[slot] = None
+        return self.timestamp_utc, self.device_id, *values
+
+    def as_dict(self) -> dict:
+        """Return the fields as a dictionary in column order."""
+        return dict(zip((name for name, _ in self.COLUMNS), self.as_row()))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Message":
+        """Build a message from a tuple in column order, as returned by ``as_row``.
+
+        Rows encoded before fields were appended to the schema are shorter; the missing fields are unset.
+        """
+        timestamp_utc, device_id, *values = row
+        message = cls(timestamp_utc, device_id)
+        for slot, value in enumerate(values):
+            if value is not None:
+                message.set_field(slot, value)
+        return message
+
+    @staticmethod
+    def to_records(messages: list["Message"]):
+        """Pack messages into a NumPy structured array (requires numpy). Unset fields are NaN."""
+        import numpy as np
+
+        dtype = [("timestamp_utc", "datetime64[us]"), ("device_id", object)] + [
+            (name, "f8") for name in PAYLOAD_FIELDS
+        ]
+        records = np.empty(len(messages), dtype=dtype)
+        records["timestamp_utc"] = [
+            np.datetime64(message.timestamp_utc.replace(tzinfo=None), "us")
+            if message.timestamp_utc is not None
+            else np.datetime64("NaT")
+            for message in messages
+        ]
+        records["device_id"] = [message.device_id for message in messages]
+        values = np.frombuffer(
+            b"".join(message._values.tobytes() for message in messages), dtype="f8"
+        ).reshape(len(messages), len(PAYLOAD_FIELDS))
+        for slot, name in enumerate(PAYLOAD_FIELDS):
+            records[name] = values[:, slot]
+        return records
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return self.as_row() == other.as_row()
+
+    def __repr__(self) -> str:
+        fields_repr = ", ".join(f"{name}={value!r}" for name, value in self.as_dict().items())
+        return f"Message({fields_repr})"
+
+
+def _field_property(slot: int) -> property:
+    return property(
+        lambda self: self.get_field(slot),
+        lambda self, value: self.set_field(slot, value),
+        doc=f"Payload field '{PAYLOAD_FIELDS[slot]}'.",
+    )
+
+
+for _slot, _name in enumerate(PAYLOAD_FIELDS):
+    setattr(Message, _name, _field_property(_slot))
 
 
 @dataclass
@@ -81,27 +195,38 @@ class Reading:
     )
 
     def __post_init__(self):
-        # Type conversion map for easier management
-        type_conversion = {
-            float: float,
-            int: int,
-            bool: lambda x: x.lower() == "true",
-            datetime: lambda x: parser.parse(x) if isinstance(x, str) else x,
-        }
-
-        for field in fields(self):
-            value = getattr(self, field.name)
-            field_type = field.type
-
-            # Convert value only if it's not already of the correct type
+        # Converters are compiled once per dataclass, see src/parser.py
+        parser = compile_parser(type(self))
+        for name, field_type, converter in parser.converters:
+            value = getattr(self, name)
             if not isinstance(value, field_type):
-                try:
-                    converter = type_conversion.get(field_type)
-                    setattr(self, field.name, converter(value))
-                except Exception as e:
-                    raise ValueError(
-                        f"Error converting field '{field.name}' with value '{value}' to {field_type}: {e}"
-                    )
+                setattr(self, name, parser.convert(name, field_type, converter, value))
+
+    def to_message(self, device_id: Optional[str] = None) -> Message:
+        """Map the reading onto the fields stored from MQTT. The device id defaults to the gateway MAC address."""
+        message = Message(
+            timestamp_utc=self.time_stamp.replace(microsecond=0),
+            device_id=device_id or self.mac_address,
+        )
+        for slot, name in READING_SLOTS:
+            message.set_field(slot, getattr(self, name))
+        return message
+
+    @classmethod
+    def from_json(cls, json_data: dict) -> "Reading":
+        """Build a reading from the gateway JSON, ignoring the keys that are not Reading fields."""
+        return compile_parser(cls).parse(json_data)
 
     def __repr__(self):
         return json.dumps(asdict(self), indent=4, default=str)
+
+
+READING_FIELDS = compile_parser(Reading).field_names
+
+# Reading field that provides each Message payload field
+READING_TO_MESSAGE = {field.name: field.reading for field in FIELDS if field.reading is not None}
+READING_SLOTS = tuple((FIELD_SLOTS[name], reading) for name, reading in READING_TO_MESSAGE.items())
+
+_unknown = set(READING_TO_MESSAGE.values()) - READING_FIELDS
+if _unknown:
+    raise ValueError(f"Schema fields map to unknown Reading fields: {sorted(_unknown)}")
@@ -0,0 +1,124 @@
+import functools
+from array import array
+from dataclasses import fields, MISSING
+from datetime import datetime
+from math import nan
+from typing import Any, Callable
+
+
+def parse_datetime(value: str | datetime) -> datetime:
+    """Parse an ISO-8601 timestamp, falling back to dateutil only for other formats."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil import parser
+
+        return parser.parse(value)
+
+
+def parse_bool(value: str | bool) -> bool:
+    return value if isinstance(value, bool) else value.lower() == "true"
+
+
+CONVERTERS: dict[type, Callable[[Any], Any]] = {
+    float: float,
+    int: int,
+    bool: parse_bool,
+    str: str,
+    datetime: parse_datetime,
+}
+
+
+class DataclassParser:
+    """Parser compiled once per dataclass from its fields: a tuple of (name, type, converter, default).
+
+    Parsing a payload applies the converters without any per-instance reflection. Use
+    ``compile_parser`` to get the cached parser of a dataclass.
+    """
+
+    def __init__(self, cls: type):
+        self.cls = cls
+        self.fields = tuple(
+            (
+                field.name,
+                field.type,
+                CONVERTERS[field.type],
+                field.default_factory if field.default_factory is not MISSING else field.default,
+                field.default_factory is not MISSING,
+            )
+            for field in fields(cls)
+        )
+        self.field_names = frozenset(name for name, *_ in self.fields)
+        self.converters = tuple((name, field_type, converter) for name, field_type, converter, *_ in self.fields)
+
+    @staticmethod
+    def convert(name: str, field_type: type, converter: Callable, value):
+        """Convert a value to the field type, unless it already is of that type."""
+        if isinstance(value, field_type):
+            return value
+        try:
+            return converter(value)
+        except Exception as e:
+            raise ValueError(
+                f"Error converting field '{name}' with value '{value}' to {field_type}: {e}"
+            )
+
+    def parse(self, json_data: dict):
+        """Build an instance from a JSON dictionary, ignoring keys that are not fields."""
+        values = {}
+        for name, field_type, converter, default, is_factory in self.fields:
+            value = json_data.get(name, MISSING)
+            if value is MISSING:
+                if is_factory:
+                    value = default()
+                elif default is MISSING:
+                    raise TypeError(f"{self.cls.__name__} is missing the field '{name}'")
+                else:
+                    value = default
+            elif value.__class__ is not field_type:
+                value = self.convert(name, field_type, converter, value)
+            values[name] = value
+
+        # The values are already converted: skip __init__/__post_init__
+        instance = self.cls.__new__(self.cls)
+        instance.__dict__.update(values)
+        return instance
+
+    def parse_batch(self, payloads: list[dict]) -> dict[str, array | list]:
+        """Parse many JSON payloads into columns: ``array('d')`` for float fields, lists otherwise.
+
+        Missing float values are NaN, other missing values take the field default (or None). The
+        payloads are parsed one column at a time, so each field is looked up once per batch and a
+        float column without missing values is converted in a single pass.
+        """
+        columns = {}
+        for name, field_type, converter, default, is_factory in self.fields:
+            values = [json_data.get(name, MISSING) for json_data in payloads]
+            if field_type is float:
+                try:
+                    columns[name] = array("d", map(float, values))
+                    continue
+                except (TypeError, ValueError):
+                    pass  # Missing or invalid values: convert them one by one below
+            column = []
+            for value in values:
+                if value is MISSING:
+                    if field_type is float:
+                        value = nan
+                    elif is_factory:
+                        value = default()
+                    else:
+                        value = None if default is MISSING else default
+                elif value.__class__ is not field_type:
+                    value = self.convert(name, field_type, converter, value)
+                column.append(value)
+            columns[name] = array("d", column) if field_type is float else column
+        return columns
+
+
+@functools.cache
+def compile_parser(cls: type) -> DataclassParser:
+    """Return the parser of a dataclass, compiled on first use."""
+    return DataclassParser(cls)
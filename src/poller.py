@@ -0,0 +1,121 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Callable, Optional
+import requests
+from .mssg import Reading
+from .scheduler import TimerScheduler
+from .logger import setup_logger, RateLimitFilter
+
+logger = setup_logger(__name__)
+logger.addFilter(RateLimitFilter())
+
+
+@dataclass
+class Gateway:
+    """Polling state of one REST-API gateway."""
+
+    url: str
+    interval: float
+    session: requests.Session = field(default_factory=requests.Session, repr=False)
+    failures: int = 0
+    last_latency: float = 0.0
+    polls: int = 0
+
+
+class GatewayPoller:
+    """Polls many REST-API gateways concurrently and hands every parsed ``Reading`` to ``on_reading``.
+
+    Each gateway keeps its own HTTP keep-alive session and is scheduled independently on a shared
+    ``TimerScheduler``; the requests run on a bounded thread pool. The interval of a gateway adapts:
+    it backs off exponentially while the gateway fails, is stretched when responses are slow, and
+    every schedule is jittered so the gateways do not poll in lockstep.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        on_reading: Callable[[str, Reading], None],
+        interval: float = 3.0,  # seconds
+        max_interval: float = 60.0,  # seconds
+        timeout: float = 2.0,  # seconds per request
+        jitter: float = 0.1,  # fraction of the interval
+        workers: int = 8,
+    ):
+        self.on_reading = on_reading  # Called with (gateway url, reading)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.workers = workers
+
+        self.gateways = [Gateway(url, interval) for url in urls]
+        self.scheduler = TimerScheduler()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Start polling. The first polls are spread over one interval."""
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gateway-poller")
+        self.scheduler.start()
+        for gateway in self.gateways:
+            self._schedule(gateway, random.uniform(0, self.interval))
+        logger.info(f"Polling {len(self.gateways)} gateway(s) every {self.interval} seconds.")
+
+    def stop(self):
+        """Stop polling and wait for the requests in flight."""
+        self._stop_event.set()
+        self.scheduler.stop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for gateway in self.gateways:
+            gateway.session.close()
+
+    def stats(self) -> list[dict]:
+        """Return the polling state of each gateway."""
+        return [
+            {
+                "url": gateway.url,
+                "interval": gateway.interval,
+                "failures": gateway.failures,
+                "latency": gateway.last_latency,
+                "polls": gateway.polls,
+            }
+            for gateway in self.gateways
+        ]
+
+    def _schedule(self, gateway: Gateway, delay: float):
+        if not self._stop_event.is_set():
+            self.scheduler.schedule(gateway.url, delay, lambda: self._submit(gateway))
+
+    def _submit(self, gateway: Gateway):
+        if not self._stop_event.is_set():
+            self._executor.submit(self._poll, gateway)
+
+    def _poll(self, gateway: Gateway):
+        start = monotonic()
+        try:
+            response = gateway.session.get(gateway.url, timeout=self.timeout)
+            response.raise_for_status()
+            reading = Reading.from_json(response.json())
+            gateway.last_latency = monotonic() - start
+            gateway.failures = 0
+            # A slow gateway is not polled faster than twice its response time
+            gateway.interval = min(self.max_interval, max(self.interval, 2 * gateway.last_latency))
+            self.on_reading(gateway.url, reading)
+        except Exception as e:
+            gateway.failures += 1
+            # Capped exponent: past ~1000 failures the power of two no longer fits in a float
+            gateway.interval = min(self.max_interval, self.interval * 2 ** min(gateway.failures, 16))
+            logger.warning(
+                f"Polling {gateway.url} failed ({gateway.failures} in a row): {e}. "
+                f"Next attempt in {gateway.interval:.1f} seconds."
+            )
+        finally:
+            gateway.polls += 1
+            delay = gateway.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._schedule(gateway, max(0.0, delay - (monotonic() - start)))
@@ -0,0 +1,98 @@
+from typing import Optional
+from .mssg import DEFAULT_DEVICE, FIELD_SLOTS
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DEVICE_PLACEHOLDER = "{device}"
+
+
+class _Node:
+    __slots__ = ("children", "plus", "device", "rest")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.plus: Optional[_Node] = None  # '+' level
+        self.device: Optional[_Node] = None  # '{device}' level, a '+' that captures the device id
+        self.rest = False  # '#' level: the remaining levels are the Message field name
+
+
+class TopicRouter:
+    """Routes received MQTT topics to a ``(device id, Message field slot)`` pair.
+
+    The root topic templates are compiled once into a trie over the topic levels. Templates may
+    use the ``+`` wildcard and a ``{device}`` level carrying the meter id (subscribed as ``+``), and
+    must end with ``#``, which matches the field name. Resolved topics are memoized, so routing a
+    topic seen before is a single dict lookup.
+    """
+
+    def __init__(self, templates: list[str], max_cache: int = 100_000):
+        self._root = _Node()
+        self._cache: dict[str, Optional[tuple[str, int]]] = {}
+        self.max_cache = max_cache
+        self.subscriptions = [self.add(template) for template in templates]
+
+        with_device = [template for template in templates if DEVICE_PLACEHOLDER in template]
+        if with_device and len(with_device) < len(templates):
+            without = [template for template in templates if DEVICE_PLACEHOLDER not in template]
+            logger.warning(
+                f"Topic templates {without} have no {DEVICE_PLACEHOLDER} level: their fields go to the "
+                f"'{DEFAULT_DEVICE}' device, so the readings of {with_device} are never complete."
+            )
+
+    def add(self, template: str) -> str:
+        """Compile a root topic template into the trie and return its MQTT subscription."""
+        levels = template.split("/")
+        if levels[-1] != "#" or "#" in levels[:-1]:
+            raise ValueError(f"Topic template '{template}' must end with the '#' wildcard.")
+
+        node = self._root
+        for level in levels[:-1]:
+            if level == DEVICE_PLACEHOLDER:
+                node.device = node.device or _Node()
+                node = node.device
+            elif level == "+":
+                node.plus = node.plus or _Node()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _Node())
+        node.rest = True
+
+        self._cache.clear()
+        return template.replace(DEVICE_PLACEHOLDER, "+")
+
+    def route(self, topic: str) -> Optional[tuple[str, int]]:
+        """Return ``(device id, field slot)`` for a topic, or None if it is not routed to a Message field."""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+
+        route = self._match(topic.split("/"), 0, self._root, None)
+        if len(self._cache) < self.max_cache:
+            self._cache[topic] = route
+        return route
+
+    def _match(
+        self, levels: list[str], index: int, node: _Node, device: Optional[str]
+    ) -> Optional[tuple[str, int]]:
+        if node.rest and index < len(levels):
+            slot = FIELD_SLOTS.get("/".join(levels[index:]))
+            if slot is not None:
+                return device or DEFAULT_DEVICE, slot
+        if index == len(levels):
+            return None
+
+        level = levels[index]
+        child = node.children.get(level)
+        if child is not None:
+            route = self._match(levels, index + 1, child, device)
+            if route is not None:
+                return route
+        if node.device is not None:
+            route = self._match(levels, index + 1, node.device, level)
+            if route is not None:
+                return route
+        if node.plus is not None:
+            return self._match(levels, index + 1, node.plus, device)
+        return None
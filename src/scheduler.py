@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import threading
+from time import monotonic
+from typing import Callable, Hashable, Optional
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class TimerScheduler:
+    """Single background thread that fires keyed deadlines, replacing one ``threading.Timer`` per deadline.
+
+    Deadlines live in a heap. Pushing a key's deadline further away (the common case, a new
+    MQTT message arrived) only updates its entry; the heap is touched again when the stale
+    deadline surfaces, so rescheduling is O(1) and firing is O(log n).
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, Hashable]] = []
+        # key -> [deadline, callback, heap sequence, heap deadline]
+        self._entries: dict[Hashable, list] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start(self):
+        """Start the scheduler thread."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="timer-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the scheduler thread. Pending deadlines are discarded."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], None]):
+        """Call ``callback`` after ``delay`` seconds, replacing any pending deadline for ``key``."""
+        deadline = monotonic() + delay
+        with self._condition:
+            entry = self._entries.get(key)
+            if entry is not None and deadline >= entry[3]:
+                entry[0] = deadline
+                entry[1] = callback
+                return
+
+            sequence = next(self._sequence)
+            self._entries[key] = [deadline, callback, sequence, deadline]
+            heapq.heappush(self._heap, (deadline, sequence, key))
+            if self._heap[0][1] == sequence:
+                self._condition.notify()
+
+    def cancel(self, key: Hashable):
+        """Drop the pending deadline for ``key``, if any."""
+        with self._condition:
+            self._entries.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                callback = self._next_due()
+                if callback is None:
+                    return
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in scheduled callback: {e}")
+
+    def _next_due(self) -> Optional[Callable[[], None]]:
+        """Wait (holding the condition) until a deadline is due and return its callback."""
+        while not self._stopped:
+            if not self._heap:
+                self._condition.wait()
+                continue
+
+            heap_deadline, sequence, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != sequence:
+                heapq.heappop(self._heap)  # Cancelled or superseded by an earlier deadline
+                continue
+
+            now = monotonic()
+            if heap_deadline > now:
+                self._condition.wait(heap_deadline - now)
+                continue
+
+            heapq.heappop(self._heap)
+            deadline = entry[0]
+            if deadline > now:
+                # The deadline was pushed back while queued: requeue it at its current value
+                entry[2] = next(self._sequence)
+                entry[3] = deadline
+                heapq.heappush(self._heap, (deadline, entry[2], key))
+                continue
+
+            del self._entries[key]
+            return entry[1]
+        return None
+
+
+class LoopScheduler:
+    """Counterpart of ``TimerScheduler`` for asyncio: fires keyed deadlines as callbacks on the event loop.
+
+    Pushing a key's deadline further away only updates its entry; the loop timer is re-armed
+    when the stale deadline fires.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop
+        # key -> [deadline, callback, timer handle]
+        self._entries: dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], None]):
+        """Call ``callback`` after ``delay`` seconds, replacing any pending deadline for ``key``."""
+        loop = self._loop or asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        entry = self._entries.get(key)
+        if entry is not None:
+            if deadline >= entry[2].when():
+                entry[0] = deadline
+                entry[1] = callback
+                return
+            entry[2].cancel()
+        self._entries[key] = [deadline, callback, loop.call_at(deadline, self._fire, key)]
+
+    def cancel(self, key: Hashable):
+        """Drop the pending deadline for ``key``, if any."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[2].cancel()
+
+    def _fire(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        loop = self._loop or asyncio.get_running_loop()
+        if entry[0] > loop.time():
+            # The deadline was pushed back: re-arm the timer at its current value
+            entry[2] = loop.call_at(entry[0], self._fire, key)
+            return
+        del self._entries[key]
+        try:
+            entry[1]()
+        except Exception as e:
+            logger.error(f"Error in scheduled callback: {e}")
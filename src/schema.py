@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Field:
+    """One smart meter quantity, from its sources to its column.
+
+    ``name`` is the table column, the ``Message`` attribute and the MQTT subtopic (the levels matched
+    by ``#`` in the topic templates). ``reading`` is the key of the same quantity in the gateway REST
+    JSON (a ``Reading`` field). A message is complete once all its ``required`` fields arrived; the
+    optional ones are stored when they arrived by then. ``deadband`` is the default change below
+    which ``DeadbandFilter`` considers the field unchanged. ``obis`` is the code of the quantity in a
+    DSMR P1 telegram, for the fields the meter reports itself (gas on M-Bus channel 1).
+    """
+
+    name: str
+    reading: Optional[str]
+    unit: str
+    required: bool = False
+    deadband: float = 0.0
+    obis: Optional[str] = None
+
+
+# Single definition of the stored fields. The table columns, the topic routing, the Message slots and
+# row encoding, the Reading mapping and the DSMR telegram codes are all derived from it. Fields are
+# only ever appended: the slot order is the column order of spooled rows.
+FIELDS = (
+    Field("electricity_delivered_1", "EnergyDeliveredTariff1", "kWh", required=True, obis="1-0:1.8.1"),
+    Field("electricity_delivered_2", "EnergyDeliveredTariff2", "kWh", required=True, obis="1-0:1.8.2"),
+    Field("electricity_returned_1", "EnergyReturnedTariff1", "kWh", required=True, obis="1-0:2.8.1"),
+    Field("electricity_returned_2", "EnergyReturnedTariff2", "kWh", required=True, obis="1-0:2.8.2"),
+    Field("electricity_currently_delivered", "PowerDelivered_total", "kW", required=True, deadband=0.01, obis="1-0:1.7.0"),
+    Field("electricity_currently_returned", "PowerReturned_total", "kW", required=True, deadband=0.01, obis="1-0:2.7.0"),
+    Field("phase_currently_delivered_l1", "PowerDelivered_l1", "kW", required=True, deadband=0.01, obis="1-0:21.7.0"),
+    Field("phase_currently_delivered_l2", "PowerDelivered_l2", "kW", required=True, deadband=0.01, obis="1-0:41.7.0"),
+    Field("phase_currently_delivered_l3", "PowerDelivered_l3", "kW", required=True, deadband=0.01, obis="1-0:61.7.0"),
+    Field("phase_voltage_l1", "Voltage_l1", "V", required=True, deadband=1.0, obis="1-0:32.7.0"),
+    Field("phase_voltage_l2", "Voltage_l2", "V", required=True, deadband=1.0, obis="1-0:52.7.0"),
+    Field("phase_voltage_l3", "Voltage_l3", "V", required=True, deadband=1.0, obis="1-0:72.7.0"),
+    Field("delivered", "GasDelivered", "m3", required=True, obis="0-1:24.2.1"),  # Gas
+    # Full-resolution capture: published by the gateway but not needed to complete a message
+    Field("phase_currently_returned_l1", "PowerReturned_l1", "kW", deadband=0.01, obis="1-0:22.7.0"),
+    Field("phase_currently_returned_l2", "PowerReturned_l2", "kW", deadband=0.01, obis="1-0:42.7.0"),
+    Field("phase_currently_returned_l3", "PowerReturned_l3", "kW", deadband=0.01, obis="1-0:62.7.0"),
+    Field("phase_power_current_l1", "Current_l1", "A", deadband=0.5, obis="1-0:31.7.0"),
+    Field("phase_power_current_l2", "Current_l2", "A", deadband=0.5, obis="1-0:51.7.0"),
+    Field("phase_power_current_l3", "Current_l3", "A", deadband=0.5, obis="1-0:71.7.0"),
+    Field("reactive_energy_delivered_1", "ReactiveEnergyDeliveredTariff1", "kvarh"),
+    Field("reactive_energy_delivered_2", "ReactiveEnergyDeliveredTariff2", "kvarh"),
+    Field("reactive_energy_returned_1", "ReactiveEnergyReturnedTariff1", "kvarh"),
+    Field("reactive_energy_returned_2", "ReactiveEnergyReturnedTariff2", "kvarh"),
+    Field("electricity_tariff", "ElectricityTariff", "", obis="0-0:96.14.0"),
+    Field("power_delivered_hour", "PowerDeliveredHour", "kW", deadband=0.01),
+    Field("power_delivered_netto", "PowerDeliveredNetto", "kW", deadband=0.01),
+    Field("gas_delivered_hour", "GasDeliveredHour", "m3"),
+)
+
+FIELDS_BY_NAME = {field.name: field for field in FIELDS}
+REQUIRED_FIELDS = tuple(field.name for field in FIELDS if field.required)
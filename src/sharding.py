@@ -0,0 +1,91 @@
+import zlib
+from typing import Iterable
+from .router import DEVICE_PLACEHOLDER
+
+SHARD_MODES = ("filter", "shared")
+
+
+def device_shard(device_id: str, shard_count: int) -> int:
+    """Stable shard of a device: the same on every replica and across restarts."""
+    return zlib.crc32(device_id.encode()) % shard_count
+
+
+class ShardAssignment:
+    """Which meters one ingester replica assembles and stores, out of ``count`` replicas.
+
+    All the subtopics of a meter must reach the same replica, or its ``Message`` is never complete.
+    Plain MQTT shared subscriptions balance individual publishes, so they would scatter a meter's
+    fields across replicas. The modes:
+
+    - ``"filter"``: every replica subscribes to all the topics and keeps the meters whose
+      ``device_shard`` is its ``index``. Assembly and database writes scale out; the network
+      traffic and the routing lookup are paid by every replica.
+    - ``"shared"``: the replicas subscribe as ``$share/<group>/<topic>`` and the broker splits
+      the traffic. Only device-affine if the broker pins each publisher to one subscriber
+      (e.g. EMQX ``hash_clientid`` with one gateway client per meter); otherwise expect
+      partial messages. No filtering is done, since each publish reaches a single replica.
+
+    If ``devices`` is given, the replica subscribes to the ``{device}`` level of those meters
+    only, so the broker does the filtering.
+    """
+
+    def __init__(
+        self,
+        index: int = 0,
+        count: int = 1,
+        mode: str = "filter",
+        group: str = "smart-meter",
+        devices: Iterable[str] = (),
+    ):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{mode}'. Use one of {SHARD_MODES}.")
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index {index} is out of range for {count} shards.")
+        self.index = index
+        self.count = count
+        self.mode = mode
+        self.group = group
+        self.devices = tuple(devices)
+        # Only the hash filter drops anything: shared and per-device subscriptions are split by the broker
+        self.filtering = count > 1 and mode == "filter" and not self.devices
+        self._owned: dict[str, bool] = {}
+
+    def subscriptions(self, topics: list[tuple[str, int]]) -> list[tuple[str, int]]:
+        """MQTT subscriptions for the ``{device}`` topic templates of this replica."""
+        subscriptions = []
+        for topic, qos in topics:
+            if not topic:
+                subscriptions.append((topic, qos))  # Reported as a configuration error on connect
+                continue
+            if self.devices and DEVICE_PLACEHOLDER in topic:
+                subscriptions += [(topic.replace(DEVICE_PLACEHOLDER, device), qos) for device in self.devices]
+                continue
+            topic = topic.replace(DEVICE_PLACEHOLDER, "+")
+            if self.mode == "shared":
+                topic = f"$share/{self.group}/{topic}"
+            subscriptions.append((topic, qos))
+        return subscriptions
+
+    def client_id(self, client_id: str) -> str:
+        """Per-replica MQTT client id: replicas sharing one id would keep taking over each other's session.
+
+        Suffixed with the shard index when sharded, and with a hash of the meters when subscribing
+        to a device list, so replicas configured with different lists get their own sessions.
+        """
+        if not client_id:
+            return client_id
+        suffixes = []
+        if self.count > 1 or self.mode == "shared":
+            suffixes.append(str(self.index))
+        if self.devices:
+            suffixes.append(f"{zlib.crc32(','.join(sorted(self.devices)).encode()):08x}")
+        return "-".join([client_id, *suffixes])
+
+    def owns(self, device_id: str) -> bool:
+        """Return True if this replica assembles the device's messages."""
+        if not self.filtering:
+            return True
+        owned = self._owned.get(device_id)
+        if owned is None:
+            owned = self._owned[device_id] = device_shard(device_id, self.count) == self.index
+        return owned
@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from .db import DBConnection
+from .metrics import DB_ERRORS
+from .mssg import Message
+from .logger import setup_logger, BASE_DIR
+
+logger = setup_logger(__name__)
+
+SPOOL_DIR = BASE_DIR / "spool"
+
+REPLAY_ERRORS = DB_ERRORS.labels("replay")
+
+
+def _encode(message: Message) -> str:
+    return json.dumps(message.as_row(), default=lambda value: value.isoformat())
+
+
+def _decode(payload: str) -> Message:
+    timestamp, *values = json.loads(payload)
+    if timestamp is not None:
+        timestamp = datetime.fromisoformat(timestamp)
+    return Message.from_row((timestamp, *values))
+
+
+# Shared with the async engine (see src/async_handler.py)
+def record_replayed(spool: "Spool", last_id: int, messages: list[Message]):
+    """Acknowledge a batch merged into the database, so it is not replayed again."""
+    spool.ack(last_id)
+    logger.info(f"Replayed {len(messages)} spooled messages. {len(spool)} left.")
+
+
+def record_replay_error(error: Exception, interval: float):
+    logger.warning(f"Spool replay failed, retrying in {interval} seconds: {error}")
+    REPLAY_ERRORS.inc()
+
+
+class Spool:
+    """Disk-backed, append-only spool (SQLite in WAL mode) for messages that could not reach the database.
+
+    The spool is bounded to ``max_rows`` messages; when it is full the oldest messages are discarded.
+    """
+
+    def __init__(self, path: Optional[str | Path] = None, max_rows: int = 2_000_000):
+        self.path = Path(path) if path is not None else SPOOL_DIR / "messages.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_rows = max_rows
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL);"
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM spool;").fetchone()[0]
+        if self._size:
+            logger.info(f"Spool '{self.path}' holds {self._size} messages pending replay.")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, messages: list[Message]):
+        """Append messages to the end of the spool, evicting the oldest ones if it is full."""
+        rows = [(_encode(message),) for message in messages]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN;")
+                self._conn.executemany("INSERT INTO spool (row) VALUES (?);", rows)
+                self._size += len(rows)
+
+                excess = self._size - self.max_rows
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?);",
+                        (excess,),
+                    )
+                    self._size -= excess
+                    logger.warning(f"Spool is full. Discarded the {excess} oldest messages.")
+
+    def peek(self, limit: int) -> tuple[int, list[Message]]:
+        """Return the id of the last message and up to ``limit`` of the oldest messages, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, row FROM spool ORDER BY id LIMIT ?;", (limit,)
+            ).fetchall()
+        if not rows:
+            return 0, []
+        return rows[-1][0], [_decode(row) for _, row in rows]
+
+    def ack(self, last_id: int):
+        """Remove every message up to and including ``last_id`` after it was replayed."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN;")
+                deleted = self._conn.execute("DELETE FROM spool WHERE id <= ?;", (last_id,)).rowcount
+                self._size -= deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolReplayer:
+    """Background thread that drains the spool into the database in large, idempotent batches.
+
+    Replay starts once ``ready`` is set, if given.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        db_handler: DBConnection,
+        batch_size: int = 5_000,
+        interval: float = 10.0,  # seconds between attempts when idle or the DB is down
+        ready: Optional[threading.Event] = None,
+    ):
+        self.spool = spool
+        self.db_handler = db_handler
+        self.batch_size = batch_size
+        self.interval = interval
+        self.ready = ready
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the replay thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the replay thread. Messages left in the spool are replayed on the next start."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while self.ready is not None and not self.ready.is_set():
+            if self._stop_event.wait(0.5):
+                return
+        while not self._stop_event.is_set():
+            if len(self.spool) == 0 or not self.replay_batch():
+                self._stop_event.wait(self.interval)
+
+    def replay_batch(self) -> bool:
+        """Replay the oldest batch from the spool. Returns False if nothing could be replayed."""
+        last_id, messages = self.spool.peek(self.batch_size)
+        if not messages:
+            return False
+        try:
+            self.db_handler.merge_messages(messages)
+        except Exception as e:
+            record_replay_error(e, self.interval)
+            return False
+        record_replayed(self.spool, last_id, messages)
+        return True
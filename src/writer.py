@@ -0,0 +1,261 @@
+import queue
+import threading
+from time import monotonic
+from typing import Callable, Optional
+from .db import DBConnection
+from .metrics import QUEUE_WAIT_SECONDS, DB_COMMIT_SECONDS, DB_MESSAGES_WRITTEN, DB_ERRORS
+from .mssg import Message
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+WRITE_ERRORS = DB_ERRORS.labels("write")
+
+OVERFLOW_POLICIES = ("block", "drop-oldest", "spill")
+
+
+# Shared with the async engine (see src/async_handler.py)
+def record_written(batch: list[tuple[float, Message]], started: float):
+    """Record the commit time of a written batch and how long its messages waited in the queue."""
+    committed = monotonic()
+    DB_COMMIT_SECONDS.observe(committed - started)
+    DB_MESSAGES_WRITTEN.inc(len(batch))
+    for enqueued, _ in batch:
+        QUEUE_WAIT_SECONDS.observe(committed - enqueued)
+    logger.debug(f"Flushed {len(batch)} messages to the database.")
+
+
+def record_write_error(batch: list[tuple[float, Message]], error: Exception):
+    logger.error(f"Error while flushing {len(batch)} messages: {error}")
+    WRITE_ERRORS.inc()
+
+
+def spill(spill_handler: Callable[[list[Message]], None], messages: list[Message]) -> bool:
+    """Hand messages to the spill handler. Returns False if that failed and they are lost."""
+    try:
+        spill_handler(messages)
+        return True
+    except Exception as e:
+        logger.error(f"Error while spilling {len(messages)} messages: {e}")
+        return False
+
+
+class BatchWriter:
+    """Write-behind ingestion queue drained into the database by a pool of writer workers.
+
+    Producers only enqueue; each worker flushes a batch when it reaches ``batch_size`` messages
+    or when its oldest message is ``max_age`` seconds old, whichever comes first.
+    When the bounded queue is full the ``overflow`` policy decides what happens:
+
+    - ``"block"``: the producer waits until a worker frees a slot.
+    - ``"drop-oldest"``: the oldest queued message is discarded to make room.
+    - ``"spill"``: the message is handed to ``spill_handler`` instead of being queued.
+
+    If a ``spill_handler`` is given, batches that fail to reach the database are spilled too.
+    Until ``ready`` is set (e.g. while the schema is being checked) the workers only buffer; what is
+    still queued if they are stopped before that is spilled. Once stopping, the first failed batch
+    or the ``stop`` timeout spills the rest of the queue too, instead of waiting on the database.
+    """
+
+    def __init__(
+        self,
+        db_handler: DBConnection,
+        batch_size: int = 500,
+        max_age: float = 1.0,  # seconds
+        max_pending: int = 10_000,
+        workers: int = 1,
+        overflow: str = "block",
+        spill_handler: Optional[Callable[[list[Message]], None]] = None,
+        ready: Optional[threading.Event] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'. Use one of {OVERFLOW_POLICIES}.")
+        if overflow == "spill" and spill_handler is None:
+            raise ValueError("The 'spill' overflow policy requires a spill_handler.")
+
+        self.db_handler = db_handler
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.workers = workers
+        self.overflow = overflow
+        self.spill_handler = spill_handler
+        self.ready = ready
+
+        # Messages are queued with the time they were added, to measure their wait until committed
+        self._queue: queue.Queue[tuple[float, Message]] = queue.Queue(maxsize=max_pending)
+        self._stop_event = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._in_flight: dict[int, list[Message]] = {}  # Batch being written by each worker
+        self._abandoned = False  # Past the stop timeout: the workers spill instead of writing
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "failed": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        """Start the writer worker threads."""
+        self._stop_event.clear()
+        self._abandoned = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f"batch-writer-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Flush whatever is pending and stop the worker threads.
+
+        What is not written within ``timeout`` seconds is spilled (or dropped without a
+        ``spill_handler``), including the batches still being written: replaying them is idempotent.
+        """
+        self._stop_event.set()
+        deadline = None if timeout is None else monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - monotonic()))
+        if any(thread.is_alive() for thread in self._threads):
+            with self._stats_lock:
+                self._abandoned = True
+                in_flight = [message for batch in self._in_flight.values() for message in batch]
+            logger.warning(f"Writers still busy after {timeout} seconds. Spilling the pending messages.")
+            self._spill_pending(in_flight)
+        self._threads = []
+
+    def add(self, message: Message):
+        """Queue a message to be written with the next batch, applying the overflow policy."""
+        item = (monotonic(), message)
+        if self.overflow == "block":
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self.overflow == "spill":
+                    self._spill([message])
+                    return
+                self._put_dropping_oldest(item)
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+
+    def stats(self) -> dict:
+        """Return the queue depth and the writer counters."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        stats["capacity"] = self._queue.maxsize
+        return stats
+
+    def depth(self) -> int:
+        """Return the number of queued messages."""
+        return self._queue.qsize()
+
+    def is_alive(self) -> bool:
+        """Check that no started worker thread died."""
+        return all(thread.is_alive() for thread in self._threads)
+
+    def _put_dropping_oldest(self, item: tuple[float, Message]):
+        while True:
+            try:
+                self._queue.get_nowait()
+                with self._stats_lock:
+                    self._stats["dropped"] += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _spill(self, messages: list[Message]):
+        spilled = spill(self.spill_handler, messages)
+        with self._stats_lock:
+            self._stats["spilled" if spilled else "dropped"] += len(messages)
+
+    def _run(self):
+        while self.ready is not None and not self.ready.wait(0.5):
+            if self._stop_event.is_set():
+                self._spill_pending()
+                return
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self._stats_lock:
+                abandoned = self._abandoned
+                if not abandoned:
+                    self._in_flight[threading.get_ident()] = [message for _, message in batch]
+            if abandoned:
+                self._spill_pending([message for _, message in batch])
+                return
+            written = self._flush(batch)
+            with self._stats_lock:
+                self._in_flight.pop(threading.get_ident(), None)
+            if not written and self._stop_event.is_set():
+                # The database is unreachable: do not wait on it for every queued batch
+                self._spill_pending()
+                return
+
+    def _spill_pending(self, messages: Optional[list[Message]] = None):
+        """Spill the given messages and whatever is still queued (drop them without a spill handler)."""
+        messages = list(messages or [])
+        while True:
+            try:
+                messages.append(self._queue.get_nowait()[1])
+            except queue.Empty:
+                break
+        if not messages:
+            return
+        if self.spill_handler is not None:
+            self._spill(messages)
+        else:
+            logger.error(f"Dropping {len(messages)} messages: stopped before they could be written.")
+            with self._stats_lock:
+                self._stats["dropped"] += len(messages)
+
+    def _next_batch(self) -> list[tuple[float, Message]]:
+        """Block until a batch is full or the oldest message in it reached max_age."""
+        try:
+            batch = [self._queue.get(timeout=self.max_age)]
+        except queue.Empty:
+            return []
+
+        deadline = monotonic() + self.max_age
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list[tuple[float, Message]]) -> bool:
+        """Write a batch, or spill it if that fails. Returns True if it was written."""
+        started = monotonic()
+        try:
+            self.db_handler.save_messages([message for _, message in batch])
+            record_written(batch, started)
+            with self._stats_lock:
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+            return True
+        except Exception as e:
+            record_write_error(batch, e)
+            with self._stats_lock:
+                self._stats["failed"] += len(batch)
+            if self.spill_handler is not None:
+                self._spill([message for _, message in batch])
+            return False